@@ -4,8 +4,10 @@ import os
 import shutil
 import errno
 import numpy as np
+import math
 import sys
 from pathlib import Path
+from collections import OrderedDict
 import platform
 from packaging import version
 
@@ -250,6 +252,496 @@ def windDirectionFromXY(windSpeedEast, windSpeedNorth):
     
     return radAngle
 
+# Java source of the H2 functions writing the result of a query as binary
+# column files (returns the name and the NumPy type of each column)...
+BINARY_WRITE_SOURCE = """
+import java.sql.*;
+import java.nio.*;
+import java.nio.channels.FileChannel;
+import java.nio.file.*;
+@CODE
+String binaryWrite(Connection conn, String basePath, String query) throws Exception {
+    Statement statement = conn.createStatement();
+    ResultSet rs = statement.executeQuery(query);
+    ResultSetMetaData meta = rs.getMetaData();
+    int n = meta.getColumnCount();
+    boolean[] isInteger = new boolean[n];
+    FileChannel[] channels = new FileChannel[n];
+    ByteBuffer[] buffers = new ByteBuffer[n];
+    StringBuilder description = new StringBuilder();
+    for (int i = 0; i < n; i++) {
+        int type = meta.getColumnType(i + 1);
+        isInteger[i] = (type == Types.INTEGER || type == Types.SMALLINT || type == Types.TINYINT)
+                       && meta.isNullable(i + 1) == ResultSetMetaData.columnNoNulls;
+        channels[i] = FileChannel.open(Paths.get(basePath + "_" + i + ".bin"),
+                                       StandardOpenOption.CREATE,
+                                       StandardOpenOption.WRITE,
+                                       StandardOpenOption.TRUNCATE_EXISTING);
+        buffers[i] = ByteBuffer.allocateDirect(1 << 16).order(ByteOrder.LITTLE_ENDIAN);
+        description.append(i == 0 ? "" : ",").append(meta.getColumnLabel(i + 1))
+                   .append(isInteger[i] ? ":<i4" : ":<f8");
+    }
+    while (rs.next()) {
+        for (int i = 0; i < n; i++) {
+            if (buffers[i].remaining() < 8) {
+                buffers[i].flip();
+                while (buffers[i].hasRemaining()) channels[i].write(buffers[i]);
+                buffers[i].clear();
+            }
+            if (isInteger[i]) {
+                int value = rs.getInt(i + 1);
+                if (rs.wasNull()) {
+                    throw new SQLException("NULL value in the column " + meta.getColumnLabel(i + 1));
+                }
+                buffers[i].putInt(value);
+            } else {
+                double value = rs.getDouble(i + 1);
+                buffers[i].putDouble(rs.wasNull() ? Double.NaN : value);
+            }
+        }
+    }
+    for (int i = 0; i < n; i++) {
+        buffers[i].flip();
+        while (buffers[i].hasRemaining()) channels[i].write(buffers[i]);
+        channels[i].close();
+    }
+    rs.close();
+    statement.close();
+    return description.toString();
+}
+"""
+# ...and inserting binary column files into an existing table (NaN values 
+# are NULL), the files being memory-mapped and the rows inserted by batches
+BINARY_READ_SOURCE = """
+import java.sql.*;
+import java.nio.*;
+import java.nio.channels.FileChannel;
+import java.nio.file.*;
+@CODE
+int binaryRead(Connection conn, String tableName, String basePath, String description) throws Exception {
+    String[] columns = description.split(",");
+    int n = columns.length;
+    boolean[] isInteger = new boolean[n];
+    ByteBuffer[] buffers = new ByteBuffer[n];
+    StringBuilder parameters = new StringBuilder();
+    for (int i = 0; i < n; i++) {
+        isInteger[i] = columns[i].substring(columns[i].lastIndexOf(":") + 1).equals("<i4");
+        FileChannel channel = FileChannel.open(Paths.get(basePath + "_" + i + ".bin"),
+                                               StandardOpenOption.READ);
+        buffers[i] = channel.map(FileChannel.MapMode.READ_ONLY, 0, channel.size())
+                            .order(ByteOrder.LITTLE_ENDIAN);
+        channel.close();
+        parameters.append(i == 0 ? "?" : ", ?");
+    }
+    int nbRows = buffers[0].capacity() / (isInteger[0] ? 4 : 8);
+    PreparedStatement statement = conn.prepareStatement("INSERT INTO " + tableName
+                                                        + " VALUES (" + parameters + ")");
+    for (int r = 0; r < nbRows; r++) {
+        for (int i = 0; i < n; i++) {
+            if (isInteger[i]) {
+                statement.setInt(i + 1, buffers[i].getInt());
+            } else {
+                long bits = buffers[i].getLong();
+                if (bits == NULL_BITSL) {
+                    statement.setNull(i + 1, Types.DOUBLE);
+                } else {
+                    statement.setDouble(i + 1, Double.longBitsToDouble(bits));
+                }
+            }
+        }
+        statement.addBatch();
+        if ((r + 1) % 10000 == 0) {
+            statement.executeBatch();
+        }
+    }
+    statement.executeBatch();
+    statement.close();
+    return nbRows;
+}
+""".replace("NULL_BITS", "0x{0:X}".format(BINARY_NULL_BITS))
+# ...and returning the result of a query as one packed little-endian binary
+# value per column (one row per column of the query)
+BULK_FETCH_SOURCE = """
+import java.sql.*;
+import java.nio.*;
+import java.io.ByteArrayOutputStream;
+import org.h2.tools.SimpleResultSet;
+@CODE
+ResultSet bulkFetch(Connection conn, String query) throws Exception {
+    SimpleResultSet output = new SimpleResultSet();
+    output.addColumn("NAME", Types.VARCHAR, 0, 0);
+    output.addColumn("TYPE", Types.VARCHAR, 0, 0);
+    output.addColumn("DATA", Types.VARBINARY, 0, 0);
+    if (conn.getMetaData().getURL().equals("jdbc:columnlist:connection")) {
+        return output;
+    }
+    Statement statement = conn.createStatement();
+    ResultSet rs = statement.executeQuery(query);
+    ResultSetMetaData meta = rs.getMetaData();
+    int n = meta.getColumnCount();
+    boolean[] isInteger = new boolean[n];
+    ByteArrayOutputStream[] streams = new ByteArrayOutputStream[n];
+    for (int i = 0; i < n; i++) {
+        int type = meta.getColumnType(i + 1);
+        isInteger[i] = (type == Types.INTEGER || type == Types.SMALLINT || type == Types.TINYINT)
+            && meta.isNullable(i + 1) == ResultSetMetaData.columnNoNulls;
+        streams[i] = new ByteArrayOutputStream();
+    }
+    ByteBuffer buffer = ByteBuffer.allocate(8).order(ByteOrder.LITTLE_ENDIAN);
+    while (rs.next()) {
+        for (int i = 0; i < n; i++) {
+            buffer.clear();
+            if (isInteger[i]) {
+                int value = rs.getInt(i + 1);
+                if (rs.wasNull()) {
+                    throw new SQLException("NULL value in the column " + meta.getColumnLabel(i + 1));
+                }
+                buffer.putInt(value);
+            } else {
+                double value = rs.getDouble(i + 1);
+                buffer.putDouble(rs.wasNull() ? Double.NaN : value);
+            }
+            streams[i].write(buffer.array(), 0, buffer.position());
+        }
+    }
+    for (int i = 0; i < n; i++) {
+        output.addRow(meta.getColumnLabel(i + 1), isInteger[i] ? "<i4" : "<f8",
+                      streams[i].toByteArray());
+    }
+    rs.close();
+    statement.close();
+    return output;
+}
+"""
+
+def createBinaryExchangeFunctions(cursor):
+    """
+    Create the H2 functions used to exchange tables between H2GIS and Python
+    as binary column files. The Java sources are compiled by H2 (a Java 
+    compiler is needed): if the functions are not created, CSV files are used.
+    
+    Parameters
+    _ _ _ _ _ _ _ _ _ _ 
+        cursor: conn.cursor
+            A cursor object, used to perform spatial SQL queries
+    
+    Returns
+    -------
+        None
+    """
+    cursor.execute("""
+        DROP ALIAS IF EXISTS {0};
+        CREATE ALIAS {0} AS $${1}$$;
+        DROP ALIAS IF EXISTS {2};
+        CREATE ALIAS {2} AS $${3}$$;
+        DROP ALIAS IF EXISTS {4};
+        CREATE ALIAS {4} AS $${5}$$;
+        """.format(BINARY_WRITE_FUNCTION, BINARY_WRITE_SOURCE,
+                   BINARY_READ_FUNCTION, BINARY_READ_SOURCE,
+                   BULK_FETCH_FUNCTION, BULK_FETCH_SOURCE))
+
+def isFunctionMissing(error, functionName):
+    """
+    Whether an error raised by H2 through the cursor is due to a function 
+    not created in the database (H2 error code 90022), e.g. when the Java
+    sources of the binary exchange functions could not be compiled.
+    
+    Parameters
+    _ _ _ _ _ _ _ _ _ _ 
+        error: Exception
+            Error raised when executing the query
+        functionName: String
+            Name of the function called by the query
+    
+    Returns
+    -------
+        Boolean
+    """
+    message = str(error)
+    return "90022" in message and functionName.upper() in message.upper()
+
+def isIntegerColumn(columnDescription):
+    """
+    Whether a column of a query result is exchanged as int32: INTEGER, 
+    SMALLINT or TINYINT column (precision <= 10) declared as not nullable,
+    the same rule being used by the binary exchange functions.
+    
+    Parameters
+    _ _ _ _ _ _ _ _ _ _ 
+        columnDescription: tuple
+            Description of the column given by the cursor (name, type, 
+            display size, internal size, precision, scale, nullable)
+    
+    Returns
+    -------
+        Boolean
+    """
+    precision, nullable = columnDescription[4], columnDescription[6]
+    return nullable == 0 and precision is not None and precision <= 10
+
+def readQueryColumns(cursor, query, filePathBase):
+    """
+    Get the result of a query from H2GIS as one array per column. The result
+    is written by H2 as binary column files (little-endian int32 or float64),
+    memory-mapped in Python, or as a CSV file if the binary exchange is not
+    available.
+    
+    Parameters
+    _ _ _ _ _ _ _ _ _ _ 
+        cursor: conn.cursor
+            A cursor object, used to perform spatial SQL queries
+        query: String
+            SELECT query whose result is needed in Python
+        filePathBase: String
+            Path (without extension) of the file(s) used for the exchange
+    
+    Returns
+    -------
+        OrderedDict having the column names as keys and the 1D arrays of
+        values as values (int32 for the integer columns which can not be NULL,
+        float64 otherwise, NaN standing for NULL values)
+    """
+    description = None
+    if BINARY_EXCHANGE:
+        try:
+            cursor.execute("""CALL {0}('{1}', '{2}')
+                           """.format(BINARY_WRITE_FUNCTION,
+                                      filePathBase,
+                                      query.replace("'", "''")))
+            description = cursor.fetchall()[0][0]
+        except Exception as error:
+            if not isFunctionMissing(error, BINARY_WRITE_FUNCTION):
+                raise
+            print("{0} not available, a CSV file is used".format(BINARY_WRITE_FUNCTION))
+        if description:
+            columns = OrderedDict()
+            for i, column in enumerate(description.split(",")):
+                name, dtype = column.rsplit(":", 1)
+                filePath = "{0}_{1}.bin".format(filePathBase, i)
+                if os.path.getsize(filePath) == 0:
+                    columns[name] = np.zeros(0, dtype = dtype)
+                else:
+                    columns[name] = np.memmap(filePath, dtype = dtype, mode = "r")
+            return columns
+    
+    cursor.execute("""CALL CSVWRITE('{0}', '{1}', 'charset=UTF-8 fieldSeparator=,')
+                   """.format(filePathBase + ".csv",
+                              query.replace("'", "''")))
+    df = pd.read_csv(filePathBase + ".csv", header = 0)
+    # Same types as the binary files (the columns are described by the
+    # query without any row)
+    cursor.execute("SELECT * FROM ({0}) LIMIT 0".format(query))
+    columns = OrderedDict()
+    for c, d in zip(df.columns, cursor.description):
+        if isIntegerColumn(d) and np.issubdtype(df[c].dtype, np.integer):
+            columns[c] = df[c].values.astype(np.int32)
+        else:
+            columns[c] = df[c].values.astype(np.float64)
+    
+    return columns
+
+def fetchColumns(cursor, query, connection = None):
+    """
+    Fetch the result of a query as one NumPy array per column. H2 packs each
+    column into a single binary value, obtained through JPype as a Java
+    primitive array and copied at once into NumPy (no Python object is
+    created per value). Falls back to a row-wise fetch if the connection is
+    not given or if the function is not available.
+    
+    Parameters
+    _ _ _ _ _ _ _ _ _ _ 
+        cursor: conn.cursor
+            A cursor object, used to perform spatial SQL queries
+        query: String
+            SELECT query whose result is needed in Python
+        connection: jaydebeapi.Connection, default None
+            Connection of the cursor, whose JDBC connection is used to call
+            the bulk fetch function
+    
+    Returns
+    -------
+        OrderedDict having the column names as keys and the 1D arrays of
+        values as values (int32 for the integer columns which can not be NULL,
+        float64 otherwise, NaN standing for NULL values)
+    """
+    if BINARY_EXCHANGE and connection is not None:
+        statement = connection.jconn.createStatement()
+        try:
+            rs = statement.executeQuery("SELECT * FROM {0}('{1}')"\
+                                        .format(BULK_FETCH_FUNCTION,
+                                                query.replace("'", "''")))
+            columns = OrderedDict()
+            while rs.next():
+                columns[str(rs.getString(1))] = \
+                    np.frombuffer(memoryview(rs.getBytes(3)),
+                                  dtype = str(rs.getString(2))).copy()
+            return columns
+        except Exception as error:
+            if not isFunctionMissing(error, BULK_FETCH_FUNCTION):
+                raise
+            print("{0} not available, the rows are fetched".format(BULK_FETCH_FUNCTION))
+        finally:
+            statement.close()
+    
+    cursor.execute(query)
+    description = cursor.description
+    rows = cursor.fetchall()
+    columns = OrderedDict()
+    for i, d in enumerate(description):
+        values = [row[i] for row in rows]
+        # Same types as the bulk fetch
+        if isIntegerColumn(d) and all(type(v) is int for v in values):
+            columns[d[0]] = np.array(values, dtype = np.int32)
+        else:
+            columns[d[0]] = np.array([np.nan if v is None else v for v in values],
+                                     dtype = np.float64)
+    
+    return columns
+
+def writeTableColumns(cursor, tableName, columns, filePathBase):
+    """
+    Create an H2GIS table from arrays of values (one per column). The arrays
+    are written as binary column files (little-endian int32 for integer
+    arrays, float64 otherwise) inserted by batches into the table by H2, or
+    as a CSV file if the binary exchange is not available.
+    
+    Parameters
+    _ _ _ _ _ _ _ _ _ _ 
+        cursor: conn.cursor
+            A cursor object, used to perform spatial SQL queries
+        tableName: String
+            Name of the table to create (replaced if exists)
+        columns: OrderedDict
+            Column names as keys and 1D arrays of values as values (NaN 
+            float values are NULL, except for masked arrays whose masked
+            values are NULL and whose NaN values are kept as NaN)
+        filePathBase: String
+            Path (without extension) of the file(s) used for the exchange
+    
+    Returns
+    -------
+        None
+    """
+    types = ["<i4" if np.issubdtype(columns[c].dtype, np.integer) else "<f8"
+                 for c in columns]
+    columnDefinition = ", ".join(["{0} {1}".format(c, "INTEGER NOT NULL" if t == "<i4" else "DOUBLE")
+                                      for c, t in zip(columns, types)])
+    isNull = {c: np.ma.getmaskarray(columns[c]) if np.ma.isMaskedArray(columns[c])
+                     else np.isnan(columns[c])
+                  for c, t in zip(columns, types) if t == "<f8"}
+    if BINARY_EXCHANGE:
+        description = ",".join(["{0}:{1}".format(c, t) for c, t in zip(columns, types)])
+        for i, (c, t) in enumerate(zip(columns, types)):
+            values = np.array(np.ma.getdata(columns[c]), dtype = t)
+            if t == "<f8":
+                values.view("<i8")[isNull[c]] = BINARY_NULL_BITS
+            values.tofile("{0}_{1}.bin".format(filePathBase, i))
+        try:
+            cursor.execute("""
+                DROP TABLE IF EXISTS {0};
+                CREATE TABLE {0}({1});
+                CALL {2}('{0}', '{3}', '{4}');
+                """.format(tableName, columnDefinition, BINARY_READ_FUNCTION,
+                           filePathBase, description))
+            return
+        except Exception as error:
+            if not isFunctionMissing(error, BINARY_READ_FUNCTION):
+                raise
+            print("{0} not available, a CSV file is used".format(BINARY_READ_FUNCTION))
+    
+    # NULL values as empty fields, NaN values as read by Java
+    csvColumns = OrderedDict()
+    for c, t in zip(columns, types):
+        csvColumns[c] = np.ma.getdata(columns[c])
+        if t == "<f8":
+            text = csvColumns[c].astype(np.float64).astype(str)
+            for value, javaValue in [("nan", "NaN"), ("inf", "Infinity"), ("-inf", "-Infinity")]:
+                text[text == value] = javaValue
+            text[isNull[c]] = ""
+            csvColumns[c] = text
+    pd.DataFrame(csvColumns).to_csv(filePathBase + ".csv", index = False)
+    cursor.execute("""
+        DROP TABLE IF EXISTS {0};
+        CREATE TABLE {0}({1})
+            AS SELECT {2} FROM CSVREAD('{3}');
+        """.format(tableName, columnDefinition, ", ".join(columns),
+                   filePathBase + ".csv"))
+
+def getLevelThicknesses(topHeight, dz = DZ, stretchRatio = DZ_STRETCH_RATIO,
+                        stretchHeight = None):
+    """
+    Calculates the thickness of each vertical level of the grid (ground
+    excluded). The levels have a dz thickness up to the stretching height,
+    then each level is 'stretchRatio' times thicker than the one below. Only
+    the levels entirely located below the top height are kept.
+    
+    Parameters
+    _ _ _ _ _ _ _ _ _ _ 
+        topHeight: float
+            Height of the top of the grid (m)
+        dz: float, default DZ
+            Thickness (in meter) of the levels below the stretching height
+        stretchRatio: float, default DZ_STRETCH_RATIO
+            Ratio between the thicknesses of two consecutive levels above
+            the stretching height
+        stretchHeight: float, default None
+            Height (m) above which the levels are stretched (usually the
+            highest obstacle height). If None, the grid is uniform
+    
+    Returns
+    -------
+        np.array of the level thicknesses (m), from the lowest level
+    """
+    nbLevels = math.trunc(topHeight / dz)
+    if stretchRatio == 1 or stretchHeight is None:
+        return np.full(nbLevels, float(dz))
+    
+    # Uniform levels up to the first level starting above the stretching height
+    nbUniform = min(math.ceil(stretchHeight / dz), nbLevels)
+    thicknesses = [float(dz)] * nbUniform
+    bottom = nbUniform * dz
+    thickness = float(dz) * stretchRatio
+    while bottom + thickness <= topHeight:
+        thicknesses.append(thickness)
+        bottom += thickness
+        thickness *= stretchRatio
+    
+    return np.array(thicknesses)
+
+def getLevelHeights(topHeight, dz = DZ, stretchRatio = DZ_STRETCH_RATIO,
+                    stretchHeight = None):
+    """
+    Calculates the height of the center of each vertical level of the grid
+    (ground excluded, see getLevelThicknesses for the level definition).
+    
+    Parameters
+    _ _ _ _ _ _ _ _ _ _ 
+        topHeight: float
+            Height of the top of the grid (m)
+        dz: float, default DZ
+            Thickness (in meter) of the levels below the stretching height
+        stretchRatio: float, default DZ_STRETCH_RATIO
+            Ratio between the thicknesses of two consecutive levels above
+            the stretching height
+        stretchHeight: float, default None
+            Height (m) above which the levels are stretched. If None, the
+            grid is uniform
+    
+    Returns
+    -------
+        np.array of the level center heights (m), from the lowest level
+    """
+    if stretchRatio == 1 or stretchHeight is None:
+        return np.arange(float(dz)/2,
+                         float(dz)/2+math.trunc(topHeight/dz)*dz,
+                         dz)
+    thicknesses = getLevelThicknesses(topHeight = topHeight,
+                                      dz = dz,
+                                      stretchRatio = stretchRatio,
+                                      stretchHeight = stretchHeight)
+    
+    return np.cumsum(thicknesses) - thicknesses / 2
+
 def getExtremumPoint(pointsTable, axis, extremum, secondAxisExtremum, cursor, prefix_name):
     """ Identify the point geometry being an extremum ("MIN" or "MAX"") of a polygon
     along a given axis ("X" or "Y"). If two points are at the same "X" (or "Y"),
@@ -44,7 +44,28 @@ DELETE_OUTPUT_IF_EXISTS = True
 # VEGETATION_FILENAME = "vegetation.shp"
 # CAD_TRIANGLE_FILENAME = "AllTriangles.shp"
 # CAD_VEG_INTERSECTION_FILENAME = "treesIntersection.shp"
-TEMPO_HORIZ_WIND_FILE = "tempo_horiz_wind.csv"
+TEMPO_HORIZ_WIND_FILE = "tempo_horiz_wind"
+# Large tables are exchanged between H2GIS and Python as binary column files
+# (little-endian int32 / float64, memory-mapped on the Python side) if 
+# BINARY_EXCHANGE is True and the Java environment can compile the exchange
+# functions (CSV files otherwise). Experimental: not yet validated on a
+# complete H2GIS calculation
+BINARY_EXCHANGE = False
+BINARY_WRITE_FUNCTION = "UROCK_BINARY_WRITE"
+BINARY_READ_FUNCTION = "UROCK_BINARY_READ"
+# Bits of the float64 NaN standing for NULL values in the binary column files
+# written by Python (any other NaN value is inserted as NaN)
+BINARY_NULL_BITS = 0x7FF8000000000001
+# Query results fetched in Python as one packed binary value per column
+# (converted to NumPy through JPype without per-value Python objects)
+BULK_FETCH_FUNCTION = "UROCK_BULK_FETCH"
+# Engine calculating the 3D wind speed factors of the building Röckle zones:
+#   - "numpy": the 2D zone point attributes are loaded from H2GIS and the
+#   factors are calculated in Python for each vertical level as arrays
+#   - "sql": cross join of the 2D zone points with the vertical levels in H2GIS
+# (the "numpy" engine gives NULL where the SQL one gives NaN and has not yet
+# been compared table by table to the SQL engine on a real case)
+BUILD_WIND_FACTOR_ENGINE = "sql"
 # Output files
 OUTPUT_FILENAME = "UROCK_OUTPUT"
 OUTPUT_RASTER_EXTENSION = ".GTiff"
@@ -77,6 +98,119 @@ ONLY_INITIALIZATION = False
 SAVE_ROCKLE_ZONES = False
 MAX_ITERATIONS = 500      # Based on QUIC-URB default values (2021)
 THRESHOLD_ITERATIONS = 1e-4 # Based on QUIC-URB default values (2021)
+# Method used to solve the lambda equation within the wind solver:
+#   - "sor": lexicographic successive over-relaxation (single thread)
+#   - "red-black": checkerboard ordered successive over-relaxation (multi-threads)
+#   - "multigrid": geometric multigrid V-cycles using red-black relaxation as smoother
+#   - "pcg": preconditioned conjugate gradient applied to the sparse matrix of the equation
+#   - "zline": vertical line successive over-relaxation (columns solved at once
+#   with the Thomas algorithm, multi-threads), for grids having dz much smaller than dx
+#   - "schwarz": overlapping domain decomposition (tiles of the horizontal plane
+#   relaxed in parallel processes sharing the 3D fields), for very large grids
+SOLVER_METHOD = "sor"
+# Number of threads used by the parallel solver kernels (None: all available)
+SOLVER_NB_THREADS = None
+# If True, the "sor" and "red-black" methods sweep directly the 3D grid
+# instead of a list of the coordinates of the cells to solve (less memory,
+# contiguous memory access)
+SOLVER_DENSE_SWEEP = False
+# Number of iterations between two checks of the solver convergence criterion
+# (the variation of lambda is only summed during the iterations where it is checked)
+CONVERGENCE_CHECK_INTERVAL = 1
+# Minimum time (s) between two messages about the progress of the solver iterations
+SOLVER_LOG_INTERVAL = 5
+# Relaxation factor of the "sor", "red-black" and "zline" methods:
+#   - "fixed": calculated from the horizontal grid size only (from the grid
+#   size and the vertical coupling for the "zline" method)
+#   - "adaptive": updated every OMEGA_ADAPT_ITERATIONS iterations from the observed
+#   convergence rate (until it increases by less than OMEGA_ADAPT_TOLERANCE)
+#   - "chebyshev": Chebyshev acceleration of the "red-black" and "zline" methods
+SOLVER_OMEGA_METHOD = "fixed"
+OMEGA_ADAPT_ITERATIONS = 10
+OMEGA_ADAPT_TOLERANCE = 0.01
+# Upper bound of the Jacobi spectral radius estimates (omega stays lower than 1.98)
+OMEGA_MAX_JACOBI_RADIUS = 0.99995
+# Domain decomposition of the "schwarz" method: number of processes (one tile
+# per process, None: number of CPUs), number of cells overlapping the neighbouring
+# tiles, number of sweeps of each tile between two exchanges of the overlapping 
+# cells and method used to start the processes ("spawn" does not duplicate the 
+# threads of the main process)
+DECOMPOSITION_NB_PROCESSES = None
+DECOMPOSITION_HALO_SIZE = 4
+DECOMPOSITION_INNER_ITERATIONS = 10
+DECOMPOSITION_START_METHOD = "spawn"
+# Checkpoints of the wind solver (opt-in): if SOLVER_CHECKPOINT is True, the
+# state of the wind solver (lambda and iteration number) is written in the 
+# temporary directory every CHECKPOINT_INTERVAL iterations (one 3D field
+# written to disk each time) and when the calculation is canceled. An
+# interrupted calculation of the same case (same geometry and initial wind
+# field) is then resumed from its last checkpoint when it is launched again,
+# including the checkpoint left by a killed run: remove the CHECKPOINT_PREFIX
+# files of the temporary directory to start from scratch
+SOLVER_CHECKPOINT = False
+CHECKPOINT_PREFIX = "urock_checkpoint_"
+CHECKPOINT_INTERVAL = 50
+# Nested iteration: if greater than 1, the wind solver is first applied to a grid
+# NESTED_ITERATION_FACTOR times coarser (horizontally and vertically), the coarse
+# lambda field being interpolated as initial guess of the full resolution solver
+NESTED_ITERATION_FACTOR = 1
+# Active-set mode of the "sor" and "red-black" methods (None to solve all cells):
+# only the cells located at less than ACTIVE_SET_DISTANCE cells from a cell where
+# the initial wind field is divergent (more than ACTIVE_SET_TOLERANCE times the 
+# maximum divergence) are solved. Every ACTIVE_SET_UPDATE_INTERVAL iterations,
+# the active cells are extended around the cells where lambda is greater than 
+# ACTIVE_SET_TOLERANCE times its maximum (the error on the wind speed being roughly
+# proportional to ACTIVE_SET_TOLERANCE). e.g. ACTIVE_SET_DISTANCE = 4
+ACTIVE_SET_DISTANCE = None
+ACTIVE_SET_TOLERANCE = 1e-3
+ACTIVE_SET_UPDATE_INTERVAL = 10
+# Compile (or load from the numba cache) the solver kernels for the PRECISION
+# of the 3D wind fields in the background, once per session when the plugin
+# is loaded (the first calculation starts solving immediately)
+KERNEL_WARM_UP = True
+# Out-of-core mode: the 3D wind fields (initial, solved and rotated) and the
+# lambda buffers are allocated as memory-mapped files of the temporary 
+# directory. The vectorized calculations are made by slabs of
+# OUT_OF_CORE_SLAB_SIZE cells along X. The obstacle flags of the solver (one 
+# byte per cell) and the coordinates of the cells solved (12 bytes per cell,
+# not stored with SOLVER_DENSE_SWEEP) stay in RAM: use the "sor", "red-black"
+# or "zline" method with the dense sweep to keep the memory needed to about
+# one byte per cell
+OUT_OF_CORE = False
+OUT_OF_CORE_SLAB_SIZE = 16
+# Multigrid parameters: number of relaxations before and after each coarse grid
+# correction, number of relaxations on the coarsest level and minimum number
+# of (non boundary) cells along each axis of the coarsest level
+MULTIGRID_PRE_SMOOTHING = 2
+MULTIGRID_POST_SMOOTHING = 2
+MULTIGRID_COARSEST_SMOOTHING = 50
+MULTIGRID_MIN_CELLS = 3
+# Preconditioner used by the "pcg" method ("jacobi", "ssor" or "ic") and 
+# threshold for stopping the "pcg" method: when the true relative residual
+# norm ||rhs - L.lambda|| / ||rhs|| goes under this threshold, the solver stops
+PCG_PRECONDITIONER = "ic"
+PCG_RESIDUAL_THRESHOLD = 1e-6
+# Number of geometries (building coordinates, wind direction and grid resolution)
+# for which the wind solver operator (obstacle flags, sparse matrix, preconditioners, 
+# multigrid levels) is kept in memory to be reused by the next calculations
+# (opt-in: 0 deactivates the cache, whose arrays are otherwise kept in the
+# memory of the QGIS process between two calculations)
+SOLVER_CACHE_SIZE = 0
+# Floating point precision of the 3D wind fields ("float64" or "float32"): 
+# "float32" halves the memory used by the initialization, the solver and the
+# outputs (the solver convergence criterion is still accumulated in "float64")
+PRECISION = "float64"
+# Warm start of the wind solver (opt-in): the converged lambda field is saved
+# into the temporary directory and used as initial guess by the next 
+# calculations on the same grid (same geometry or wind direction differing by
+# less than LAMBDA_CACHE_MAX_ANGLE degrees). LAMBDA_CACHE_SIZE lambda files
+# (one 3D field each) are kept at most on disk. The initial wind field is
+# hashed to identify each case and the convergence criterion is then relative
+# to the lambda guess, thus the results may slightly differ from a cold start
+WARM_START = False
+LAMBDA_CACHE_PREFIX = "urock_lambda_"
+LAMBDA_CACHE_MAX_ANGLE = 10
+LAMBDA_CACHE_SIZE = 10
 
 # Note that the number of points of an ellipse is only used to identify whether
 # the upper or lower part of an ellipse should be used (fro displacement zones),
@@ -86,6 +220,10 @@ THRESHOLD_ITERATIONS = 1e-4 # Based on QUIC-URB default values (2021)
 NPOINTS_ELLIPSE = 100
 MESH_SIZE = 2
 DZ = 2
+# Ratio between the thicknesses of two consecutive vertical levels above the
+# highest obstacle (1 for a uniform vertical grid, e.g. 1.2 to keep the grid
+# fine up to the roofs and to reach the top of the sketch with fewer levels)
+DZ_STRETCH_RATIO = 1.
 ALONG_WIND_ZONE_EXTEND = 60
 CROSS_WIND_ZONE_EXTEND = 40
 VERTICAL_EXTEND = 20
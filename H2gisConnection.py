@@ -12,7 +12,7 @@ import os
 import urllib3
 from . import DataUtil
 from .GlobalVariables import INSTANCE_NAME, INSTANCE_ID, INSTANCE_PASS, NEW_DB,\
-    JAVA_PATH_FILENAME, TEMPO_DIRECTORY
+    JAVA_PATH_FILENAME, TEMPO_DIRECTORY, BINARY_EXCHANGE
 import subprocess
 import re
 import pandas as pd
@@ -90,7 +90,8 @@ def downloadH2gis(dbDirectory):
            
 def startH2gisInstance(dbDirectory, dbInstanceDir = TEMPO_DIRECTORY, 
                        instanceName = INSTANCE_NAME, instanceId=INSTANCE_ID, 
-                       instancePass = INSTANCE_PASS, newDB = NEW_DB):
+                       instancePass = INSTANCE_PASS, newDB = NEW_DB,
+                       returnConnection = False):
     """ Start an H2GIS spatial database instance (used for Röckle zone calculation)
     For more information about use with Python: https://github.com/orbisgis/h2gis/wiki/4.4-Use-H2GIS-with-Python
 
@@ -110,12 +111,17 @@ def startH2gisInstance(dbDirectory, dbInstanceDir = TEMPO_DIRECTORY,
             newDB: Boolean, default NEW_DB
                 Whether or not all existing 'public' tables should be deleted
                 (if the DB already exists)
+            returnConnection: Boolean, default False
+                Whether or not the connection is also returned (its JDBC
+                connection 'jconn' is used to fetch large query results)
         
 		Returns
 		_ _ _ _ _ _ _ _ _ _ 
 
             cur: conn.cursor
-                A cursor object, used to perform queries"""
+                A cursor object, used to perform queries
+            conn: jaydebeapi.Connection
+                The connection of the cursor (only if returnConnection is True)"""
     # DB extension
     dbExtension = ".mv.db"
     dbTraceExtension = ".trace.db"
@@ -160,6 +166,16 @@ def startH2gisInstance(dbDirectory, dbInstanceDir = TEMPO_DIRECTORY,
     cur.execute("CALL H2GIS_SPATIAL();")
     print("Spatial functions added!\n")
     
+    # Init the functions used to exchange large tables with Python
+    if BINARY_EXCHANGE:
+        try:
+            DataUtil.createBinaryExchangeFunctions(cursor = cur)
+            print("Binary exchange functions added!\n")
+        except Exception as error:
+            print("Binary exchange functions not available, CSV files are used: {0}\n".format(error))
+    
+    if returnConnection:
+        return cur, conn
     return cur
 
 def setJavaDir(javaPath):
@@ -8,7 +8,6 @@ Created on Wed Feb  3 15:39:07 2021
 
 from . import DataUtil as DataUtil
 import pandas as pd
-idx = pd.IndexSlice
 from .GlobalVariables import ALONG_WIND_ZONE_EXTEND, CROSS_WIND_ZONE_EXTEND,\
     MESH_SIZE, PREFIX_NAME, GEOM_FIELD, ID_POINT, ID_POINT_X, ID_POINT_Y,\
     CAVITY_NAME, WAKE_NAME, DISPLACEMENT_NAME, DISPLACEMENT_VORTEX_NAME,\
@@ -24,7 +23,7 @@ from .GlobalVariables import ALONG_WIND_ZONE_EXTEND, CROSS_WIND_ZONE_EXTEND,\
     WAKE_RELATIVE_POSITION_FIELD, ROOFTOP_CORNER_VAR_HEIGHT, DEBUG,\
     VEGETATION_CROWN_TOP_HEIGHT, ID_VEGETATION, TOP_CANOPY_HEIGHT_POINT,\
     VEGETATION_ATTENUATION_FACTOR, VEGETATION_CROWN_BASE_HEIGHT,\
-    DZ, ID_POINT_Z, C_DZ, P_DZ, Z, X, Y,\
+    DZ, DZ_STRETCH_RATIO, ID_POINT_Z, C_DZ, P_DZ, Z, X, Y,\
     Z_REF, P_RTP, VEGETATION_OPEN_NAME, VEGETATION_BUILT_NAME,\
     VEGETATION_FACTOR, UPSTREAM_PRIORITY_TABLES, UPSTREAM_WEIGHTING_TABLES,\
     UPSTREAM_WEIGHTING_INTER_RULES, UPSTREAM_WEIGHTING_INTRA_RULES,\
@@ -40,10 +39,12 @@ from .GlobalVariables import ALONG_WIND_ZONE_EXTEND, CROSS_WIND_ZONE_EXTEND,\
     SIN_BLOCK_LEFT_AZIMUTH, SIN_BLOCK_AZIMUTH, STACKED_BLOCK_WIDTH,\
     DOWNSTREAM_X_RELATIVE_POSITION, V_WEIGHT, U_WEIGHT, W_WEIGHT,\
     STACKED_BLOCK_X_MED, REMOVE_INITIALIZATION_OFFSET, IS_UPSTREAM_FIELD,\
-    IS_UPSTREAM_UPSTREAM_WEIGHTING
+    IS_UPSTREAM_UPSTREAM_WEIGHTING, PRECISION, BUILD_WIND_FACTOR_ENGINE
+from .WindSolver import allocateArray
 import math
 import numpy as np
 import os
+from collections import OrderedDict
 
 def createGrid(cursor, dicOfInputTables,  srid,
                alongWindZoneExtend = ALONG_WIND_ZONE_EXTEND, 
@@ -1500,7 +1501,11 @@ def manageBackwardZones(cursor, dicOfBuildZoneGridPoint, cavity2dInitPoints,
 
 
 def calculates3dBuildWindFactor(cursor, dicOfBuildZoneGridPoint,
-                                dz = DZ, prefix = PREFIX_NAME):
+                                dz = DZ, prefix = PREFIX_NAME,
+                                dzStretchRatio = DZ_STRETCH_RATIO,
+                                dzStretchHeight = None,
+                                tempoDirectory = TEMPO_DIRECTORY,
+                                engine = BUILD_WIND_FACTOR_ENGINE):
     """ Calculates the 3D wind speed factors for each building zone.
 
 		Parameters
@@ -1515,6 +1520,22 @@ def calculates3dBuildWindFactor(cursor, dicOfBuildZoneGridPoint,
                 Resolution (in meter) of the grid in the vertical direction
             prefix: String, default PREFIX_NAME
                 Prefix to add to the output table name
+            dzStretchRatio: float, default DZ_STRETCH_RATIO
+                Ratio between the thicknesses of two consecutive vertical
+                levels above 'dzStretchHeight'
+            dzStretchHeight: float, default None
+                Height (m) above which the vertical levels are stretched
+                (uniform vertical grid if None)
+            tempoDirectory: String, default TEMPO_DIRECTORY
+                Path of the directory where are stored the 2D and 3D zone
+                points (in order to exchange data between H2 and Python,
+                only used by the "numpy" engine)
+            engine: String, default BUILD_WIND_FACTOR_ENGINE
+                Engine used to calculate the 3D wind speed factors:
+                    - "numpy": the 2D zone point attributes are loaded in Python
+                    and the factors are calculated as arrays
+                    - "sql": the 2D zone points are cross joined with the
+                    vertical levels in H2GIS
             
 		Returns
 		_ _ _ _ _ _ _ _ _ _ 
@@ -1555,11 +1576,73 @@ def calculates3dBuildWindFactor(cursor, dicOfBuildZoneGridPoint,
                                                               for t in dicOfBuildZoneGridPoint])))
     maxHeight = cursor.fetchall()[0][0]
     
+    if engine == "numpy":
+        # 2D attributes needed for each zone (the 3D factors are calculated in Python)
+        attributeQuery = \
+            {   DISPLACEMENT_NAME       : [UPPER_VERTICAL_THRESHOLD, HEIGHT_FIELD, U, V,
+                                           ID_POINT, Y_WALL],
+                DISPLACEMENT_VORTEX_NAME: [UPPER_VERTICAL_THRESHOLD, HEIGHT_FIELD,
+                                           POINT_RELATIVE_POSITION_FIELD+DISPLACEMENT_VORTEX_NAME[0],
+                                           ID_POINT, Y_WALL],
+                CAVITY_NAME             : [UPPER_VERTICAL_THRESHOLD, HEIGHT_FIELD,
+                                           POINT_RELATIVE_POSITION_FIELD+CAVITY_NAME[0],
+                                           COS_BLOCK_AZIMUTH, DOWNSTREAM_X_RELATIVE_POSITION,
+                                           ID_POINT, Y_WALL],
+                WAKE_NAME               : [UPPER_VERTICAL_THRESHOLD,
+                                           UPPER_VERTICAL_THRESHOLD + CAVITY_NAME[0],
+                                           HEIGHT_FIELD, WAKE_RELATIVE_POSITION_FIELD,
+                                           COS_BLOCK_AZIMUTH, SIN_BLOCK_AZIMUTH,
+                                           DOWNSTREAM_X_RELATIVE_POSITION, ID_POINT, Y_WALL],
+                STREET_CANYON_NAME      : [UPPER_VERTICAL_THRESHOLD, MAX_CANYON_HEIGHT_FIELD,
+                                           U, V, W, ID_POINT, UPSTREAM_HEIGHT_FIELD, Y_WALL],
+                ROOFTOP_PERP_NAME       : [HEIGHT_FIELD, ROOFTOP_PERP_VAR_HEIGHT,
+                                           ID_POINT, Y_WALL],
+                ROOFTOP_CORN_NAME       : [HEIGHT_FIELD, ROOFTOP_CORNER_VAR_HEIGHT,
+                                           ROOFTOP_WIND_FACTOR, UPWIND_FACADE_ANGLE_FIELD,
+                                           ID_POINT, Y_WALL],
+                CAVITY_BACKWARD_NAME    : [UPPER_VERTICAL_THRESHOLD, HEIGHT_FIELD,
+                                           POINT_RELATIVE_POSITION_FIELD+CAVITY_NAME[0],
+                                           ID_POINT, ID_POINT_X, UPWIND_FACADE_FIELD, Y_WALL],
+                WAKE_BACKWARD_NAME      : [UPPER_VERTICAL_THRESHOLD,
+                                           UPPER_VERTICAL_THRESHOLD + CAVITY_NAME[0],
+                                           HEIGHT_FIELD, WAKE_RELATIVE_POSITION_FIELD,
+                                           ID_POINT, ID_POINT_X, UPWIND_FACADE_FIELD, Y_WALL]}
+        
+        # Height of the z levels impacted by building obstacles (start at dz/2)
+        if maxHeight:
+            levelHeights = DataUtil.getLevelHeights(topHeight = maxHeight,
+                                                    dz = dz,
+                                                    stretchRatio = dzStretchRatio,
+                                                    stretchHeight = dzStretchHeight)
+        else:
+            levelHeights = np.zeros(0)
+        
+        for t in dicOfBuildZoneGridPoint:
+            attributes = DataUtil.readQueryColumns(cursor = cursor,
+                                                   query = "SELECT {0} FROM {1}"\
+                                                       .format(", ".join(attributeQuery[t]),
+                                                               dicOfBuildZoneGridPoint[t]),
+                                                   filePathBase = os.path.join(tempoDirectory,
+                                                                               "BUILD_ZONE_2D_" + t))
+            DataUtil.writeTableColumns(cursor = cursor,
+                                       tableName = dicOfOutputTables[t],
+                                       columns = calculates3dBuildWindFactorArrays(zoneType = t,
+                                                                                   attributes = attributes,
+                                                                                   levelHeights = levelHeights),
+                                       filePathBase = os.path.join(tempoDirectory,
+                                                                   "BUILD_ZONE_3D_" + t))
+        
+        return dicOfOutputTables, maxHeight
+    
+    elif engine != "sql":
+        raise ValueError("Unknown building wind factor engine '{0}'".format(engine))
+    
     # Creates the table of z levels impacted by building obstacles (start at dz/2)
     if maxHeight:
-        listOfZ = [str(i) for i in np.arange(float(dz)/2,
-                                             float(dz)/2+math.trunc(maxHeight/dz)*dz,
-                                             dz)]
+        listOfZ = [str(i) for i in DataUtil.getLevelHeights(topHeight = maxHeight,
+                                                            dz = dz,
+                                                            stretchRatio = dzStretchRatio,
+                                                            stretchHeight = dzStretchHeight)]
         cursor.execute("""
                    DROP TABLE IF EXISTS {0};
                    CREATE TABLE {0}({2} SERIAL, {3} DOUBLE);
@@ -1787,8 +1870,181 @@ def calculates3dBuildWindFactor(cursor, dicOfBuildZoneGridPoint,
     return dicOfOutputTables, maxHeight
 
 
+def calculates3dBuildWindFactorArrays(zoneType, attributes, levelHeights):
+    """ Calculates the 3D wind speed factors of the points of a building
+    zone from their 2D attributes. Each 2D point is associated to the
+    vertical levels located within the zone and the factors are calculated
+    using the same equations as the SQL engine of 'calculates3dBuildWindFactor'.
+    NaN attributes stand for NULL values: as in SQL, a factor is NULL (masked)
+    if one of the attributes of its equation is NULL, while a factor which is
+    NaN in SQL (e.g. square root of a negative value) is kept as NaN.
+
+		Parameters
+		_ _ _ _ _ _ _ _ _ _ 
+
+            zoneType: String
+                Type of Rockle zone (e.g. CAVITY_NAME, WAKE_NAME, etc.)
+            attributes: dictionary of 1D arrays
+                2D attributes of the zone points (column names as keys)
+            levelHeights: 1D array
+                Height (m) of the center of each vertical level impacted by
+                building obstacles (ID_POINT_Z - 1 as index)
+            
+		Returns
+		_ _ _ _ _ _ _ _ _ _ 
+
+            columns: OrderedDict
+                Column names as keys and 1D arrays of values (one per
+                point and level, masked arrays for the calculated factors)
+                as values"""
+    a = {c: np.asarray(attributes[c]) for c in attributes}
+    zLevels = np.asarray(levelHeights, dtype = np.float64)[np.newaxis, :]
+    
+    # Identify the levels located within the zone for each point
+    with np.errstate(invalid = "ignore"):
+        if zoneType in [WAKE_NAME, WAKE_BACKWARD_NAME]:
+            isInZone = (zLevels < a[UPPER_VERTICAL_THRESHOLD][:, np.newaxis])\
+                        & (zLevels >= a[UPPER_VERTICAL_THRESHOLD + CAVITY_NAME[0]][:, np.newaxis])
+        elif zoneType == STREET_CANYON_NAME:
+            isInZone = (zLevels < a[UPPER_VERTICAL_THRESHOLD][:, np.newaxis])\
+                        & (zLevels < a[MAX_CANYON_HEIGHT_FIELD][:, np.newaxis])
+        elif zoneType in [ROOFTOP_PERP_NAME, ROOFTOP_CORN_NAME]:
+            varHeight = ROOFTOP_PERP_VAR_HEIGHT if zoneType == ROOFTOP_PERP_NAME\
+                            else ROOFTOP_CORNER_VAR_HEIGHT
+            isInZone = (zLevels < (a[HEIGHT_FIELD] + a[varHeight])[:, np.newaxis])\
+                        & (zLevels > a[HEIGHT_FIELD][:, np.newaxis])
+        else:
+            isInZone = zLevels < a[UPPER_VERTICAL_THRESHOLD][:, np.newaxis]
+    indPoint, indLevel = np.nonzero(isInZone)
+    
+    # 2D attributes and height of each 3D point
+    p = {c: a[c][indPoint] for c in a}
+    z = zLevels[0, indLevel]
+    
+    # SQL gives NULL as soon as one of the attributes of an equation is NULL
+    # (NaN attribute), the NaN values calculated from non-NULL attributes
+    # being kept as NaN (e.g. 0 * Infinity or square root of a negative value)
+    def nullIfAnyNull(values, *attributeNames):
+        isNull = np.zeros(z.size, dtype = bool)
+        for c in attributeNames:
+            isNull |= np.isnan(p[c])
+        return np.ma.masked_array(values, mask = isNull)
+    
+    columns = OrderedDict([(ID_POINT_Z, (indLevel + 1).astype(np.int32))])
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        if zoneType == DISPLACEMENT_NAME:
+            factor = C_DZ * np.power(z / p[HEIGHT_FIELD], P_DZ)
+            columns[U] = nullIfAnyNull(factor * p[U], HEIGHT_FIELD, U)
+            columns[V] = nullIfAnyNull(factor * p[V], HEIGHT_FIELD, V)
+            columns[W] = np.ma.where((p[U] == 0) & (p[V] == 0),
+                                     0.,
+                                     nullIfAnyNull(-0 * C_DZ * np.power((p[HEIGHT_FIELD] - z) / p[HEIGHT_FIELD], 0.5)\
+                                                   * (np.abs(p[U]) / np.power(p[U] ** 2 + p[V] ** 2, 0.5)),
+                                                   HEIGHT_FIELD, U, V))
+            columns[ID_POINT] = p[ID_POINT]
+            columns[HEIGHT_FIELD] = p[HEIGHT_FIELD]
+        
+        elif zoneType == DISPLACEMENT_VORTEX_NAME:
+            relativePosition = POINT_RELATIVE_POSITION_FIELD+DISPLACEMENT_VORTEX_NAME[0]
+            columns[V] = nullIfAnyNull(-(0.6 * np.cos(np.pi * z / (0.5 * p[HEIGHT_FIELD])) + 0.05)\
+                                       * 0.6 * np.sin(np.pi * p[relativePosition]),
+                                       HEIGHT_FIELD, relativePosition)
+            columns[W] = nullIfAnyNull(-0.1 * np.cos(np.pi * p[relativePosition]) - 0.05,
+                                       relativePosition)
+            columns[ID_POINT] = p[ID_POINT]
+            columns[HEIGHT_FIELD] = p[HEIGHT_FIELD]
+        
+        elif zoneType in [CAVITY_NAME, CAVITY_BACKWARD_NAME]:
+            relativePosition = POINT_RELATIVE_POSITION_FIELD+CAVITY_NAME[0]
+            ratio = p[relativePosition] / np.power(1 - np.power(z / p[HEIGHT_FIELD], 2), 0.5)
+            factor = 1 - ratio
+            if zoneType == CAVITY_NAME:
+                columns[V] = nullIfAnyNull(-np.power(factor, 2) * np.power(p[COS_BLOCK_AZIMUTH], 0)\
+                                           * np.power(p[DOWNSTREAM_X_RELATIVE_POSITION], 0.5),
+                                           relativePosition, HEIGHT_FIELD, COS_BLOCK_AZIMUTH,
+                                           DOWNSTREAM_X_RELATIVE_POSITION)
+                columns[ID_POINT] = p[ID_POINT]
+                columns[HEIGHT_FIELD] = p[HEIGHT_FIELD]
+                columns[U] = nullIfAnyNull(0 * np.power(ratio, 0.5),
+                                           relativePosition, HEIGHT_FIELD)
+                columns[W] = nullIfAnyNull(0 * np.power(factor, 2),
+                                           relativePosition, HEIGHT_FIELD)
+            else:
+                columns[V] = nullIfAnyNull(np.power(factor, 2),
+                                           relativePosition, HEIGHT_FIELD)
+                columns[ID_POINT] = p[ID_POINT]
+                columns[HEIGHT_FIELD] = p[HEIGHT_FIELD]
+                columns[ID_POINT_X] = p[ID_POINT_X]
+                columns[UPWIND_FACADE_FIELD] = p[UPWIND_FACADE_FIELD]
+        
+        elif zoneType == WAKE_NAME:
+            deficit = p[WAKE_RELATIVE_POSITION_FIELD]\
+                        * np.power(np.power(1 - np.power(z / p[HEIGHT_FIELD], 2), 0.5), 1.5)
+            for c in [V_WEIGHT, U_WEIGHT, W_WEIGHT]:
+                columns[c] = nullIfAnyNull(1 - deficit,
+                                           WAKE_RELATIVE_POSITION_FIELD, HEIGHT_FIELD)
+            columns[ID_POINT] = p[ID_POINT]
+            columns[HEIGHT_FIELD] = p[HEIGHT_FIELD]
+            columns[V] = nullIfAnyNull(1 - deficit * np.power(p[COS_BLOCK_AZIMUTH], 0)\
+                                       * np.power(p[DOWNSTREAM_X_RELATIVE_POSITION], 0),
+                                       WAKE_RELATIVE_POSITION_FIELD, HEIGHT_FIELD,
+                                       COS_BLOCK_AZIMUTH, DOWNSTREAM_X_RELATIVE_POSITION)
+            columns[U] = nullIfAnyNull(0 * deficit * p[SIN_BLOCK_AZIMUTH]\
+                                       * p[DOWNSTREAM_X_RELATIVE_POSITION],
+                                       WAKE_RELATIVE_POSITION_FIELD, HEIGHT_FIELD,
+                                       SIN_BLOCK_AZIMUTH, DOWNSTREAM_X_RELATIVE_POSITION)
+        
+        elif zoneType == WAKE_BACKWARD_NAME:
+            factor = -1 + np.power(p[WAKE_RELATIVE_POSITION_FIELD]\
+                                   * np.power(1 - np.power(z / p[HEIGHT_FIELD], 2), 0.5), 1.5)
+            for c in [V, U, W]:
+                columns[c] = nullIfAnyNull(factor,
+                                           WAKE_RELATIVE_POSITION_FIELD, HEIGHT_FIELD)
+            columns[ID_POINT] = p[ID_POINT]
+            columns[HEIGHT_FIELD] = p[HEIGHT_FIELD]
+            columns[ID_POINT_X] = p[ID_POINT_X]
+            columns[UPWIND_FACADE_FIELD] = p[UPWIND_FACADE_FIELD]
+        
+        elif zoneType == STREET_CANYON_NAME:
+            columns[U] = p[U]
+            columns[V] = p[V]
+            columns[W] = p[W]
+            columns[ID_POINT] = p[ID_POINT]
+            columns[HEIGHT_FIELD] = p[UPSTREAM_HEIGHT_FIELD]
+        
+        elif zoneType == ROOFTOP_PERP_NAME:
+            distanceToTop = p[HEIGHT_FIELD] + p[ROOFTOP_PERP_VAR_HEIGHT] - z
+            columns[V] = nullIfAnyNull(-np.power(distanceToTop / Z_REF, P_RTP)\
+                                       * np.abs(distanceToTop) / p[ROOFTOP_PERP_VAR_HEIGHT],
+                                       HEIGHT_FIELD, ROOFTOP_PERP_VAR_HEIGHT)
+            columns[ID_POINT] = p[ID_POINT]
+            columns[HEIGHT_FIELD] = p[HEIGHT_FIELD]
+        
+        elif zoneType == ROOFTOP_CORN_NAME:
+            distanceToTop = p[HEIGHT_FIELD] + p[ROOFTOP_CORNER_VAR_HEIGHT] - z
+            factor = np.power(distanceToTop / Z_REF, P_RTP)\
+                        * np.abs(distanceToTop) / p[ROOFTOP_CORNER_VAR_HEIGHT]
+            attributeNames = [HEIGHT_FIELD, ROOFTOP_CORNER_VAR_HEIGHT, ROOFTOP_WIND_FACTOR,
+                              UPWIND_FACADE_ANGLE_FIELD]
+            columns[U] = nullIfAnyNull(-p[ROOFTOP_WIND_FACTOR] * np.sin(2 * p[UPWIND_FACADE_ANGLE_FIELD])\
+                                       * factor, *attributeNames)
+            columns[V] = nullIfAnyNull(-p[ROOFTOP_WIND_FACTOR] * np.power(np.sin(p[UPWIND_FACADE_ANGLE_FIELD]), 2)\
+                                       * factor, *attributeNames)
+            columns[ID_POINT] = p[ID_POINT]
+            columns[HEIGHT_FIELD] = p[HEIGHT_FIELD]
+        
+        else:
+            raise ValueError("Unknown building zone type '{0}'".format(zoneType))
+    
+    columns[Y_WALL] = p[Y_WALL]
+    
+    return columns
+
+
 def calculates3dVegWindFactor(cursor, dicOfVegZoneGridPoint, sketchHeight,
-                              z0, d, dz = DZ, prefix = PREFIX_NAME):
+                              z0, d, dz = DZ, prefix = PREFIX_NAME,
+                              dzStretchRatio = DZ_STRETCH_RATIO,
+                              dzStretchHeight = None):
     """ Calculates the 3D wind speed factors for each zone according to 
     Nelson et al. (2009) method. Note that for vegetation located in 
     open areas (Equations 8 and 9), the displacement height is defined by
@@ -1821,6 +2077,12 @@ def calculates3dVegWindFactor(cursor, dicOfVegZoneGridPoint, sketchHeight,
                 Resolution (in meter) of the grid in the vertical direction
             prefix: String, default PREFIX_NAME
                 Prefix to add to the output table name
+            dzStretchRatio: float, default DZ_STRETCH_RATIO
+                Ratio between the thicknesses of two consecutive vertical
+                levels above 'dzStretchHeight'
+            dzStretchHeight: float, default None
+                Height (m) above which the vertical levels are stretched
+                (uniform vertical grid if None)
             
 		Returns
 		_ _ _ _ _ _ _ _ _ _ 
@@ -1845,9 +2107,10 @@ def calculates3dVegWindFactor(cursor, dicOfVegZoneGridPoint, sketchHeight,
     tempoAllVeg = DataUtil.postfix("TEMPO_ALL_VEG")
     
     # Creates the table of z levels of the sketch
-    listOfZ = [str(i) for i in np.arange(float(dz)/2, 
-                                         float(dz)/2+math.trunc(sketchHeight/dz)*dz, 
-                                         dz)]
+    listOfZ = [str(i) for i in DataUtil.getLevelHeights(topHeight = sketchHeight,
+                                                        dz = dz,
+                                                        stretchRatio = dzStretchRatio,
+                                                        stretchHeight = dzStretchHeight)]
     cursor.execute("""
             DROP TABLE IF EXISTS {0};
             CREATE TABLE {0}({2} SERIAL, {3} DOUBLE);
@@ -2835,6 +3098,8 @@ def setInitialWindField(cursor, initializedWindFactorTable, gridPoint,
                         df_gridBuil, z0, sketchHeight, profileType = PROFILE_TYPE,
                         meshSize = MESH_SIZE,  dz = DZ, z_ref = Z_REF, 
                         V_ref = V_REF, tempoDirectory = TEMPO_DIRECTORY,
+                        dzStretchRatio = DZ_STRETCH_RATIO, dzStretchHeight = None,
+                        precision = PRECISION, memmapDirectory = None,
                         **kwargs):
     """ Set the initial 3D wind speed according to the wind speed factor in
     the Röckle zones and to the initial vertical wind speed profile.
@@ -2873,6 +3138,17 @@ def setInitialWindField(cursor, initializedWindFactorTable, gridPoint,
                 Path of the directory where will be stored the grid points
                 having Röckle initial wind speed values (in order to exchange
                                                          data between H2 to Python)
+            dzStretchRatio: float, default DZ_STRETCH_RATIO
+                Ratio between the thicknesses of two consecutive vertical
+                levels above 'dzStretchHeight'
+            dzStretchHeight: float, default None
+                Height (m) above which the vertical levels are stretched
+                (uniform vertical grid if None)
+            precision: String, default PRECISION
+                Precision of the 3D wind speed arrays ("float64" or "float32")
+            memmapDirectory: String, default None
+                Directory of the memory-mapped files of the 3D wind speed
+                arrays (out-of-core mode, None to allocate them in RAM)
             (optional) d: float
                 Value of the study area displacement length (only if profileType = "log" or "urban")
             (optional) H: float
@@ -2889,8 +3165,12 @@ def setInitialWindField(cursor, initializedWindFactorTable, gridPoint,
     		Returns
     		_ _ _ _ _ _ _ _ _ _ 
     
-            initial3dWindSpeed: pd.DataFrame
-                3D wind speed value used as "first guess" in the wind solver
+            u0: np.ndarray
+                3D (X, Y, Z) wind speed along X used as "first guess" in the wind solver
+            v0: np.ndarray
+                3D (X, Y, Z) wind speed along Y used as "first guess" in the wind solver
+            w0: np.ndarray
+                3D (X, Y, Z) wind speed along Z used as "first guess" in the wind solver
             nPoints: dictionary
                 Dimension of the 3D grid object with X, Y and Z as key and the
                 number of grid point in the corresponding axis as value
@@ -2905,7 +3185,7 @@ def setInitialWindField(cursor, initializedWindFactorTable, gridPoint,
     verticalProfileFile = kwargs.get('verticalProfileFile', None)
     
     # File name of the intermediate data saved on disk
-    initRockleFilename = "INIT_WIND_ROCKLE_ZONES.csv"
+    initRockleFilename = "INIT_WIND_ROCKLE_ZONES"
     
     # Temporary tables (and prefix for temporary tables)
     tempoVerticalProfileTable = DataUtil.postfix("TEMPO_VERTICAL_PROFILE_WIND")
@@ -2913,9 +3193,10 @@ def setInitialWindField(cursor, initializedWindFactorTable, gridPoint,
     tempoZoneWindSpeedFactorTable = DataUtil.postfix("TEMPO_ZONE_WIND_SPEED_FACTOR")
     
     # Set a list of the level height and get their horizontal wind speed
-    levelHeightList = [i for i in np.arange(float(dz)/2, 
-                                            float(dz)/2+math.trunc(sketchHeight/dz)*dz,
-                                            dz)]
+    levelHeightList = [i for i in DataUtil.getLevelHeights(topHeight = sketchHeight,
+                                                           dz = dz,
+                                                           stretchRatio = dzStretchRatio,
+                                                           stretchHeight = dzStretchHeight)]
     verticalWindSpeedProfile = \
         getVerticalProfile( cursor = cursor,
                             pointHeightList = levelHeightList,
@@ -2979,11 +3260,11 @@ def setInitialWindField(cursor, initializedWindFactorTable, gridPoint,
     # Calculates the initial wind speed field according to each point rule
     # and join to the table x and y coordinates
     cursor.execute("""
+           {12};
+           {13};
+           {14};
+           {15};
            {16};
-           {17};
-           {18};
-           {19};
-           {20};
            DROP TABLE IF EXISTS {4};
            CREATE TABLE {4}
                AS SELECT   a.{5},
@@ -3006,27 +3287,14 @@ def setInitialWindField(cursor, initializedWindFactorTable, gridPoint,
                            a.{6},
                            a.{9}
                FROM {0} AS a;
-           {21};
-           {22};
-           CALL CSVWRITE('{13}',
-                         'SELECT b.{14} - 1 AS {14}_MINUS_1,
-                                 b.{15} - 1 AS {15}_MINUS_1,
-                                 a.{2},
-                                 a.{8} * WIND_SPEED AS {8},
-                                 a.{6} * WIND_SPEED AS {6},
-                                 a.{9} * WIND_SPEED AS {9}
-                          FROM {4} AS a LEFT JOIN {12} AS b
-                          ON a.{5} = b.{5}',
-                         'charset=UTF-8 fieldSeparator=,')
+           {17};
+           {18};
            """.format( initializedWindFactorTable   , tempoVerticalProfileTable,
                        ID_POINT_Z                   , REF_HEIGHT_FIELD,
                        tempoZoneWindSpeedFactorTable, ID_POINT,
                        V                            , V_ref,
                        U                            , W,
                        tempoBuildingHeightWindTable , HEIGHT_FIELD,
-                       gridPoint                    , os.path.join(tempoDirectory,
-                                                                   initRockleFilename),
-                       ID_POINT_X                   , ID_POINT_Y,
                       DataUtil.createIndex(tableName=initializedWindFactorTable, 
                                             fieldName=HEIGHT_FIELD,
                                             isSpatial=False),
@@ -3058,39 +3326,47 @@ def setInitialWindField(cursor, initializedWindFactorTable, gridPoint,
     nPoints = {X: nPointsResults[0][0]   , Y: nPointsResults[0][1],
                Z: verticalWindSpeedProfile.index.max()+1}
     
-    # Initialize the 3D wind speed field considering no obstacles
+    # Initialize the 3D wind speed field considering no obstacles (the
+    # vertical profile is broadcasted along the V component, slice by slice
+    # along X for memory-mapped arrays)
     verticalWindSpeedProfile.loc[0] = [0, 0]
     verticalWindSpeedProfile.sort_index(inplace = True)
-    df_wind0 = pd.DataFrame({U: np.zeros(nPoints[X]*nPoints[Y]*nPoints[Z]),
-                             V: [val for j in range(nPoints[Y])
-                                     for i in range(nPoints[X])
-                                     for val in verticalWindSpeedProfile[HORIZ_WIND_SPEED]],
-                             W: np.zeros(nPoints[X] * nPoints[Y] * nPoints[Z])},
-                            index=pd.MultiIndex.from_product([[i for i in range(0, nPoints[X])],
-                                                              [j for j in range(0, nPoints[Y])],
-                                                              [k for k in range(0, nPoints[Z])]]))
+    nx, ny, nz = nPoints[X], nPoints[Y], nPoints[Z]
+    u0 = allocateArray((nx, ny, nz), precision, memmapDirectory, "u0")
+    v0 = allocateArray((nx, ny, nz), precision, memmapDirectory, "v0")
+    w0 = allocateArray((nx, ny, nz), precision, memmapDirectory, "w0")
+    profile = verticalWindSpeedProfile[HORIZ_WIND_SPEED].values
+    for i in range(nx):
+        v0[i] = profile
 
     # Read the wind speed near obstacles (data coming from H2GIS database)
-    df_wind0_rockle = pd.read_csv(os.path.join(tempoDirectory,
-                                               initRockleFilename),
-                                  header = 0,
-                                  index_col = [0, 1, 2])
+    rockleColumns = DataUtil.readQueryColumns(cursor = cursor,
+                                              query = """
+                                                  SELECT b.{0} - 1 AS {0}_MINUS_1,
+                                                         b.{1} - 1 AS {1}_MINUS_1,
+                                                         a.{2},
+                                                         a.{3} * WIND_SPEED AS {3},
+                                                         a.{4} * WIND_SPEED AS {4},
+                                                         a.{5} * WIND_SPEED AS {5}
+                                                  FROM {6} AS a LEFT JOIN {7} AS b
+                                                  ON a.{8} = b.{8}
+                                                  """.format(ID_POINT_X, ID_POINT_Y,
+                                                             ID_POINT_Z, U, V, W,
+                                                             tempoZoneWindSpeedFactorTable,
+                                                             gridPoint, ID_POINT),
+                                              filePathBase = os.path.join(tempoDirectory,
+                                                                          initRockleFilename))
+    rockleX, rockleY, rockleZ = [np.asarray(values, dtype = np.int64)
+                                    for values in list(rockleColumns.values())[0:3]]
     
     # Update the 3D wind speed field with the initial guess near obstacles
-    for c in df_wind0_rockle.columns:
-        df_wind0.loc[df_wind0_rockle[c].sort_index().dropna().index,c] = df_wind0_rockle[c].sort_index().dropna() 
-    
-    # Renormalize wind speed at each height to make sure there is no offset of
-    # wind speed between the wind profile and the initialization before the balance of wind
-    if REMOVE_INITIALIZATION_OFFSET:
-        max_zi = df_wind0_rockle.index.get_level_values("ID_Z").max()
-        for z_i in verticalWindSpeedProfile.index[1:max_zi + 1]:
-            df_wind0.loc[idx[:,:,z_i],:] = df_wind0.loc[idx[:,:,z_i],:] \
-                * verticalWindSpeedProfile.loc[z_i, HORIZ_WIND_SPEED] \
-                    / df_wind0.loc[idx[:,:,z_i],:].pow(2).sum(axis=1).pow(0.5).mean()
-    
-    # Set to 0 wind speed within buildings...
-    df_wind0.loc[df_gridBuil.index] = 0
+    # and set to 0 wind speed within buildings
+    buildX, buildY, buildZ = [df_gridBuil.index.get_level_values(j).values
+                                  for j in range(3)]
+    fillInitialWindField(u0 = u0, v0 = v0, w0 = w0, profile = profile,
+                         rockleCoordinates = (rockleX, rockleY, rockleZ),
+                         rockleValues = list(rockleColumns.values())[3:6],
+                         buildingCoordinates = (buildX, buildY, buildZ))
         
     if not DEBUG:
         # Remove intermediate tables
@@ -3100,7 +3376,71 @@ def setInitialWindField(cursor, initializedWindFactorTable, gridPoint,
                                            tempoBuildingHeightWindTable,
                                            tempoZoneWindSpeedFactorTable])))
     
-    return df_wind0, nPoints, verticalWindSpeedProfile
+    return u0, v0, w0, nPoints, verticalWindSpeedProfile
+
+
+def fillInitialWindField(u0, v0, w0, profile, rockleCoordinates, rockleValues,
+                         buildingCoordinates,
+                         removeOffset = REMOVE_INITIALIZATION_OFFSET):
+    """ Update (in place) the 3D wind speed field without obstacle with the
+    wind speed of the Röckle zones, remove the offset between the vertical
+    wind profile and the resulting field (if needed) and set to 0 the wind
+    speed within buildings. The arrays are processed slice by slice along X
+    (may be memory-mapped).
+
+		Parameters
+		_ _ _ _ _ _ _ _ _ _ 
+
+            u0: 3D array
+                Wind speed along X without obstacle (0)
+            v0: 3D array
+                Wind speed along Y without obstacle (vertical profile)
+            w0: 3D array
+                Wind speed along Z without obstacle (0)
+            profile: 1D array
+                Horizontal wind speed of each level (0 for the ground level)
+            rockleCoordinates: tuple of 1D arrays
+                X, Y and Z grid indices of the Röckle zone points
+            rockleValues: list of 1D arrays
+                U, V and W wind speeds of the Röckle zone points (NaN when
+                the zone does not set the component)
+            buildingCoordinates: tuple of 1D arrays
+                X, Y and Z grid indices of the building cells
+            removeOffset: boolean, default REMOVE_INITIALIZATION_OFFSET
+                Whether the mean wind speed of each level impacted by a
+                Röckle zone is brought back to the vertical profile
+            
+		Returns
+		_ _ _ _ _ _ _ _ _ _ 
+
+            None"""
+    nx, ny, nz = u0.shape
+    rockleX, rockleY, rockleZ = rockleCoordinates
+    
+    # Scattered using the integer grid indices of each point
+    for wind0, values in zip([u0, v0, w0], rockleValues):
+        isDefined = ~np.isnan(values)
+        wind0[rockleX[isDefined], rockleY[isDefined], rockleZ[isDefined]] = values[isDefined]
+    
+    # Renormalize wind speed at each height to make sure there is no offset of
+    # wind speed between the wind profile and the initialization before the balance of wind
+    if removeOffset and rockleZ.size > 0:
+        max_zi = rockleZ.max()
+        levels = slice(1, max_zi + 1)
+        meanSpeed = np.zeros(max_zi)
+        for i in range(nx):
+            meanSpeed += np.sqrt(u0[i, :, levels] ** 2 + v0[i, :, levels] ** 2
+                                 + w0[i, :, levels] ** 2).sum(axis = 0, dtype = np.float64)
+        factor = profile[levels] / (meanSpeed / (nx * ny))
+        for i in range(nx):
+            u0[i, :, levels] *= factor
+            v0[i, :, levels] *= factor
+            w0[i, :, levels] *= factor
+    
+    # Set to 0 wind speed within buildings...
+    buildX, buildY, buildZ = buildingCoordinates
+    for wind0 in [u0, v0, w0]:
+        wind0[buildX, buildY, buildZ] = 0
 
 
 def identifyBuildPoints(cursor, gridPoint, stackedBlocksWithBaseHeight,
@@ -3135,7 +3475,7 @@ def identifyBuildPoints(cursor, gridPoint, stackedBlocksWithBaseHeight,
     print("Identify grid points intersecting buildings")
     
     # File name of the intermediate data saved on disk
-    buildPointsFilename = "BUILDING_POINTS.csv"
+    buildPointsFilename = "BUILDING_POINTS"
     
     # Temporary tables (and prefix for temporary tables)
     tempoBuildPointsTable = DataUtil.postfix("BUILDING_POINTS")
@@ -3189,23 +3529,12 @@ def identifyBuildPoints(cursor, gridPoint, stackedBlocksWithBaseHeight,
                """.format( tempoLevelHeightPointTable     , ID_POINT_Z,
                            Z))
                        
-    # Identify the third dimension of points intersecting buildings and save it...
+    # Identify the third dimension of points intersecting buildings...
     cursor.execute("""
-           {9};
-           {10};
-           {11};
-           CALL CSVWRITE('{0}',
-                         ' SELECT a.{1}-1, a.{8}-1, b.{2}
-                           FROM {3} AS a, {4} AS b
-                           WHERE b.{5} <= a.{6} AND b.{5} > a.{7}',
-                         'charset=UTF-8 fieldSeparator=,')
-           """.format( os.path.join(tempoDirectory,
-                                    buildPointsFilename)    , ID_POINT_X,
-                       ID_POINT_Z                           , tempoBuildPointsTable,
-                       tempoLevelHeightPointTable           , Z,
-                       HEIGHT_FIELD                         , BASE_HEIGHT_FIELD,
-                       ID_POINT_Y,
-                      DataUtil.createIndex(tableName=tempoBuildPointsTable, 
+           {0};
+           {1};
+           {2};
+           """.format(DataUtil.createIndex(tableName=tempoBuildPointsTable, 
                                             fieldName=HEIGHT_FIELD,
                                             isSpatial=False),
                       DataUtil.createIndex(tableName=tempoBuildPointsTable, 
@@ -3216,13 +3545,24 @@ def identifyBuildPoints(cursor, gridPoint, stackedBlocksWithBaseHeight,
                                             isSpatial=False)))
     
     # ...in order to load it back into Python
-    df_gridBuil = pd.read_csv(os.path.join(tempoDirectory,
-                                           buildPointsFilename),
-                                  header = 0,
-                                  index_col = [0, 1, 2])
+    buildColumns = DataUtil.readQueryColumns(cursor = cursor,
+                                             query = """
+                                                 SELECT a.{0}-1 AS {0}_MINUS_1,
+                                                        a.{1}-1 AS {1}_MINUS_1,
+                                                        b.{2}
+                                                 FROM {3} AS a, {4} AS b
+                                                 WHERE b.{5} <= a.{6} AND b.{5} > a.{7}
+                                                 """.format(ID_POINT_X, ID_POINT_Y,
+                                                            ID_POINT_Z, tempoBuildPointsTable,
+                                                            tempoLevelHeightPointTable, Z,
+                                                            HEIGHT_FIELD, BASE_HEIGHT_FIELD),
+                                             filePathBase = os.path.join(tempoDirectory,
+                                                                         buildPointsFilename))
     
     # Remove potential duplicated indexes
-    df_gridBuil = pd.DataFrame(index = df_gridBuil.index.drop_duplicates())
+    df_gridBuil = pd.DataFrame(index = pd.MultiIndex.from_arrays([np.asarray(values, dtype = np.int64)
+                                                                      for values in buildColumns.values()])\
+                                         .drop_duplicates())
 
     if not DEBUG:
         # Remove intermediate tables
@@ -18,8 +18,10 @@ from . import InitWindField
 from . import DataUtil
 from . import WindSolver
 import time
+import numba
 from numba import jit
 import copy as cp
+from concurrent.futures import ThreadPoolExecutor
 
 import os
 
@@ -62,7 +64,20 @@ def main(javaEnvironmentPath,
          saveNetcdf = True,
          debug = DEBUG,
          profileType = PROFILE_TYPE,
-         verticalProfileFile = None):
+         verticalProfileFile = None,
+         solverMethod = SOLVER_METHOD,
+         nbThreads = SOLVER_NB_THREADS,
+         denseSweep = SOLVER_DENSE_SWEEP,
+         convergenceInterval = CONVERGENCE_CHECK_INTERVAL,
+         omegaMethod = SOLVER_OMEGA_METHOD,
+         checkpoint = SOLVER_CHECKPOINT,
+         nestedFactor = NESTED_ITERATION_FACTOR,
+         activeDistance = ACTIVE_SET_DISTANCE,
+         activeTolerance = ACTIVE_SET_TOLERANCE,
+         outOfCore = OUT_OF_CORE,
+         warmStart = WARM_START,
+         precision = PRECISION,
+         dzStretchRatio = DZ_STRETCH_RATIO):
     # If the function is called within QGIS, a feedback is sent into the QGIS interface
     if feedback:
         feedback.setProgressText('Initiating algorithm')
@@ -114,8 +129,9 @@ def main(javaEnvironmentPath,
     #Download H2GIS
     H2gisConnection.downloadH2gis(dbDirectory = pluginDirectory)
     #Initialize a H2GIS database connection
-    cursor = H2gisConnection.startH2gisInstance(dbDirectory = pluginDirectory,
-                                                dbInstanceDir = tempoDirectory)
+    cursor, connection = H2gisConnection.startH2gisInstance(dbDirectory = pluginDirectory,
+                                                            dbInstanceDir = tempoDirectory,
+                                                            returnConnection = True)
     
     # Load data
     loadData.loadData(fromCad = False, 
@@ -133,6 +149,9 @@ def main(javaEnvironmentPath,
     
     timeStartCalculation = time.time()
     
+    # Grid point layers (debug) saved while the wind solver is applied
+    deferredLayers = []
+    
     # -----------------------------------------------------------------------------------
     # 2. CREATES OBSTACLE GEOMETRIES ----------------------------------------------------
     # -----------------------------------------------------------------------------------
@@ -440,12 +459,11 @@ def main(javaEnvironmentPath,
                            DataUtil.createIndex(tableName=dicOfBuildZoneGridPoint[t], 
                                                 fieldName=ID_POINT,
                                                 isSpatial=False)))
-            saveData.saveTable(cursor = cursor,
-                               tableName = "point_Buildzone_"+t,
-                               filedir = outputDataAbs["point_BuildZone"]+t+".geojson",
-                               delete = True,
-                               rotationCenterCoordinates = rotationCenterCoordinates,
-                               rotateAngle = - windDirection)
+            deferredLayers.append(dict(tableName = "point_Buildzone_"+t,
+                                       filedir = outputDataAbs["point_BuildZone"]+t+".geojson",
+                                       delete = True,
+                                       rotationCenterCoordinates = rotationCenterCoordinates,
+                                       rotateAngle = - windDirection))
     
     # -----------------------------------------------------------------------------------
     # 6. INITIALIZE THE 3D WIND FACTORS IN THE ROCKLE ZONES -------------------------------
@@ -457,7 +475,10 @@ def main(javaEnvironmentPath,
         InitWindField.calculates3dBuildWindFactor(cursor = cursor,
                                                   dicOfBuildZoneGridPoint = dicOfBuildZoneGridPoint,
                                                   dz = dz,
-                                                  prefix = prefix)
+                                                  prefix = prefix,
+                                                  dzStretchRatio = dzStretchRatio,
+                                                  dzStretchHeight = H_ob_max,
+                                                  tempoDirectory = tempoDirectory)
     if debug or saveRockleZones:
         for t in dicOfBuildZone3DWindFactor:
             cursor.execute("""
@@ -477,12 +498,11 @@ def main(javaEnvironmentPath,
                            DataUtil.createIndex(tableName=dicOfBuildZone3DWindFactor[t], 
                                                 fieldName=ID_POINT,
                                                 isSpatial=False)))
-            saveData.saveTable(cursor = cursor,
-                               tableName = "point3D_Buildzone_"+t,
-                               filedir = outputDataAbs["point3D_BuildZone"]+t+".geojson",
-                               delete = True,
-                               rotationCenterCoordinates = rotationCenterCoordinates,
-                               rotateAngle = - windDirection)
+            deferredLayers.append(dict(tableName = "point3D_Buildzone_"+t,
+                                       filedir = outputDataAbs["point3D_BuildZone"]+t+".geojson",
+                                       delete = True,
+                                       rotationCenterCoordinates = rotationCenterCoordinates,
+                                       rotateAngle = - windDirection))
         
     # Calculates the 3D wind speed factors of the vegetation (considering all zone types)
     # after calculation of the top of the "sketch"
@@ -498,7 +518,9 @@ def main(javaEnvironmentPath,
                                                 z0 = z0,
                                                 d = d,
                                                 dz = dz,
-                                                prefix = prefix)
+                                                prefix = prefix,
+                                                dzStretchRatio = dzStretchRatio,
+                                                dzStretchHeight = H_ob_max)
     if debug or saveRockleZones:
         cursor.execute("""
            DROP TABLE IF EXISTS point3D_AllVegZone;
@@ -517,12 +539,11 @@ def main(javaEnvironmentPath,
                        DataUtil.createIndex(tableName=vegetationWeightFactorTable, 
                                             fieldName=ID_POINT,
                                             isSpatial=False)))
-        saveData.saveTable(cursor = cursor,
-                           tableName = "point3D_AllVegZone",
-                           filedir = outputDataAbs["point3D_VegZone"]+".geojson",
-                           delete = True,
-                           rotationCenterCoordinates = rotationCenterCoordinates,
-                           rotateAngle = - windDirection)
+        deferredLayers.append(dict(tableName = "point3D_AllVegZone",
+                                   filedir = outputDataAbs["point3D_VegZone"]+".geojson",
+                                   delete = True,
+                                   rotationCenterCoordinates = rotationCenterCoordinates,
+                                   rotateAngle = - windDirection))
     
     
     # ----------------------------------------------------------------
@@ -561,12 +582,11 @@ def main(javaEnvironmentPath,
                         DataUtil.createIndex(tableName=allZonesPointFactor, 
                                              fieldName=ID_POINT,
                                              isSpatial=False)))
-        saveData.saveTable(cursor = cursor,
-                           tableName = "point3D_All",
-                           filedir = outputDataAbs["point3D_All"]+".geojson",
-                           delete = True,
-                           rotationCenterCoordinates = rotationCenterCoordinates,
-                           rotateAngle = - windDirection)    
+        deferredLayers.append(dict(tableName = "point3D_All",
+                                   filedir = outputDataAbs["point3D_All"]+".geojson",
+                                   delete = True,
+                                   rotationCenterCoordinates = rotationCenterCoordinates,
+                                   rotateAngle = - windDirection))    
     
     
     # -------------------------------------------------------------------
@@ -582,8 +602,11 @@ def main(javaEnvironmentPath,
                                           dz = dz,
                                           tempoDirectory = tempoDirectory)
     
-    # Set the initial 3D wind speed field
-    df_wind0, nPoints, verticalWindProfile = \
+    # Set the initial 3D wind speed field (as arrays having the precision
+    # used for all 3D wind fields, memory-mapped files of the temporary
+    # directory in the out-of-core mode)
+    memmapDirectory = tempoDirectory if outOfCore else None
+    u0, v0, w0, nPoints, verticalWindProfile = \
         InitWindField.setInitialWindField(cursor = cursor, 
                                           initializedWindFactorTable = allZonesPointFactor,
                                           gridPoint = gridPoint,
@@ -596,6 +619,10 @@ def main(javaEnvironmentPath,
                                           z_ref = z_ref,
                                           V_ref = v_ref, 
                                           tempoDirectory = tempoDirectory,
+                                          dzStretchRatio = dzStretchRatio,
+                                          dzStretchHeight = H_ob_max,
+                                          precision = precision,
+                                          memmapDirectory = memmapDirectory,
                                           d = d,
                                           H = Hr,
                                           lambda_f = lambda_f,
@@ -606,44 +633,53 @@ def main(javaEnvironmentPath,
     # -------------------------------------------------------------------
     if feedback:
         feedback.setProgressText('Rasterize the data')
-    # Set the ground as "building" (understand solid wall) - after getting grid size
+    # Identify building 3D coordinates (cells intersecting a building and
+    # the ground, understand solid wall) and the cells updated by the wind solver
     nx, ny, nz = nPoints.values()
-    df_gridBuil = df_gridBuil.reindex(df_gridBuil.index.append(pd.MultiIndex.from_product([range(1,nx-1),
-                                                                                          range(1,ny-1),
-                                                                                          [0]])))
-
-    # Set the buildGrid3D object to zero when a cell intersect a building 
-    buildGrid3D = pd.Series(1, index = df_wind0.index, dtype = np.int32)
-    buildGrid3D.loc[df_gridBuil.index] = 0
-    
-    # Convert building coordinates and wind speeds to numpy matrix...
-    # (note that v axis direction is changed since we first use Röckle schemes
-    # considering wind speed coming from North thus axis facing South)
-    buildGrid3D = np.array([buildGrid3D.xs(i, level = 0).unstack().values for i in range(0,nx)])
-    u0 = np.array([df_wind0[U].xs(i, level = 0).unstack().values for i in range(0,nx)])
-    v0 = -np.array([df_wind0[V].xs(i, level = 0).unstack().values for i in range(0,nx)])
-    w0 = np.array([df_wind0[W].xs(i, level = 0).unstack().values for i in range(0,nx)])
-    
-    # Identify all cells needing to be updated by the wind solver and store
-    # their coordinates in a 1D array
-    # (exclude buildings and sketch boundaries)
-    cells4Solver = np.transpose(np.where(buildGrid3D == 1))
-    cells4Solver = cells4Solver[cells4Solver[:, 0] > 0]
-    cells4Solver = cells4Solver[cells4Solver[:, 1] > 0]
-    cells4Solver = cells4Solver[cells4Solver[:, 2] > 0]
-    cells4Solver = cells4Solver[cells4Solver[:, 0] < nx - 1]
-    cells4Solver = cells4Solver[cells4Solver[:, 1] < ny - 1]
-    cells4Solver = cells4Solver[cells4Solver[:, 2] < nz - 1]
-    cells4Solver = cells4Solver.astype(np.int32)   
-    
-    # Identify building 3D coordinates
-    buildingCoordinates = np.stack(np.where(buildGrid3D==0)).astype(np.int32)
+    slabSize = OUT_OF_CORE_SLAB_SIZE if outOfCore else nx
+    buildingCoordinates, cells4Solver = \
+        rasterizeBuildings(nx = nx, ny = ny, nz = nz,
+                           buildingCells = [df_gridBuil.index.get_level_values(j).values
+                                                for j in range(3)],
+                           listCells = not denseSweep,
+                           slabSize = slabSize)
+    
+    # Change the v axis direction since we first use Röckle schemes
+    # considering wind speed coming from North thus axis facing South
+    # (slice by slice along X for memory-mapped arrays)
+    for i in range(0,nx):
+        np.negative(v0[i], out = v0[i])
+    
+    # Thickness of each vertical level when the grid is stretched above the
+    # highest obstacle (the ground level has the dz thickness) and height of
+    # the center of each level (ground excluded)
+    if dzStretchRatio == 1:
+        dzLevels = None
+        levelHeights = None
+    else:
+        dzLevels = np.concatenate([[float(dz)],
+                                   DataUtil.getLevelThicknesses(topHeight = sketchHeight,
+                                                                dz = dz,
+                                                                stretchRatio = dzStretchRatio,
+                                                                stretchHeight = H_ob_max)])
+        levelHeights = verticalWindProfile[Z].values[1:]
     
     # Interpolation is made in order to have wind speed located on the face of
     # each grid cell
-    u0[1:nx, :, :] =   (u0[0:nx-1, :, :] + u0[1:nx, :, :])/2
-    v0[:, 1:ny, :] =   (v0[:, 0:ny-1, :] + v0[:,1:ny,:])/2
-    w0[:, :, 1:nz] =   (w0[:, :, 0:nz-1] + w0[:, :, 1:nz])/2
+    # (by slabs along X in the out-of-core mode, from the last one since the 
+    # X interpolation uses the previous slice)
+    for iEnd in range(nx, 0, -slabSize):
+        iStart = max(iEnd - slabSize, 0)
+        sx = slice(max(iStart, 1), iEnd)
+        sxm = slice(max(iStart, 1) - 1, iEnd - 1)
+        u0[sx, :, :] =   (u0[sxm, :, :] + u0[sx, :, :])/2
+        v0[iStart:iEnd, 1:ny, :] =   (v0[iStart:iEnd, 0:ny-1, :] + v0[iStart:iEnd,1:ny,:])/2
+        if dzLevels is None:
+            w0[iStart:iEnd, :, 1:nz] =   (w0[iStart:iEnd, :, 0:nz-1] + w0[iStart:iEnd, :, 1:nz])/2
+        else:
+            w0[iStart:iEnd, :, 1:nz] =   (dzLevels[1:nz] * w0[iStart:iEnd, :, 0:nz-1]
+                                          + dzLevels[0:nz-1] * w0[iStart:iEnd, :, 1:nz])\
+                                         / (dzLevels[0:nz-1] + dzLevels[1:nz])
     
     # Reset input and output wind speed to zero for building cells
     u0[buildingCoordinates[0],buildingCoordinates[1],buildingCoordinates[2]] = 0
@@ -659,7 +695,10 @@ def main(javaEnvironmentPath,
     Ly = (ny-1) * meshSize
     x = np.linspace(0, Lx, nx)  
     y = np.linspace(0, Ly, ny)
-    z = np.linspace(0, Lz, nz)
+    if dzLevels is None:
+        z = np.linspace(0, Lz, nz)
+    else:
+        z = np.concatenate([[0], np.cumsum(dzLevels[1:])])
     
     print("Time spent for wind speed initialization: {0} s".format(time.time()-timeStartCalculation))
     print("Shape: " + str(u0.shape) + " - " + "Nb cells: " + str(u0.shape[0] * u0.shape[1] * u0.shape[2]))
@@ -668,27 +707,80 @@ def main(javaEnvironmentPath,
     # ------------------------------------------------------------------- 
     if feedback:
         feedback.setProgressText('Apply the wind solver equations')
-    if not onlyInitialization:
-        # Apply a mass-flow balance to have a more physical 3D wind speed field
-        u, v, w = \
-            WindSolver.solver(  x = x                       , y = y                 , z = z,
-                                dx = meshSize               , dy = meshSize         , dz = dz,
-                                u0 = u0                     , v0 = v0               , w0 = w0,
-                                buildingCoordinates = buildingCoordinates   , cells4Solver = cells4Solver,
-                                maxIterations = maxIterations, thresholdIterations = thresholdIterations,
-                                feedback = feedback)
-    else:
-        u = u0
-        v = v0
-        w = w0
+    # The H2GIS connection is only used by a single output thread while the
+    # wind solver is applied (its numba kernels release the GIL): it saves
+    # the grid point layers and prepares the rotated output grid
+    with ThreadPoolExecutor(max_workers = 1) as outputThread:
+        layerFutures = [outputThread.submit(saveData.saveTable, cursor = cursor, **layer)
+                            for layer in deferredLayers]
+        outputGridFuture = outputThread.submit(prepareOutputGrid,
+                                               cursor = cursor,
+                                               gridPoint = gridPoint,
+                                               windDirection = windDirection,
+                                               rotationCenterCoordinates = rotationCenterCoordinates,
+                                               nx = nx,
+                                               ny = ny,
+                                               saveNetcdf = saveNetcdf,
+                                               connection = connection)
+        try:
+            if not onlyInitialization:
+                # Nested iteration: the initial guess of lambda is calculated on a
+                # coarser grid
+                lambda0 = None
+                if nestedFactor > 1:
+                    if dzLevels is not None:
+                        raise ValueError("The nested iteration needs a uniform vertical grid")
+                    lambda0 = WindSolver.solveCoarseLambda(dx = meshSize, dy = meshSize, dz = dz,
+                                                           u0 = u0, v0 = v0, w0 = w0,
+                                                           buildingCoordinates = buildingCoordinates,
+                                                           factor = nestedFactor,
+                                                           maxIterations = maxIterations,
+                                                           thresholdIterations = thresholdIterations,
+                                                           feedback = feedback,
+                                                           solverMethod = solverMethod,
+                                                           nbThreads = nbThreads,
+                                                           windDirection = windDirection,
+                                                           omegaMethod = omegaMethod)
+                # Apply a mass-flow balance to have a more physical 3D wind speed field
+                u, v, w = \
+                    WindSolver.solver(  x = x                       , y = y                 , z = z,
+                                        dx = meshSize               , dy = meshSize         , dz = dz,
+                                        u0 = u0                     , v0 = v0               , w0 = w0,
+                                        buildingCoordinates = buildingCoordinates   , cells4Solver = cells4Solver,
+                                        maxIterations = maxIterations, thresholdIterations = thresholdIterations,
+                                        feedback = feedback         , solverMethod = solverMethod,
+                                        nbThreads = nbThreads       , windDirection = windDirection,
+                                        lambdaCacheDirectory = tempoDirectory if warmStart else None,
+                                        convergenceInterval = convergenceInterval,
+                                        omegaMethod = omegaMethod,
+                                        checkpointDirectory = tempoDirectory if checkpoint else None,
+                                        lambda0 = lambda0,
+                                        activeDistance = activeDistance,
+                                        activeTolerance = activeTolerance,
+                                        memmapDirectory = memmapDirectory,
+                                        dzLevels = dzLevels)
+            else:
+                u = u0
+                v = v0
+                w = w0
+        finally:
+            # Wait for the output thread before using again the H2GIS
+            # connection (its exceptions are raised even if the solver failed)
+            for layerFuture in layerFutures:
+                layerFuture.result()
+            rotated_grid, dist_rot_x, dist_rot_y, longitudeLatitude = \
+                outputGridFuture.result()
         
     # Wind speed values are recentered to the middle of the cells
-    u[0:nx-1 ,0:ny-1 ,0:nz-1]=   (u[0:nx-1, 0:ny-1, 0:nz-1] + u[1:nx, 0:ny-1, 0:nz-1])/2
-    v[0:nx-1 ,0:ny-1, 0:nz-1]=   (v[0:nx-1, 0:ny-1, 0:nz-1] + v[0:nx-1, 1:ny, 0:nz-1])/2
-    w[0:nx-1, 0:ny-1, 0:nz-1]=   (w[0:nx-1, 0:ny-1, 0:nz-1] + w[0:nx-1, 0:ny-1, 1:nz])/2
-    u0[0:nx-1 ,0:ny-1 ,0:nz-1]=   (u0[0:nx-1, 0:ny-1, 0:nz-1] + u0[1:nx, 0:ny-1, 0:nz-1])/2
-    v0[0:nx-1 ,0:ny-1, 0:nz-1]=   (v0[0:nx-1, 0:ny-1, 0:nz-1] + v0[0:nx-1, 1:ny, 0:nz-1])/2
-    w0[0:nx-1, 0:ny-1, 0:nz-1]=   (w0[0:nx-1, 0:ny-1, 0:nz-1] + w0[0:nx-1, 0:ny-1, 1:nz])/2
+    # (by slabs along X in the out-of-core mode, from the first one since the
+    # X interpolation uses the next slice)
+    for wind, shift in zip([u, v, w, u0, v0, w0], [(1, 0, 0), (0, 1, 0), (0, 0, 1)] * 2):
+        for iStart in range(0, nx - 1, slabSize):
+            iEnd = min(iStart + slabSize, nx - 1)
+            wind[iStart:iEnd, 0:ny-1, 0:nz-1] = (wind[iStart:iEnd, 0:ny-1, 0:nz-1]
+                                                 + wind[iStart+shift[0]:iEnd+shift[0],
+                                                        shift[1]:ny-1+shift[1],
+                                                        shift[2]:nz-1+shift[2]])/2
     
     # Reset input and output wind speed to zero for building cells
     u[buildingCoordinates[0],buildingCoordinates[1],buildingCoordinates[2]] = 0
@@ -701,43 +793,40 @@ def main(javaEnvironmentPath,
     # -------------------------------------------------------------------
     # 11. ROTATE THE WIND FIELD TO THE INITIAL DISPOSITION --------------
     # ------------------------------------------------------------------- 
-    # Get the relative position of the upper right corner of the grid from
-    # the center of rotation used to rotate the grid
-    cursor.execute(
-        """{0};{1}
-        """.format(DataUtil.createIndex(tableName=gridPoint, 
-                                        fieldName=ID_POINT_X,
-                                        isSpatial=False),
-                    DataUtil.createIndex(tableName=gridPoint, 
-                                         fieldName=ID_POINT_Y,
-                                         isSpatial=False)))
-    cursor.execute(
-        """
-        SELECT  {3}-ST_X(a.{0}) AS DIST_ROT_X,
-                {4}-ST_Y(a.{0}) AS DIST_ROT_Y
-        FROM {5} AS a
-        WHERE   a.{1} = (SELECT MAX({1}) FROM {5})
-                AND a.{2} = (SELECT MAX({2}) FROM {5})
-        """.format(GEOM_FIELD                   , ID_POINT_X,
-                   ID_POINT_Y                   , rotationCenterCoordinates[0],
-                   rotationCenterCoordinates[1] , gridPoint))
-    dist_rot_x, dist_rot_y = cursor.fetchall()[0]
+    # Set the position of the grid relatively to the center of rotation
+    # (obtained by the output thread)
     x += dist_rot_x
     y += dist_rot_y
     
-    x_rot = np.zeros((nx, ny))
-    y_rot = np.zeros((nx, ny))
-    x_rot, y_rot, u_rot, v_rot = rotateData(theta = -windDirection*np.pi/180, nx = nx, 
-                                            ny = ny                         , nz = nz, 
-                                            x = x                           , y = y,
-                                            x_rot = x_rot                   , y_rot = y_rot,
-                                            u = u                           , v = v)
-
-    x_rot, y_rot, u0_rot, v0_rot = rotateData(theta = -windDirection*np.pi/180  , nx = nx, 
-                                              ny = ny                           , nz = nz, 
-                                              x = x                             , y = y,
-                                              x_rot = x_rot                     , y_rot = y_rot,
-                                              u = u0                            , v = v0)
+    # The initial wind field is rotated in a second thread at the same time
+    # (the rotation kernel releases the GIL). The rotated fields are 
+    # memory-mapped files in the out-of-core mode. The angle and the 
+    # coordinates are converted to match the signature of the compiled kernel
+    theta = -float(windDirection) * np.pi / 180
+    x = np.ascontiguousarray(x, dtype = np.float64)
+    y = np.ascontiguousarray(y, dtype = np.float64)
+    u_rot = WindSolver.allocateArray(u.shape, u.dtype, memmapDirectory, "u_rot")
+    v_rot = WindSolver.allocateArray(v.shape, v.dtype, memmapDirectory, "v_rot")
+    u0_rot = WindSolver.allocateArray(u0.shape, u0.dtype, memmapDirectory, "u0_rot")
+    v0_rot = WindSolver.allocateArray(v0.shape, v0.dtype, memmapDirectory, "v0_rot")
+    with ThreadPoolExecutor(max_workers = 1) as rotationThread:
+        rotation0Future = rotationThread.submit(rotateData,
+                                                theta = theta,
+                                                nx = nx, ny = ny, nz = nz,
+                                                x = x, y = y,
+                                                x_rot = np.zeros((nx, ny)),
+                                                y_rot = np.zeros((nx, ny)),
+                                                u = u0, v = v0,
+                                                u_rot = u0_rot, v_rot = v0_rot)
+        x_rot = np.zeros((nx, ny))
+        y_rot = np.zeros((nx, ny))
+        rotateData(theta = theta                   , nx = nx, 
+                   ny = ny                         , nz = nz, 
+                   x = x                           , y = y,
+                   x_rot = x_rot                   , y_rot = y_rot,
+                   u = u                           , v = v,
+                   u_rot = u_rot                   , v_rot = v_rot)
+        rotation0Future.result()
     # Set the real (x,y) grid coordinates
     x_rot += rotationCenterCoordinates[0]
     y_rot += rotationCenterCoordinates[1]
@@ -745,12 +834,8 @@ def main(javaEnvironmentPath,
     # -------------------------------------------------------------------
     # 12. SAVE EACH OF THE UROCK OUTPUT ---------------------------------
     # ------------------------------------------------------------------- 
-    # First rotate the coordinates of the grid of points
-    rotated_grid = Obstacles.windRotation(cursor = cursor,
-                                          dicOfInputTables = {gridPoint: gridPoint},
-                                          rotateAngle = - windDirection,
-                                          rotationCenterCoordinates = rotationCenterCoordinates)[0][gridPoint]
-    
+    # The coordinates of the grid of points have already been rotated by
+    # the output thread
     dicVectorTables, netcdf_path =\
         saveData.saveBasicOutputs(cursor = cursor                , z_out = z_out,
                                   dz = dz                        , u = u_rot,
@@ -759,7 +844,9 @@ def main(javaEnvironmentPath,
                                   outputFilePath = outputFilePath, outputFilename = outputFilename,
                                   meshSize = meshSize            , outputRaster = outputRaster,
                                   saveRaster = saveRaster        , saveVector = saveVector,
-                                  saveNetcdf = saveNetcdf        , prefix_name = prefix)
+                                  saveNetcdf = saveNetcdf        , prefix_name = prefix,
+                                  levelHeights = levelHeights,
+                                  longitudeLatitude = longitudeLatitude)
     
     # Save also the initialisation field if needed
     if debug:
@@ -771,7 +858,9 @@ def main(javaEnvironmentPath,
                                       outputFilePath = tempoDirectory, outputFilename = "wind_initiatlisation",
                                       meshSize = meshSize            , outputRaster = outputRaster,
                                       saveRaster = saveRaster        , saveVector = saveVector,
-                                      saveNetcdf = saveNetcdf        , prefix_name = prefix)  
+                                      saveNetcdf = saveNetcdf        , prefix_name = prefix,
+                                      levelHeights = levelHeights,
+                                      longitudeLatitude = longitudeLatitude)
     else:
         dicVectorTables_ini = None
         netcdf_path_ini = None
@@ -780,10 +869,170 @@ def main(javaEnvironmentPath,
             buildingCoordinates, cursor, rotated_grid, rotationCenterCoordinates,\
             verticalWindProfile, dicVectorTables, netcdf_path, netcdf_path_ini
 
-@jit(nopython=True)
-def rotateData(theta, nx, ny, nz, x, y, x_rot, y_rot, u, v):
-    u_rot = np.zeros(u.shape)
-    v_rot = np.zeros(v.shape)
+def prepareOutputGrid(cursor, gridPoint, windDirection, rotationCenterCoordinates,
+                      nx, ny, saveNetcdf = True, connection = None):
+    """ Prepare the grid of points used to save the outputs: get its position
+    relatively to the center of rotation, rotate it back to the initial
+    disposition and get the longitude and latitude of each point. Only uses
+    the H2GIS database, thus may run while the wind solver is applied.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            cursor: conn.cursor
+                A cursor object, used to perform spatial SQL queries
+            gridPoint: String
+                Name of the grid point table
+            windDirection: float
+                Wind direction (° clock-wise from North)
+            rotationCenterCoordinates: tuple of float
+                x and y values of the point used as center of rotation
+            nx: int
+                Number of grid points along X-axis
+            ny: int
+                Number of grid points along Y-axis
+            saveNetcdf: boolean, default True
+                Whether or not the longitude and latitude are needed
+            connection: jaydebeapi.Connection, default None
+                Connection of the cursor, used to fetch the longitude and 
+                latitude as arrays (row-wise fetch if None)
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            rotated_grid: String
+                Name of the rotated grid point table
+            dist_rot_x: float
+                X distance between the center of rotation and the upper 
+                right corner of the grid
+            dist_rot_y: float
+                Y distance between the center of rotation and the upper 
+                right corner of the grid
+            longitudeLatitude: tuple of 2D array
+                Longitude and latitude of each (X, Y) grid point (None if
+                saveNetcdf is False)"""
+    # Get the relative position of the upper right corner of the grid from
+    # the center of rotation used to rotate the grid
+    cursor.execute(
+        """{0};{1}
+        """.format(DataUtil.createIndex(tableName=gridPoint, 
+                                        fieldName=ID_POINT_X,
+                                        isSpatial=False),
+                    DataUtil.createIndex(tableName=gridPoint, 
+                                         fieldName=ID_POINT_Y,
+                                         isSpatial=False)))
+    cursor.execute(
+        """
+        SELECT  {3}-ST_X(a.{0}) AS DIST_ROT_X,
+                {4}-ST_Y(a.{0}) AS DIST_ROT_Y
+        FROM {5} AS a
+        WHERE   a.{1} = (SELECT MAX({1}) FROM {5})
+                AND a.{2} = (SELECT MAX({2}) FROM {5})
+        """.format(GEOM_FIELD                   , ID_POINT_X,
+                   ID_POINT_Y                   , rotationCenterCoordinates[0],
+                   rotationCenterCoordinates[1] , gridPoint))
+    dist_rot_x, dist_rot_y = cursor.fetchall()[0]
+    
+    # Rotate the coordinates of the grid of points
+    rotated_grid = Obstacles.windRotation(cursor = cursor,
+                                          dicOfInputTables = {gridPoint: gridPoint},
+                                          rotateAngle = - windDirection,
+                                          rotationCenterCoordinates = rotationCenterCoordinates)[0][gridPoint]
+    
+    # Get the longitude and latitude of each point (for the NetCDF file)
+    longitudeLatitude = None
+    if saveNetcdf:
+        longitudeLatitude = saveData.getLongitudeLatitude(cursor = cursor,
+                                                          gridName = rotated_grid,
+                                                          nx = nx,
+                                                          ny = ny,
+                                                          connection = connection)
+    
+    return rotated_grid, dist_rot_x, dist_rot_y, longitudeLatitude
+
+def compileKernels(precisions = (PRECISION, )):
+    """ Compile (or load from the numba cache) the numba kernels of the
+    calculation (the rotation of the wind field and the main solver kernels)
+    for each precision of the 3D wind fields. Used to warm up the kernels in 
+    the background when the plugin is loaded.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            precisions: tuple of str, default (PRECISION, )
+                Precisions of the 3D wind fields
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            None"""
+    for precision in precisions:
+        field = numba.from_dtype(np.dtype(precision))[:, :, ::1]
+        rotateData.compile((numba.float64, numba.int64, numba.int64, numba.int64,
+                            numba.float64[::1], numba.float64[::1],
+                            numba.float64[:, ::1], numba.float64[:, ::1],
+                            field, field, field, field))
+        WindSolver.compileKernels(precision)
+
+def rasterizeBuildings(nx, ny, nz, buildingCells, listCells = True, slabSize = None):
+    """ Identify the building 3D coordinates (cells intersecting a building
+    and the ground, understand solid wall), sorted as the 3D grid memory 
+    order, and the coordinates of the cells updated by the wind solver 
+    (buildings and sketch boundaries excluded). No 3D grid of the domain is
+    created: the cells to solve are identified by slabs along X.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            nx: int
+                Number of grid points along X-axis
+            ny: int
+                Number of grid points along Y-axis
+            nz: int
+                Number of grid points along Z-axis
+            buildingCells: list of 1D arrays
+                X, Y and Z grid indices of the cells intersecting a building
+            listCells: boolean, default True
+                Whether the coordinates of the cells to solve are needed
+                (not needed when the solver sweeps directly the 3D grid)
+            slabSize: int, default None
+                Number of X slices of a slab (None: a single slab)
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            buildingCoordinates: 2D array
+                Building 3D coordinates (3 x number of building cells)
+            cells4Solver: 2D array
+                Coordinates of the cells to solve (number of cells x 3),
+                None if listCells is False"""
+    buildX, buildY, buildZ = buildingCells
+    groundX, groundY = np.meshgrid(np.arange(1, nx-1), np.arange(1, ny-1), indexing = "ij")
+    buildingIndex = np.unique(np.concatenate([
+        np.ravel_multi_index((buildX, buildY, buildZ), (nx, ny, nz)),
+        np.ravel_multi_index((groundX.ravel(), groundY.ravel(), 0), (nx, ny, nz))]))
+    buildingCoordinates = np.stack(np.unravel_index(buildingIndex, (nx, ny, nz))).astype(np.int32)
+    
+    if not listCells:
+        return buildingCoordinates, None
+    slabSize = slabSize or nx
+    slabCells = []
+    for iStart in range(1, nx - 1, slabSize):
+        iEnd = min(iStart + slabSize, nx - 1)
+        isSolved = np.ones((iEnd - iStart, ny - 2, nz - 2), dtype = bool)
+        bStart, bEnd = np.searchsorted(buildingCoordinates[0], [iStart, iEnd])
+        bx, by, bz = buildingCoordinates[:, bStart:bEnd]
+        isInterior = (by > 0) & (by < ny - 1) & (bz > 0) & (bz < nz - 1)
+        isSolved[bx[isInterior] - iStart, by[isInterior] - 1, bz[isInterior] - 1] = False
+        slabCells.append(np.argwhere(isSolved) + [iStart, 1, 1])
+    cells4Solver = np.concatenate(slabCells).astype(np.int32)
+    
+    return buildingCoordinates, cells4Solver
+
+@jit(nopython=True, nogil=True, cache=True)
+def rotateData(theta, nx, ny, nz, x, y, x_rot, y_rot, u, v, u_rot, v_rot):
+    # The rotated fields are calculated into the arrays given (possibly
+    # memory-mapped), sweeping the grid in the memory order
     rot = np.array([[math.cos(theta), -math.sin(theta)],
                     [math.sin(theta), math.cos(theta)]])
     xmax = x.max()
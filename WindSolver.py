@@ -13,13 +13,74 @@ Created on Mon Mar 29 14:57:25 2021
 """
 import numpy as np
 import time
-from .GlobalVariables import MAX_ITERATIONS, THRESHOLD_ITERATIONS, DESCENDING_Y
-from numba import jit
-import pandas as pd
+import os
+import sys
+import glob
+import hashlib
+import json
+import multiprocessing
+import tempfile
+from multiprocessing import shared_memory
+from collections import OrderedDict
+from .GlobalVariables import MAX_ITERATIONS, THRESHOLD_ITERATIONS, DESCENDING_Y,\
+    SOLVER_METHOD, SOLVER_NB_THREADS, MULTIGRID_PRE_SMOOTHING,\
+    MULTIGRID_POST_SMOOTHING, MULTIGRID_COARSEST_SMOOTHING, MULTIGRID_MIN_CELLS,\
+    PCG_PRECONDITIONER, PCG_RESIDUAL_THRESHOLD, SOLVER_CACHE_SIZE,\
+    LAMBDA_CACHE_PREFIX, LAMBDA_CACHE_MAX_ANGLE, LAMBDA_CACHE_SIZE,\
+    CONVERGENCE_CHECK_INTERVAL, SOLVER_LOG_INTERVAL, SOLVER_OMEGA_METHOD,\
+    OMEGA_ADAPT_ITERATIONS, OMEGA_ADAPT_TOLERANCE, OMEGA_MAX_JACOBI_RADIUS,\
+    DECOMPOSITION_NB_PROCESSES, DECOMPOSITION_HALO_SIZE,\
+    DECOMPOSITION_INNER_ITERATIONS, DECOMPOSITION_START_METHOD,\
+    CHECKPOINT_PREFIX, CHECKPOINT_INTERVAL, NESTED_ITERATION_FACTOR,\
+    ACTIVE_SET_DISTANCE, ACTIVE_SET_TOLERANCE, ACTIVE_SET_UPDATE_INTERVAL,\
+    OUT_OF_CORE_SLAB_SIZE
+import numba
+from numba import jit, prange, types
+from numba.typed import List
+try:
+    from scipy import sparse
+except ImportError:
+    # scipy is only needed by the "pcg" solver method
+    sparse = None
+
+# Operators of the last geometries solved (the least recently used first)
+solverCache = OrderedDict()
+
+# Shared arrays and parameters of a worker process of the "schwarz" method
+schwarzWorkerData = {}
+
+class SolverCanceled(Exception):
+    """ Raised when the wind solver is canceled by the user (the state of the
+    solver being saved in the checkpoint directory, if any)"""
+    pass
+
+# Bits of the obstacle flags of a cell: a bit is set when the corresponding
+# coefficient of the lambda equation (table 1 in Pardyjak and Brown, 2003)
+# is 0. Coefficients o, p and q are 0.5 when respectively e or f, g or h and
+# m or n are 0 (1 otherwise)
+WALL_E = 1
+WALL_F = 2
+WALL_G = 4
+WALL_H = 8
+WALL_M = 16
+WALL_N = 32
+# Bit set for the cells where lambda is calculated (neither building nor
+# sketch boundary)
+SOLVED = 64
 
 def solver(x, y, z, dx, dy, dz, u0, v0, w0, buildingCoordinates, cells4Solver,
            maxIterations = MAX_ITERATIONS, thresholdIterations = THRESHOLD_ITERATIONS,
-           feedback = None):
+           feedback = None, solverMethod = SOLVER_METHOD, nbThreads = SOLVER_NB_THREADS,
+           preconditioner = PCG_PRECONDITIONER, residualThreshold = PCG_RESIDUAL_THRESHOLD,
+           windDirection = None, cacheSize = SOLVER_CACHE_SIZE,
+           lambdaCacheDirectory = None, lambdaCacheMaxAngle = LAMBDA_CACHE_MAX_ANGLE,
+           convergenceInterval = CONVERGENCE_CHECK_INTERVAL, iterationCallback = None,
+           omegaMethod = SOLVER_OMEGA_METHOD, nbProcesses = DECOMPOSITION_NB_PROCESSES,
+           haloSize = DECOMPOSITION_HALO_SIZE, innerIterations = DECOMPOSITION_INNER_ITERATIONS,
+           checkpointDirectory = None, checkpointInterval = CHECKPOINT_INTERVAL,
+           resume = True, lambda0 = None, returnLambda = False,
+           activeDistance = ACTIVE_SET_DISTANCE, activeTolerance = ACTIVE_SET_TOLERANCE,
+           memmapDirectory = None, dzLevels = None):
     """ Use the mass-balance solver minimizing the modification of the initial
     wind speed field. The method used is based on Pardyjak and Brown (2003).
     
@@ -44,7 +105,9 @@ def solver(x, y, z, dx, dy, dz, u0, v0, w0, buildingCoordinates, cells4Solver,
             dz: int
                 Grid spacing along Z-axis
             u0: 3D array
-                Initialized 3D wind speed value in X direction
+                Initialized 3D wind speed value in X direction (its dtype,
+                float64 or float32, sets the precision of all the 3D fields
+                of the solver)
             v0: 3D array
                 Initialized 3D wind speed value in Y direction 
             w0: 3D array
@@ -53,6 +116,9 @@ def solver(x, y, z, dx, dy, dz, u0, v0, w0, buildingCoordinates, cells4Solver,
                 Building 3D coordinates
             cells4Solver: 1D array
                 Array of 3D cell coordinates for which the wind solver is applied
+                (None to sweep directly the 3D grid, the cells to solve being 
+                identified by the obstacle flags: no list of coordinates is 
+                stored for the "sor" and "red-black" methods)
             maxIterations: int, default MAX_ITERATIONS
                 Maximum number of wind solver iterations (solver stops if reached)
             thresholdIterations: float, default THRESHOLD_ITERATIONS
@@ -61,7 +127,125 @@ def solver(x, y, z, dx, dy, dz, u0, v0, w0, buildingCoordinates, cells4Solver,
                 threshold, the wind solver stops
             feedback: Qgis.core class QgsProcessingFeedback
                 Base class for providing feedback to QGIS from a processing algorithm (if not in standalone mode).
-        
+            solverMethod: String, default SOLVER_METHOD
+                Method used to solve the lambda equation:
+                    - "sor": lexicographic successive over-relaxation
+                    - "red-black": checkerboard ordered successive over-relaxation
+                    (cells of a same color are updated in parallel)
+                    - "multigrid": geometric multigrid V-cycles (red-black
+                    relaxation used as smoother, obstacles restricted on coarse grids)
+                    - "pcg": preconditioned conjugate gradient applied to the
+                    sparse matrix of the lambda equation (needs scipy)
+                    - "zline": vertical line successive over-relaxation (the
+                    cells of a column are solved at once, columns of a same
+                    color being updated in parallel), for grids where dz is
+                    much smaller than dx
+                    - "schwarz": overlapping domain decomposition, the tiles of
+                    the (nx, ny) plane being relaxed in parallel processes
+                    sharing the 3D fields (for grids too large for one process),
+                    "sor" being used if no Python interpreter is found to
+                    start the processes
+            nbThreads: int, default SOLVER_NB_THREADS
+                Number of threads used by the parallel kernels (None: all
+                threads available to numba)
+            preconditioner: String, default PCG_PRECONDITIONER
+                Preconditioner used by the "pcg" method:
+                    - "jacobi": diagonal of the matrix
+                    - "ssor": symmetric successive over-relaxation
+                    - "ic": incomplete Cholesky factorization without fill-in
+            residualThreshold: float, default PCG_RESIDUAL_THRESHOLD
+                Threshold for stopping the "pcg" method: when the true relative
+                residual norm of the lambda equation goes under this threshold,
+                the wind solver stops
+            windDirection: float, default None
+                Wind direction of the calculation (only used to identify the
+                operator in the solver cache)
+            cacheSize: int, default SOLVER_CACHE_SIZE
+                Number of geometries for which the operator of the lambda 
+                equation is kept in memory: a new calculation on the same 
+                geometry (e.g. with an other reference wind speed or wind
+                profile) only updates the right hand side of the equation
+            lambdaCacheDirectory: String, default None
+                Directory where the converged lambda fields are saved and
+                used as initial guess by the next calculations on the same
+                grid (None to start from lambda = 1 without saving lambda)
+            lambdaCacheMaxAngle: float, default LAMBDA_CACHE_MAX_ANGLE
+                Maximum wind direction difference (°) for using the lambda
+                field of an other geometry having the same grid as initial guess
+            convergenceInterval: int, default CONVERGENCE_CHECK_INTERVAL
+                Number of iterations between two checks of the convergence
+                criterion (the relaxation kernels only sum the variation of 
+                lambda during the sweeps where it is checked)
+            iterationCallback: function, default None
+                Function called with the iteration number and the convergence
+                criterion each time the convergence is checked and not reached 
+                (None: progress printed and sent to QGIS at most every 
+                SOLVER_LOG_INTERVAL seconds)
+            omegaMethod: String, default SOLVER_OMEGA_METHOD
+                Relaxation factor of the "sor", "red-black" and "zline" methods:
+                    - "fixed": calculated from the horizontal grid size only
+                    (optimal factor of the 3D grid without obstacle for "zline")
+                    - "adaptive": starts from the optimal factor of the 3D grid
+                    without obstacle and is increased every 
+                    OMEGA_ADAPT_ITERATIONS iterations from the observed
+                    convergence rate
+                    - "chebyshev": Chebyshev acceleration of the "red-black" 
+                    and "zline" methods (relaxation factor updated at each 
+                    half-sweep)
+            nbProcesses: int, default DECOMPOSITION_NB_PROCESSES
+                Number of processes (and of tiles) of the "schwarz" method
+                (None: number of CPUs)
+            haloSize: int, default DECOMPOSITION_HALO_SIZE
+                Number of cells overlapping the neighbouring tiles ("schwarz" method)
+            innerIterations: int, default DECOMPOSITION_INNER_ITERATIONS
+                Number of sweeps of each tile between two exchanges of the 
+                halos ("schwarz" method)
+            checkpointDirectory: String, default None
+                Directory where lambda (memory-mapped file) and the iteration
+                state are saved every 'checkpointInterval' iterations and when
+                the calculation is canceled (None: no checkpoint). The 
+                checkpoint is removed once the solver is finished
+            checkpointInterval: int, default CHECKPOINT_INTERVAL
+                Number of iterations between two checkpoints
+            resume: boolean, default True
+                Whether a calculation interrupted (checkpoint of the same
+                geometry and initial wind field found in 'checkpointDirectory')
+                is resumed from its last checkpoint
+            lambda0: 3D array, default None
+                Initial guess of lambda for the cells where it is calculated
+                (e.g. prolonged from a coarser grid, see 'solveCoarseLambda'),
+                used instead of the lambda field saved by a previous calculation
+            returnLambda: boolean, default False
+                Whether lambda is also returned
+            activeDistance: int, default ACTIVE_SET_DISTANCE
+                Active-set mode of the "sor" and "red-black" methods (None to
+                solve all cells): only the cells located at less than 
+                'activeDistance' cells from a cell where the initial wind 
+                field is divergent are solved (lambda being 0 elsewhere, the
+                undisturbed wind field being divergence free). Every
+                ACTIVE_SET_UPDATE_INTERVAL iterations (and before stopping),
+                the active cells are extended by 'activeDistance' cells around
+                the cells where lambda is significant
+            activeTolerance: float, default ACTIVE_SET_TOLERANCE
+                Relative tolerance (to the maximum of the initial divergence
+                and of lambda) above which a cell extends the active cells
+            memmapDirectory: str, default None
+                Out-of-core mode: directory where the 3D wind fields and the 
+                lambda buffers are allocated as memory-mapped files (None to
+                allocate them in RAM). The relaxation sweeps the grid slab by
+                slab along X (the memory order of the arrays) and the final 
+                wind field is calculated by slabs of OUT_OF_CORE_SLAB_SIZE 
+                cells. Only the 3D fields are out of core: the obstacle flags
+                (one byte per cell, built from boolean masks of the 3D grid)
+                and 'cells4Solver' (12 bytes per cell solved, None for the
+                dense sweep) stay in RAM, as the structures of the "multigrid",
+                "pcg" and active-set modes
+            dzLevels: 1D array, default None
+                Thickness of each vertical level (the Z index of the grid) of
+                a vertically stretched grid (None for a uniform grid of 
+                resolution 'dz'). Not available with the "multigrid" and 
+                "pcg" methods
+
     		Returns
     		_ _ _ _ _ _ _ _ _ _ 
     
@@ -70,9 +254,33 @@ def solver(x, y, z, dx, dy, dz, u0, v0, w0, buildingCoordinates, cells4Solver,
             v: 3D array
                 Updated 3D wind speed value in Y direction 
             w: 3D array
-                Updated 3D wind speed value in Z direction"""    
+                Updated 3D wind speed value in Z direction
+            lambdaN1: 3D array
+                Solution of the lambda equation (only if 'returnLambda' is True)
+    
+    		Raises
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            SolverCanceled
+                If the calculation is canceled from QGIS (the state of the 
+                solver being saved in 'checkpointDirectory')"""    
 
     print("Start to apply the wind solver")
+    
+    # The 3D fields are calculated with the precision of the initial wind field
+    dtype = u0.dtype
+    # The grid spacings (integers when set from QGIS) are converted once to
+    # match the signatures of the compiled kernels
+    dx, dy, dz = float(dx), float(dy), float(dz)
+    if dzLevels is not None:
+        dzLevels = np.ascontiguousarray(dzLevels, dtype = np.float64)
+    if cells4Solver is not None:
+        cells4Solver = np.ascontiguousarray(cells4Solver, dtype = np.int32)
+    
+    # Compile (or load from the cache) the kernels apart from the solver time
+    timeStartCompilation = time.time()
+    compileKernels(dtype)
+    print("Time spent to compile the wind solver kernels: {0} s".format(time.time()-timeStartCompilation))
     timeStartCalculation = time.time()
 
     # Get number of cells in each 3 dimensions
@@ -81,19 +289,12 @@ def solver(x, y, z, dx, dy, dz, u0, v0, w0, buildingCoordinates, cells4Solver,
     nz = z.size
     
     # Create empty matrix for the 3D wind speed calculation
-    u = np.zeros((nx, ny, nz))
-    v = np.zeros((nx, ny, nz))
-    w = np.zeros((nx, ny, nz))
-
-    # Preallocating lambda and lambda + 1 and set values to 0 on sketch boundaries
-    lambdaN = np.ones([nx, ny, nz])
-    lambdaN1 = np.ones([nx, ny, nz])
-    lambdaN[0, :, :] = 0.
-    lambdaN[:, 0, :] = 0.
-    lambdaN[:, :, 0] = 0.
-    lambdaN[-1, :, :] = 0.
-    lambdaN[:, -1, :] = 0.
-    lambdaN[:, :, -1] = 0.
+    u = allocateArray((nx, ny, nz), dtype, memmapDirectory, "u")
+    v = allocateArray((nx, ny, nz), dtype, memmapDirectory, "v")
+    w = allocateArray((nx, ny, nz), dtype, memmapDirectory, "w")
+
+    # Preallocating lambda and set values to 0 on sketch boundaries
+    lambdaN1 = allocateArray((nx, ny, nz), dtype, memmapDirectory, "lambda", 1.)
     lambdaN1[0, :, :] = 0.
     lambdaN1[:, 0, :] = 0.
     lambdaN1[:, :, 0] = 0.
@@ -112,120 +313,366 @@ def solver(x, y, z, dx, dy, dz, u0, v0, w0, buildingCoordinates, cells4Solver,
     alpha2 = 1.
     eta = alpha1 / alpha2
     A = dx ** 2 / dy ** 2
-    B = eta ** 2 * dx ** 2 / dz ** 2
+    # The vertical coefficients depend on the level of a stretched grid
+    isStretched = dzLevels is not None
+    if not isStretched:
+        dzLevels = np.full(nz, dz, dtype = np.float64)
+    if isStretched and solverMethod in ("multigrid", "pcg"):
+        raise ValueError("The '{0}' solver method needs a uniform vertical grid".format(solverMethod))
+    # The processes of the "schwarz" method need a Python interpreter to be
+    # started: the serial "sor" method is used if none is found
+    if solverMethod == "schwarz" and DECOMPOSITION_START_METHOD != "fork"\
+        and getPythonExecutable() is None:
+        print("No Python interpreter found to start the 'schwarz' processes, the 'sor' method is used")
+        solverMethod = "sor"
+    B = eta ** 2 * dx ** 2 / dzLevels ** 2
+    dzFaces, zWeights = calcVerticalWeights(dzLevels)
+    
+    # The adaptive and Chebyshev relaxation factors start from the spectral
+    # radius of the Jacobi iteration on the 3D grid without obstacle (the
+    # vertical direction dominates when dz is smaller than dx)
+    if omegaMethod not in ("fixed", "adaptive", "chebyshev"):
+        raise ValueError("Unknown relaxation factor method '{0}'".format(omegaMethod))
+    if omegaMethod == "chebyshev" and solverMethod not in ("red-black", "zline"):
+        raise ValueError("The 'chebyshev' relaxation factor needs the 'red-black' or 'zline' solver method")
+    # The vertical coupling is solved exactly by the line relaxation: the 
+    # default relaxation factor does not apply
+    if omegaMethod != "fixed" or solverMethod == "zline":
+        jacobiRadius = estimateJacobiRadius(nx = nx, ny = ny, nz = nz, A = A, B = B.max(),
+                                            zLine = solverMethod == "zline")
+        omega = calcOptimalOmega(jacobiRadius)
 
+    # Get the operator of the lambda equation already calculated for this
+    # geometry (if any)
+    geometryHash = hashGeometry(buildingCoordinates = buildingCoordinates,
+                                dzLevels = dzLevels if isStretched else None)
+    solverData = getSolverData(geometryHash = geometryHash,
+                               shape = (nx, ny, nz), dx = dx, dy = dy, dz = dz,
+                               windDirection = windDirection, dtype = dtype,
+                               cacheSize = cacheSize)
+    
     # Set coefficients according to table 1 (Pardyjak et Brown, 2003) 
-    # to modify the Equation near obstacles
-    e = np.ones([nx, ny, nz])
-    f = np.ones([nx, ny, nz])
-    g = np.ones([nx, ny, nz])
-    h = np.ones([nx, ny, nz])
-    m = np.ones([nx, ny, nz])
-    n = np.ones([nx, ny, nz])
-    o = np.ones([nx, ny, nz])
-    p = np.ones([nx, ny, nz])
-    q = np.ones([nx, ny, nz])
-    
-    # Identify index having wall below AND front, left, right or behind
-    indBelow = pd.MultiIndex.from_tuples(list(zip(*[buildingCoordinates[0], 
-                                                    buildingCoordinates[1], 
-                                                    buildingCoordinates[2] + 1])))
-    indBelowFront = indBelow.intersection(pd.MultiIndex.from_tuples(list(zip(*[buildingCoordinates[0], 
-                                                                               buildingCoordinates[1] - 1, 
-                                                                               buildingCoordinates[2]]))))
-    indBelowBehind = indBelow.intersection(pd.MultiIndex.from_tuples(list(zip(*[buildingCoordinates[0], 
-                                                                               buildingCoordinates[1] + 1, 
-                                                                               buildingCoordinates[2]]))))
-    indBelowLeft = indBelow.intersection(pd.MultiIndex.from_tuples(list(zip(*[buildingCoordinates[0] + 1, 
-                                                                               buildingCoordinates[1], 
-                                                                               buildingCoordinates[2]]))))
-    indBelowRight = indBelow.intersection(pd.MultiIndex.from_tuples(list(zip(*[buildingCoordinates[0] - 1, 
-                                                                               buildingCoordinates[1], 
-                                                                               buildingCoordinates[2]]))))
-    indBelowAnyAround = indBelowFront.union(indBelowBehind).union(indBelowLeft).union(indBelowRight)
-    indBelowLeftRight = indBelowLeft.union(indBelowRight)
-    indBelowFrontBehind = indBelowFront.union(indBelowBehind)  
+    # to modify the Equation near obstacles (stored as bit flags)
+    if "flags" not in solverData:
+        solverData["flags"] = setObstacleFlags(nx = nx, ny = ny, nz = nz,
+                                               buildingCoordinates = buildingCoordinates)
+    flags = solverData["flags"]
     
-    # Go descending order along y
-    if DESCENDING_Y:
-        e[buildingCoordinates[0] + 1, buildingCoordinates[1], buildingCoordinates[2]] = 0.
-        e[indBelowLeft.get_level_values(0), indBelowLeft.get_level_values(1), indBelowLeft.get_level_values(2)] = 0.
-        f[buildingCoordinates[0] - 1, buildingCoordinates[1], buildingCoordinates[2]] = 0.
-        f[indBelowRight.get_level_values(0), indBelowRight.get_level_values(1), indBelowRight.get_level_values(2)] = 0. 
-        g[buildingCoordinates[0], buildingCoordinates[1] + 1, buildingCoordinates[2]] = 0.
-        g[indBelowBehind.get_level_values(0), indBelowBehind.get_level_values(1), indBelowBehind.get_level_values(2)] = 0.
-        h[buildingCoordinates[0], buildingCoordinates[1] - 1, buildingCoordinates[2]] = 0.  
-        h[indBelowFront.get_level_values(0), indBelowFront.get_level_values(1), indBelowFront.get_level_values(2)] = 0.
-        m[buildingCoordinates[0], buildingCoordinates[1], buildingCoordinates[2] + 1] = 0.
-        n[buildingCoordinates[0], buildingCoordinates[1], buildingCoordinates[2] - 1] = 0.
-    else:    
-        e[buildingCoordinates[0] - 1, buildingCoordinates[1], buildingCoordinates[2]] = 0.
-        e[indBelowRight.get_level_values(0), indBelowRight.get_level_values(1), indBelowRight.get_level_values(2)] = 0.        
-        f[buildingCoordinates[0] + 1, buildingCoordinates[1], buildingCoordinates[2]] = 0.
-        f[indBelowLeft.get_level_values(0), indBelowLeft.get_level_values(1), indBelowLeft.get_level_values(2)] = 0.    
-        g[buildingCoordinates[0], buildingCoordinates[1] - 1, buildingCoordinates[2]] = 0.
-        g[indBelowFront.get_level_values(0), indBelowFront.get_level_values(1), indBelowFront.get_level_values(2)] = 0.
-        h[buildingCoordinates[0], buildingCoordinates[1] + 1, buildingCoordinates[2]] = 0.
-        h[indBelowBehind.get_level_values(0), indBelowBehind.get_level_values(1), indBelowBehind.get_level_values(2)] = 0.
-        m[buildingCoordinates[0], buildingCoordinates[1], buildingCoordinates[2] - 1] = 0.
-        n[buildingCoordinates[0], buildingCoordinates[1], buildingCoordinates[2] + 1] = 0.
-    
-    o[buildingCoordinates[0] - 1, buildingCoordinates[1], buildingCoordinates[2]] = 0.5
-    o[buildingCoordinates[0] + 1, buildingCoordinates[1], buildingCoordinates[2]] = 0.5
-    p[buildingCoordinates[0], buildingCoordinates[1] - 1, buildingCoordinates[2]] = 0.5
-    p[buildingCoordinates[0], buildingCoordinates[1] + 1, buildingCoordinates[2]] = 0.5
-    q[buildingCoordinates[0], buildingCoordinates[1], buildingCoordinates[2] + 1] = 0.5
-    q[buildingCoordinates[0], buildingCoordinates[1], buildingCoordinates[2] - 1] = 0.5
-    n[indBelowAnyAround.get_level_values(0), indBelowAnyAround.get_level_values(1), indBelowAnyAround.get_level_values(2)] = 0.
-    o[indBelowLeftRight.get_level_values(0), indBelowLeftRight.get_level_values(1), indBelowLeftRight.get_level_values(2)] = 0.5
-    p[indBelowFrontBehind.get_level_values(0), indBelowFrontBehind.get_level_values(1), indBelowFrontBehind.get_level_values(2)] = 0.5
-    q[indBelowAnyAround.get_level_values(0), indBelowAnyAround.get_level_values(1), indBelowAnyAround.get_level_values(2)] = 0.5
+    # The cells are swept directly within the 3D grid if their coordinates
+    # are not given (the other methods need their coordinates)
+    denseSweep = cells4Solver is None
+    if denseSweep and solverMethod not in ("sor", "red-black", "zline", "schwarz"):
+        cells4Solver = np.ascontiguousarray(np.argwhere(flags & SOLVED), dtype = np.int32)
+    
+    # Resume an interrupted calculation from its last checkpoint
+    state = None
+    checkpoint = None
+    if checkpointDirectory:
+        caseHash = hashCase(geometryHash = geometryHash, u0 = u0, v0 = v0, w0 = w0,
+                            dx = dx, dy = dy, dz = dz, windDirection = windDirection)
+        if resume:
+            state = loadCheckpoint(lambdaN1 = lambdaN1, 
+                                   checkpointDirectory = checkpointDirectory,
+                                   caseHash = caseHash)
+    startIteration = 0
+    if state is not None:
+        startIteration = state["iteration"]
+        if state["solverMethod"] == solverMethod and state["omegaMethod"] == omegaMethod:
+            omega = state["omega"]
+    
+    # Else start from the initial guess given or from the lambda field of a 
+    # previous calculation made on the same grid
+    if state is None and lambda0 is not None:
+        solved = (flags & SOLVED) > 0
+        lambdaN1[solved] = lambda0[solved]
+    if lambdaCacheDirectory:
+        rhsNorm = calcRhsNorm(flags, alpha1, u0, v0, w0, dx, dy, dzLevels, DESCENDING_Y)
+        if state is None and lambda0 is None:
+            loadLambda(lambdaN1 = lambdaN1, cacheDirectory = lambdaCacheDirectory,
+                       geometryHash = geometryHash, dx = dx, dy = dy, dz = dz,
+                       windDirection = windDirection, rhsNorm = rhsNorm,
+                       maxAngle = lambdaCacheMaxAngle)
+    
+    # Active-set mode: the cells far from the modified initial wind are not solved
+    activeSet = activeDistance is not None
+    if activeSet:
+        if solverMethod not in ("sor", "red-black"):
+            raise ValueError("The active-set mode needs the 'sor' or 'red-black' solver method")
+        active = np.zeros((nx, ny, nz), dtype = bool)
+        seeds = findActiveSeeds(flags, alpha1, u0, v0, w0, dx, dy, dzLevels,
+                                DESCENDING_Y, activeTolerance)
+        active[seeds[:, 0], seeds[:, 1], seeds[:, 2]] = True
+        cells4Solver, nbNewCells = extendActiveCells(cells4Solver = seeds, 
+                                                     isHot = np.ones(seeds.shape[0], dtype = bool),
+                                                     active = active, flags = flags,
+                                                     nbLayers = activeDistance)
+        lambdaN1[~active & ((flags & SOLVED) > 0)] = 0.
+        denseSweep = False
+        print("Active cells: {0} (of {1} cells solved)".format(cells4Solver.shape[0],
+                                                             np.count_nonzero(flags & SOLVED)))
+    
+    # The calculation may be canceled from QGIS
+    if feedback is not None:
+        isCanceled = feedback.isCanceled
+    else:
+        isCanceled = lambda: False
+    
+    # Progress of the iterations printed (and sent to QGIS) at most every 
+    # SOLVER_LOG_INTERVAL seconds
+    if iterationCallback is None:
+        iterationCallback = createIterationLogger(maxIterations = maxIterations,
+                                                  threshold = residualThreshold\
+                                                      if solverMethod == "pcg"\
+                                                      else thresholdIterations,
+                                                  feedback = feedback,
+                                                  criterion = "residual"\
+                                                      if solverMethod == "pcg"\
+                                                      else "eps")
+    
+    if nbThreads:
+        numba.set_num_threads(min(nbThreads, numba.config.NUMBA_NUM_THREADS))
+    # For the red-black method, split the cells into two colors: the 7-points
+    # stencil of a cell only involves cells of the other color
+    if solverMethod == "red-black" and activeSet:
+        redCells, blackCells = splitRedBlack(cells4Solver)
+    elif solverMethod == "red-black" and not denseSweep:
+        if "redBlack" not in solverData:
+            solverData["redBlack"] = splitRedBlack(cells4Solver)
+        redCells, blackCells = solverData["redBlack"]
+    elif solverMethod == "multigrid":
+        # Right hand side of the lambda equation
+        rhs = np.zeros([nx, ny, nz], dtype = dtype)
+        calcRhs(cells4Solver, rhs, alpha1, u0, v0, w0, dx, dy, dzLevels, DESCENDING_Y)
+        if "levels" not in solverData:
+            solverData["levels"] = \
+                createMultigridLevels(lambdaN1 = lambdaN1, rhs = rhs,
+                                      cells4Solver = cells4Solver,
+                                      buildingCoordinates = buildingCoordinates,
+                                      flags = flags)
+        levels = solverData["levels"]
+        levels[0]["lambda"] = lambdaN1
+        levels[0]["rhs"] = rhs
+        print("Multigrid levels: {0}".format([lev["lambda"].shape for lev in levels]))
+    elif solverMethod == "pcg":
+        if sparse is None:
+            raise ImportError("The 'pcg' solver method needs the scipy library")
+        rhs = np.zeros([nx, ny, nz], dtype = dtype)
+        calcRhs(cells4Solver, rhs, alpha1, u0, v0, w0, dx, dy, dzLevels, DESCENDING_Y)
+        # The operator and its preconditioner are built once for all the 
+        # iterations (and for all the calculations on this geometry)
+        if "operator" not in solverData:
+            solverData["operator"] = assembleOperator(cells4Solver = cells4Solver,
+                                                      flags = flags, A = A, B = B[0])
+            solverData["preconditioners"] = {}
+        operator = solverData["operator"]
+        if preconditioner not in solverData["preconditioners"]:
+            solverData["preconditioners"][preconditioner] = \
+                createPreconditioner(operator = operator,
+                                     preconditioner = preconditioner)
+        applyPreconditioner = solverData["preconditioners"][preconditioner]
+    elif solverMethod == "zline":
+        # Work arrays of the tridiagonal solver (one column per thread)
+        cp = np.zeros([nx, nz])
+        dp = np.zeros([nx, nz])
+    elif solverMethod not in ("sor", "red-black", "schwarz"):
+        raise ValueError("Unknown solver method '{0}'".format(solverMethod))
        
-    for N in range(maxIterations):
-        print("Iteration {0} (max {1})".format( N + 1, 
-                                                maxIterations))
-        lambdaN = np.copy(lambdaN1)
+    if solverMethod == "pcg":
+        i, j, k = cells4Solver.T
+        lambdaN1[i, j, k], residualNorm = solvePcg(operator = operator,
+                                                   rhs = rhs[i, j, k],
+                                                   lambda0 = lambdaN1[i, j, k],
+                                                   applyPreconditioner = applyPreconditioner,
+                                                   maxIterations = maxIterations,
+                                                   residualThreshold = residualThreshold,
+                                                   iterationCallback = iterationCallback,
+                                                   isCanceled = isCanceled)
+        print("Relative residual norm of the lambda equation: {0}".format(residualNorm))
+    elif solverMethod == "schwarz":
+        lambdaN1, eps = solveSchwarz(lambdaN1 = lambdaN1, u0 = u0, v0 = v0, w0 = w0,
+                                     flags = flags, omega = omega, alpha1 = alpha1,
+                                     dx = dx, dy = dy, dz = dzLevels, A = A, B = B,
+                                     zWeights = zWeights, maxIterations = maxIterations,
+                                     thresholdIterations = thresholdIterations,
+                                     nbProcesses = nbProcesses,
+                                     haloSize = haloSize,
+                                     innerIterations = innerIterations,
+                                     iterationCallback = iterationCallback,
+                                     isCanceled = isCanceled)
+    else:
+        # Lambda is updated in place by the relaxation kernels which also sum
+        # its variation during the sweep. The cells not solved never change: 
+        # their contribution to the sum of lambda is calculated once
+        # (by slabs along X in the out-of-core mode)
+        slabSize = nx if memmapDirectory is None else OUT_OF_CORE_SLAB_SIZE
+        fixedSum = 0.
+        for iStart in range(0, nx, slabSize):
+            slab = slice(iStart, iStart + slabSize)
+            fixedSum += np.sum(np.abs(lambdaN1[slab]), where = (flags[slab] & SOLVED) == 0,
+                               dtype = np.float64)
+        if solverMethod == "multigrid":
+            # A V-cycle is not a single sweep: the previous lambda is copied
+            # into a buffer allocated once (only when the convergence is checked)
+            lambdaN = allocateArray(lambdaN1.shape, dtype, memmapDirectory, "lambdaN")
+        eps = np.inf
+        # Variation of lambda at each iteration since the last update of the
+        # adaptive relaxation factor
+        adaptOmega = omegaMethod == "adaptive" and solverMethod in ("sor", "red-black", "zline")
+        variations = []
+        # The Chebyshev acceleration starts with a Gauss-Seidel half-sweep
+        if omegaMethod == "chebyshev" and startIteration == 0:
+            omega = 1.
+        # (no iteration left if resumed from a checkpoint of the last iteration)
+        N = startIteration - 1
+        for N in range(startIteration, maxIterations):
+            # Check the convergence only every 'convergenceInterval' iterations
+            computeVariation = ((N + 1) % convergenceInterval == 0)\
+                or (N == maxIterations - 1) or adaptOmega
+            sumVariation = 0.
+            sumLambda = fixedSum
 
-        lambdaN1 = calcLambda(cells4Solver, lambdaN, lambdaN1, omega, alpha1,
-                              u0, v0, w0, dx, dy, dz, e, f, g, h, m, n, o, p, q,
-                              DESCENDING_Y, A, B)
-        
-        # Calculate how much lambda evolves between 2 consecutive iterations                                      
-        eps = np.sum(np.abs(lambdaN1 - lambdaN)) / np.sum(np.abs(lambdaN1))
-        
-        # Check if the condition for ending process is reached
-        if eps < thresholdIterations:
-            break
-        else:
-            print("   eps = {0} >= {1}".format(np.round(eps,6),
-                                               thresholdIterations))
-            # Feedback to QGIS every 50 iterations
-            if (N % 50 == 0) & (feedback is not None):
-                textToSend = """Iteration {0} (max {1}) - eps = {2} >= {3}
-                            """.format( N + 1, 
-                                        maxIterations,
-                                        np.round(eps,6),
-                                        thresholdIterations)
-                feedback.setProgressText(textToSend)
+            if solverMethod == "multigrid":
+                if computeVariation:
+                    lambdaN[:] = lambdaN1
+                vCycle(levels = levels, level = 0, A = A, B = B[0])
+                if computeVariation:
+                    sumVariation, sumLambda = calcVariation(lambdaN1, lambdaN)
+            elif solverMethod == "red-black" and denseSweep:
+                for color in (0, 1):
+                    sums = calcLambdaRedBlackDense(color, lambdaN1, omega, alpha1,
+                                                   u0, v0, w0, dx, dy, dzLevels, flags,
+                                                   DESCENDING_Y, A, B, zWeights, computeVariation)
+                    sumVariation += sums[0]
+                    sumLambda += sums[1]
+                    if omegaMethod == "chebyshev":
+                        omega = calcChebyshevOmega(omega = omega, 
+                                                   jacobiRadius = jacobiRadius,
+                                                   firstHalfSweep = N == 0 and omega == 1.)
+            elif solverMethod == "red-black":
+                for cellsColor in (redCells, blackCells):
+                    sums = calcLambdaRedBlack(cellsColor, lambdaN1, omega, alpha1,
+                                              u0, v0, w0, dx, dy, dzLevels, flags,
+                                              DESCENDING_Y, A, B, zWeights, computeVariation)
+                    sumVariation += sums[0]
+                    sumLambda += sums[1]
+                    if omegaMethod == "chebyshev":
+                        omega = calcChebyshevOmega(omega = omega, 
+                                                   jacobiRadius = jacobiRadius,
+                                                   firstHalfSweep = N == 0 and omega == 1.)
+            elif solverMethod == "zline":
+                for color in (0, 1):
+                    sums = calcLambdaZLine(color, lambdaN1, omega, alpha1,
+                                           u0, v0, w0, dx, dy, dzLevels, flags,
+                                           DESCENDING_Y, A, B, zWeights, computeVariation,
+                                           cp, dp)
+                    sumVariation += sums[0]
+                    sumLambda += sums[1]
+                    if omegaMethod == "chebyshev":
+                        omega = calcChebyshevOmega(omega = omega, 
+                                                   jacobiRadius = jacobiRadius,
+                                                   firstHalfSweep = N == 0 and omega == 1.)
+            elif denseSweep:
+                sums = calcLambdaDense(lambdaN1, omega, alpha1,
+                                       u0, v0, w0, dx, dy, dzLevels, flags,
+                                       DESCENDING_Y, A, B, zWeights, computeVariation)
+                sumVariation += sums[0]
+                sumLambda += sums[1]
+            else:
+                sums = calcLambda(cells4Solver, lambdaN1, omega, alpha1,
+                                  u0, v0, w0, dx, dy, dzLevels, flags,
+                                  DESCENDING_Y, A, B, zWeights, computeVariation)
+                sumVariation += sums[0]
+                sumLambda += sums[1]
+            
+            # Save the state of the solver regularly and stop promptly if the
+            # calculation is canceled
+            if isCanceled():
+                break
+            if checkpointDirectory and (N + 1 - startIteration) % checkpointInterval == 0:
+                checkpoint = saveCheckpoint(checkpoint = checkpoint, lambdaN1 = lambdaN1,
+                                            checkpointDirectory = checkpointDirectory,
+                                            caseHash = caseHash,
+                                            state = {"iteration": N + 1, "omega": omega,
+                                                     "solverMethod": solverMethod,
+                                                     "omegaMethod": omegaMethod})
+            
+            if adaptOmega:
+                variations.append(sumVariation)
+                if len(variations) > OMEGA_ADAPT_ITERATIONS:
+                    omega, adaptOmega = updateAdaptiveOmega(omega = omega,
+                                                            variations = variations)
+                    variations = []
+            # Relative variation of lambda between 2 consecutive iterations
+            converged = False
+            if computeVariation:
+                eps = sumVariation / sumLambda
+                converged = eps < thresholdIterations
             
+            # Extend the active cells where lambda spreads out (lambda of the
+            # cells not active being 0, the sum of lambda is not modified)
+            if activeSet and (converged or (N + 1) % ACTIVE_SET_UPDATE_INTERVAL == 0):
+                i, j, k = cells4Solver.T
+                lambdaActive = np.abs(lambdaN1[i, j, k])
+                cells4Solver, nbNewCells = \
+                    extendActiveCells(cells4Solver = cells4Solver,
+                                      isHot = lambdaActive > activeTolerance * lambdaActive.max(),
+                                      active = active, flags = flags,
+                                      nbLayers = activeDistance)
+                if nbNewCells:
+                    converged = False
+                    if solverMethod == "red-black":
+                        redCells, blackCells = splitRedBlack(cells4Solver)
+        
+            # Check if the condition for ending process is reached
+            if converged:
+                break
+            if computeVariation:
+                iterationCallback(N + 1, eps)
+        print("Wind solver stopped after {0} iterations (eps = {1}, omega = {2})".format(N + 1,
+                                                                                        np.round(eps, 6),
+                                                                                        np.round(omega, 4)))
+        if activeSet:
+            print("Active cells: {0}".format(cells4Solver.shape[0]))
     
-    # Calculates the final wind speed
-
-    # go descending order along y
-    if DESCENDING_Y:
-        u[1:nx, :, :] = u0[1:nx, :, :] + 0.5 * (
-                1. / (alpha1 ** 2)) * (lambdaN1[0:nx-1, :, :] - lambdaN1[1:nx, :, :]) / dx
-        v[:, 1:ny, :] = v0[:, 1:ny, :] + 0.5 * (
-                1. / (alpha1 ** 2)) * (lambdaN1[:, 0:ny-1, :] - lambdaN1[:, 1:ny, :]) / dy
-        w[:, :, 1:nz] = w0[:, :, 1:nz] + 0.5 * (
-                1. / (alpha2 ** 2)) * (lambdaN1[:, :, 0:nz - 1] - lambdaN1[:, :, 1:nz]) / dz
-    else:
-        u[1:nx, :, :] = u0[1:nx, :, :] + 0.5 * (
-                1. / (alpha1 ** 2)) * (lambdaN1[1:nx, :, :] - lambdaN1[0:nx - 1, :, :]) / dx
-        v[:, 1:ny, :] = v0[:, 1:ny, :] + 0.5 * (
-                1. / (alpha1 ** 2)) * (lambdaN1[:, 1:ny, :] - lambdaN1[:, 0:ny - 1, :]) / dy
-        w[:, :, 1:nz] = w0[:, :, 1:nz] + 0.5 * (
-                1. / (alpha2 ** 2)) * (lambdaN1[:, :, 1:nz] - lambdaN1[:, :, 0:nz - 1]) / dz
+    if isCanceled():
+        if checkpointDirectory:
+            saveCheckpoint(checkpoint = checkpoint, lambdaN1 = lambdaN1,
+                           checkpointDirectory = checkpointDirectory,
+                           caseHash = caseHash,
+                           state = {"iteration": N + 1 if solverMethod not in ("pcg", "schwarz") else 0,
+                                    "omega": omega, "solverMethod": solverMethod,
+                                    "omegaMethod": omegaMethod})
+            checkpoint = None
+            raise SolverCanceled("Wind solver canceled (state saved in '{0}')".format(checkpointDirectory))
+        raise SolverCanceled("Wind solver canceled")
+    if checkpointDirectory:
+        checkpoint = None
+        removeCheckpoint(checkpointDirectory = checkpointDirectory, caseHash = caseHash)
+    
+    # Calculates the final wind speed (by slabs along X in the out-of-core 
+    # mode to limit the size of the temporary arrays)
+    slabSize = nx if memmapDirectory is None else OUT_OF_CORE_SLAB_SIZE
+    for iStart in range(0, nx, slabSize):
+        iEnd = min(iStart + slabSize, nx)
+        slab = slice(iStart, iEnd)
+        # The first X face is not calculated
+        sx = slice(max(iStart, 1), iEnd)
+        sxm = slice(max(iStart, 1) - 1, iEnd - 1)
+        # go descending order along y
+        if DESCENDING_Y:
+            u[sx, :, :] = u0[sx, :, :] + 0.5 * (
+                    1. / (alpha1 ** 2)) * (lambdaN1[sxm, :, :] - lambdaN1[sx, :, :]) / dx
+            v[slab, 1:ny, :] = v0[slab, 1:ny, :] + 0.5 * (
+                    1. / (alpha1 ** 2)) * (lambdaN1[slab, 0:ny-1, :] - lambdaN1[slab, 1:ny, :]) / dy
+            w[slab, :, 1:nz] = w0[slab, :, 1:nz] + 0.5 * (
+                    1. / (alpha2 ** 2)) * (lambdaN1[slab, :, 0:nz - 1] - lambdaN1[slab, :, 1:nz]) / dzFaces[1:nz]
+        else:
+            u[sx, :, :] = u0[sx, :, :] + 0.5 * (
+                    1. / (alpha1 ** 2)) * (lambdaN1[sx, :, :] - lambdaN1[sxm, :, :]) / dx
+            v[slab, 1:ny, :] = v0[slab, 1:ny, :] + 0.5 * (
+                    1. / (alpha1 ** 2)) * (lambdaN1[slab, 1:ny, :] - lambdaN1[slab, 0:ny - 1, :]) / dy
+            w[slab, :, 1:nz] = w0[slab, :, 1:nz] + 0.5 * (
+                    1. / (alpha2 ** 2)) * (lambdaN1[slab, :, 1:nz] - lambdaN1[slab, :, 0:nz - 1]) / dzFaces[1:nz]
 
     # Reset input and output wind speed to zero for building cells
     u[buildingCoordinates[0],buildingCoordinates[1],buildingCoordinates[2]] = 0
@@ -235,33 +682,2229 @@ def solver(x, y, z, dx, dy, dz, u0, v0, w0, buildingCoordinates, cells4Solver,
     w[buildingCoordinates[0],buildingCoordinates[1],buildingCoordinates[2]] = 0
     w[buildingCoordinates[0],buildingCoordinates[1],buildingCoordinates[2]+1]=0
 
+    # Save lambda to be used as initial guess by the next calculations
+    if lambdaCacheDirectory:
+        saveLambda(lambdaN1 = lambdaN1, cacheDirectory = lambdaCacheDirectory,
+                   geometryHash = geometryHash, dx = dx, dy = dy, dz = dz,
+                   windDirection = windDirection, rhsNorm = rhsNorm)
+
     print("Time spent by the wind speed solver: {0} s".format(time.time()-timeStartCalculation))
     
+    if returnLambda:
+        return u, v, w, lambdaN1
     return u, v, w
 
-@jit(nopython=True)
-def calcLambda(cells4Solver, lambdaN, lambdaN1, omega, alpha1, u0, v0, w0, dx, dy, dz, e, f, g, h, m, n, o, p, q, DESCENDING_Y, A, B):
-    # Go descending order along y
-    if DESCENDING_Y:
-        for k, j, i in np.flip(cells4Solver):
-            lambdaN1[i, j, k] = omega * (
-                ((-1.) * (dx ** 2 * (-2. * alpha1 ** 2) * (((u0[i, j, k] - u0[i + 1, j, k]) / (dx) + (
-                        v0[i, j, k] - v0[i, j + 1, k]) / (dy) +
-                                                            (w0[i, j, k] - w0[i, j, k + 1]) / (dz)))) + (
-                          e[i, j, k] * lambdaN[i - 1, j, k] + f[i, j, k] * lambdaN1[i + 1, j, k] + A * (
-                          g[i, j, k] * lambdaN[i, j - 1, k] + h[i, j, k] * lambdaN1[i, j + 1, k]) + B * (
-                                  m[i, j, k] * lambdaN[i, j, k - 1] + n[i, j, k] * lambdaN1[i, j, k + 1]))) / (
-                        2. * (o[i, j, k] + A * p[i, j, k] + B * q[i, j, k]))) + (1 - omega) * lambdaN1[i, j, k]  
-                                      
+def calcVerticalWeights(dzLevels):
+    """ Calculate the distance between the centers of consecutive vertical
+    levels and the weights of the vertical terms of the lambda equation of 
+    each level (all weights are 1 on a uniform grid). For a level of thickness
+    dz[k], the vertical second derivative of lambda is discretized as
+    B[k] * (w0 * lambda[k-1] + w1 * lambda[k+1] - 2 * w2 * lambda[k]) with
+    w0 = dz[k] / dzFaces[k], w1 = dz[k] / dzFaces[k+1] and w2 = (w0 + w1) / 2.
+    Near an obstacle (roof or ground below, obstacle above), the weight of
+    lambda[k] only keeps the weight of the open neighbour (see
+    'calcVerticalDiagonal').
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            dzLevels: 1D array
+                Thickness of each vertical level
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            dzFaces: 1D array
+                Distance between the center of each level and the center of
+                the level below (where the vertical wind speed is located)
+            zWeights: 2D array
+                Weights (w0, w1, w2) of the lambda equation of each level"""
+    nz = dzLevels.size
+    dzFaces = np.empty(nz)
+    dzFaces[0] = dzLevels[0]
+    dzFaces[1:] = (dzLevels[:-1] + dzLevels[1:]) / 2
+    zWeights = np.ones((nz, 3))
+    zWeights[:, 0] = dzLevels / dzFaces
+    zWeights[:-1, 1] = dzLevels[:-1] / dzFaces[1:]
+    zWeights[:, 2] = (zWeights[:, 0] + zWeights[:, 1]) / 2
+    
+    return dzFaces, zWeights
+
+def estimateJacobiRadius(nx, ny, nz, A, B, zLine = False):
+    """ Estimate the spectral radius of the Jacobi iteration of the lambda
+    equation on a 3D grid without obstacle (the vertical direction is taken
+    into account, contrary to the default relaxation factor).
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            nx: int
+                Number of cells along X-axis
+            ny: int
+                Number of cells along Y-axis
+            nz: int
+                Number of cells along Z-axis
+            A: float
+                Coefficient (dx / dy) ** 2 of the lambda equation
+            B: float
+                Coefficient (dx / dz) ** 2 of the lambda equation
+            zLine: boolean, default False
+                Whether the Jacobi iteration solves the vertical lines at once
+                (block Jacobi iteration of the "zline" method)
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            jacobiRadius: float
+                Spectral radius of the Jacobi iteration"""
+    # The ground is a wall (zero flux) while lambda is 0 on the top boundary
+    cosZ = np.cos(np.pi / (2 * nz))
+    if zLine:
+        return (np.cos(np.pi / nx) + A * np.cos(np.pi / ny)) / (1 + A + B * (1 - cosZ))
     else:
-        for i, j, k in cells4Solver:
-            lambdaN1[i, j, k] = omega * (
-                ((-1.) * (dx ** 2 * (-2. * alpha1 ** 2) * (((u0[i + 1, j, k] - u0[i, j, k]) / (dx) + (
-                        v0[i, j + 1, k] - v0[i, j, k]) / (dy) +
-                                                            (w0[i, j, k + 1] - w0[i, j, k]) / (dz)))) + (
-                          e[i, j, k] * lambdaN[i + 1, j, k] + f[i, j, k] * lambdaN1[i - 1, j, k] + A * (
-                          g[i, j, k] * lambdaN[i, j + 1, k] + h[i, j, k] * lambdaN1[i, j - 1, k]) + B * (
-                                  m[i, j, k] * lambdaN[i, j, k + 1] + n[i, j, k] * lambdaN1[i, j, k - 1]))) / (
-                        2. * (o[i, j, k] + A * p[i, j, k] + B * q[i, j, k]))) + (1 - omega) * lambdaN1[i, j, k]  
-                                      
-    return lambdaN1
\ No newline at end of file
+        return (np.cos(np.pi / nx) + A * np.cos(np.pi / ny) + B * cosZ) / (1 + A + B)
+
+def calcOptimalOmega(jacobiRadius):
+    """ Return the optimal SOR relaxation factor 2 / (1 + sqrt(1 - rho^2))
+    for a given spectral radius rho of the Jacobi iteration"""
+    return 2. / (1 + np.sqrt(1 - min(jacobiRadius, OMEGA_MAX_JACOBI_RADIUS) ** 2))
+
+def calcChebyshevOmega(omega, jacobiRadius, firstHalfSweep):
+    """ Return the relaxation factor of the next half-sweep of a red-black SOR
+    using Chebyshev acceleration (Press et al., Numerical Recipes, 19.5):
+    omega = 1 for the first half-sweep, 1 / (1 - rho^2 / 2) for the second one,
+    then 1 / (1 - rho^2 * omega / 4) (converging to the optimal omega).
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            omega: float
+                Relaxation factor of the half-sweep just done
+            jacobiRadius: float
+                Spectral radius of the Jacobi iteration
+            firstHalfSweep: boolean
+                Whether the half-sweep just done is the first one
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            omega: float
+                Relaxation factor of the next half-sweep"""
+    jacobiRadius = min(jacobiRadius, OMEGA_MAX_JACOBI_RADIUS)
+    if firstHalfSweep:
+        return 1. / (1 - jacobiRadius ** 2 / 2)
+    else:
+        return 1. / (1 - jacobiRadius ** 2 * omega / 4)
+
+def updateAdaptiveOmega(omega, variations):
+    """ Update the SOR relaxation factor from the observed convergence rate
+    (Hageman et Young, Applied iterative methods, 1981): the rate r of 
+    decrease of the lambda variation gives the spectral radius of the Jacobi 
+    iteration rho^2 = (r + omega - 1)^2 / (r * omega^2) as long as omega is
+    lower than the optimal factor (r = omega - 1 above, giving back omega).
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            omega: float
+                Relaxation factor used since the last update
+            variations: list of float
+                Sum of the lambda variation at each iteration since the last update
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            omega: float
+                Updated relaxation factor
+            adaptOmega: boolean
+                Whether the relaxation factor should still be adapted"""
+    # The first iterations after an update are affected by the previous omega
+    variations = variations[len(variations) // 2:]
+    if variations[0] <= 0:
+        return omega, False
+    ratio = (variations[-1] / variations[0]) ** (1. / (len(variations) - 1))
+    # Convergence rate not measurable (noise or divergence): keep omega
+    if not 0 < ratio < 1:
+        return omega, True
+    jacobiRadius2 = (ratio + omega - 1) ** 2 / (ratio * omega ** 2)
+    newOmega = calcOptimalOmega(np.sqrt(min(jacobiRadius2, 1.)))
+    # Omega only increases (the estimate is a lower bound of the optimal factor)
+    if newOmega - omega < OMEGA_ADAPT_TOLERANCE:
+        return omega, False
+    print("   Relaxation factor updated from {0} to {1}".format(np.round(omega, 4),
+                                                             np.round(newOmega, 4)))
+    return newOmega, True
+
+def coarsenInitialField(u0, v0, w0, buildingCoordinates, factor):
+    """ Coarsen the initial wind field and the buildings by a given factor
+    along the 3 axes: a coarse cell gathers factor^3 cells (it is a building
+    if at least half of them are buildings, and the ground if its lowest cells
+    are) and the wind speed of a coarse face is the mean wind speed of the 
+    fine faces it gathers (same flux through the face).
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            u0: 3D array
+                Initialized 3D wind speed value in X direction
+            v0: 3D array
+                Initialized 3D wind speed value in Y direction 
+            w0: 3D array
+                Initialized 3D wind speed value in Z direction
+            buildingCoordinates: 3D array
+                Building 3D coordinates
+            factor: int
+                Coarsening factor
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            u0: 3D array
+                Coarse initial wind speed value in X direction
+            v0: 3D array
+                Coarse initial wind speed value in Y direction 
+            w0: 3D array
+                Coarse initial wind speed value in Z direction
+            buildingCoordinates: 3D array
+                Coarse building 3D coordinates"""
+    nx, ny, nz = u0.shape
+    ncx, ncy, ncz = [int(np.ceil(n / factor)) for n in (nx, ny, nz)]
+    padding = [(0, ncx * factor - nx), (0, ncy * factor - ny), (0, ncz * factor - nz)]
+    
+    building = np.zeros((nx, ny, nz), dtype = bool)
+    building[buildingCoordinates[0], buildingCoordinates[1], buildingCoordinates[2]] = True
+    building = np.pad(building, padding, mode = "edge")
+    coarseBuilding = building.reshape(ncx, factor, ncy, factor, ncz, factor).mean(axis = (1, 3, 5)) >= 0.5
+    coarseBuilding[:, :, 0] |= building[:, :, 0].reshape(ncx, factor, ncy, factor).any(axis = (1, 3))
+    # No building on the last sketch boundaries (as on the fine grid)
+    coarseBuilding[-1, :, :] = False
+    coarseBuilding[:, -1, :] = False
+    coarseBuilding[:, :, -1] = False
+    coarseCoordinates = np.stack(np.where(coarseBuilding)).astype(np.int32)
+    
+    # Faces of the coarse cells are the fine faces of index factor * I
+    u0 = np.pad(u0, padding, mode = "edge")[::factor, :, :]\
+        .reshape(ncx, ncy, factor, ncz, factor).mean(axis = (2, 4))
+    v0 = np.pad(v0, padding, mode = "edge")[:, ::factor, :]\
+        .reshape(ncx, factor, ncy, ncz, factor).mean(axis = (1, 4))
+    w0 = np.pad(w0, padding, mode = "edge")[:, :, ::factor]\
+        .reshape(ncx, factor, ncy, factor, ncz).mean(axis = (1, 3))
+    
+    # Reset wind speed to zero for building cells
+    i, j, k = coarseCoordinates
+    u0[i, j, k] = 0
+    u0[i + 1, j, k] = 0
+    v0[i, j, k] = 0
+    v0[i, j + 1, k] = 0
+    w0[i, j, k] = 0
+    w0[i, j, k + 1] = 0
+    
+    return u0, v0, w0, coarseCoordinates
+
+def prolongLambda(lambdaCoarse, buildingCoordinates, shape, factor):
+    """ Trilinear interpolation of a coarse lambda field onto the fine grid
+    (coarse cell I being centered on the fine cell factor * I + (factor - 1) / 2).
+    The coarse building cells, where lambda is not calculated, are not used.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            lambdaCoarse: 3D array
+                Lambda field of the coarse grid
+            buildingCoordinates: 3D array
+                Coarse building 3D coordinates
+            shape: tuple
+                Shape of the fine grid
+            factor: int
+                Coarsening factor
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            lambdaFine: 3D array
+                Lambda field interpolated on the fine grid"""
+    weights = np.ones(lambdaCoarse.shape)
+    weights[buildingCoordinates[0], buildingCoordinates[1], buildingCoordinates[2]] = 0
+    lambdaFine = lambdaCoarse * weights
+    for axis, n in enumerate(shape):
+        nc = lambdaCoarse.shape[axis]
+        position = np.clip((np.arange(n) - (factor - 1) / 2.) / factor, 0, nc - 1)
+        index = np.minimum(np.floor(position).astype(int), max(nc - 2, 0))
+        coefShape = [1, 1, 1]
+        coefShape[axis] = n
+        coef = (position - index).reshape(coefShape)
+        indexNext = np.minimum(index + 1, nc - 1)
+        lambdaFine = (1 - coef) * np.take(lambdaFine, index, axis = axis)\
+            + coef * np.take(lambdaFine, indexNext, axis = axis)
+        weights = (1 - coef) * np.take(weights, index, axis = axis)\
+            + coef * np.take(weights, indexNext, axis = axis)
+    
+    return np.divide(lambdaFine, weights, out = np.zeros(shape), where = weights > 0)
+
+def solveCoarseLambda(dx, dy, dz, u0, v0, w0, buildingCoordinates,
+                      factor = NESTED_ITERATION_FACTOR,
+                      maxIterations = MAX_ITERATIONS,
+                      thresholdIterations = THRESHOLD_ITERATIONS,
+                      feedback = None, solverMethod = SOLVER_METHOD,
+                      nbThreads = SOLVER_NB_THREADS, windDirection = None,
+                      omegaMethod = SOLVER_OMEGA_METHOD):
+    """ First step of a nested iteration: the wind solver is applied to a
+    grid 'factor' times coarser (initial wind field and buildings coarsened,
+    see 'coarsenInitialField') and the resulting lambda field is prolonged
+    onto the fine grid to be used as initial guess of the wind solver (most
+    of the low-frequency error being removed on the coarse grid).
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            dx: float
+                Grid spacing along X-axis
+            dy: float
+                Grid spacing along Y-axis  
+            dz: float
+                Grid spacing along Z-axis
+            u0: 3D array
+                Initialized 3D wind speed value in X direction
+            v0: 3D array
+                Initialized 3D wind speed value in Y direction 
+            w0: 3D array
+                Initialized 3D wind speed value in Z direction
+            buildingCoordinates: 3D array
+                Building 3D coordinates
+            factor: int, default NESTED_ITERATION_FACTOR
+                Coarsening factor (2 or 4 usually)
+            maxIterations: int, default MAX_ITERATIONS
+                Maximum number of wind solver iterations on the coarse grid
+            thresholdIterations: float, default THRESHOLD_ITERATIONS
+                Threshold for stopping the wind solver on the coarse grid
+            feedback: Qgis.core class QgsProcessingFeedback
+                Base class for providing feedback to QGIS from a processing algorithm (if not in standalone mode).
+            solverMethod: String, default SOLVER_METHOD
+                Method used to solve the lambda equation (see 'solver')
+            nbThreads: int, default SOLVER_NB_THREADS
+                Number of threads used by the parallel kernels
+            windDirection: float, default None
+                Wind direction of the calculation
+            omegaMethod: String, default SOLVER_OMEGA_METHOD
+                Relaxation factor method (see 'solver')
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            lambda0: 3D array
+                Initial guess of lambda on the fine grid"""
+    print("Apply the wind solver on a {0} times coarser grid".format(factor))
+    u0Coarse, v0Coarse, w0Coarse, coarseCoordinates = \
+        coarsenInitialField(u0 = u0, v0 = v0, w0 = w0, 
+                            buildingCoordinates = buildingCoordinates,
+                            factor = factor)
+    ncx, ncy, ncz = u0Coarse.shape
+    lambdaCoarse = solver(x = np.arange(ncx) * dx * factor,
+                          y = np.arange(ncy) * dy * factor,
+                          z = np.arange(ncz) * dz * factor,
+                          dx = dx * factor, dy = dy * factor, dz = dz * factor,
+                          u0 = u0Coarse.astype(u0.dtype),
+                          v0 = v0Coarse.astype(u0.dtype),
+                          w0 = w0Coarse.astype(u0.dtype),
+                          buildingCoordinates = coarseCoordinates,
+                          cells4Solver = None,
+                          maxIterations = maxIterations,
+                          thresholdIterations = thresholdIterations,
+                          feedback = feedback, solverMethod = solverMethod,
+                          nbThreads = nbThreads, windDirection = windDirection,
+                          omegaMethod = omegaMethod, returnLambda = True)[3]
+    
+    return prolongLambda(lambdaCoarse = lambdaCoarse, 
+                         buildingCoordinates = coarseCoordinates,
+                         shape = u0.shape, factor = factor)
+
+def getKernelSignatures(dtype):
+    """ Explicit signatures of the main solver kernels for a precision of the
+    3D wind fields.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            dtype: numpy dtype
+                Precision of the 3D wind fields (float64 or float32)
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            signatures: list
+                (kernel, signature) couples"""
+    field = numba.from_dtype(np.dtype(dtype))[:, :, ::1]
+    cells = types.int32[:, ::1]
+    flags = types.uint8[:, :, ::1]
+    real = types.float64
+    levels = types.float64[::1]
+    # Arguments from 'lambdaN1' to 'computeVariation' of the relaxation kernels
+    relaxation = (field, real, real, field, field, field, real, real, levels,
+                  flags, types.boolean, real, levels, real[:, ::1], types.boolean)
+    
+    return [(calcLambda, (cells, ) + relaxation),
+            (calcLambdaDense, relaxation),
+            (calcLambdaRedBlack, (cells, ) + relaxation),
+            (calcLambdaRedBlackDense, (types.int64, ) + relaxation),
+            (calcLambdaZLine, (types.int64, ) + relaxation + (real[:, ::1], real[:, ::1])),
+            (calcVariation, (field, field)),
+            (calcRhsNorm, (flags, real, field, field, field, real, real, levels,
+                           types.boolean))]
+
+def compileKernels(dtype = np.float64):
+    """ Compile the main solver kernels for a precision of the 3D wind fields
+    (loaded from the numba cache when they have already been compiled by a
+    previous session, nothing done when they are already compiled).
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            dtype: numpy dtype, default np.float64
+                Precision of the 3D wind fields (float64 or float32)
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            None"""
+    for kernel, signature in getKernelSignatures(dtype):
+        kernel.compile(signature)
+
+def allocateArray(shape, dtype, memmapDirectory = None, name = "array", fillValue = 0.):
+    """ Allocate an array in RAM or, in the out-of-core mode, as a memory-mapped
+    file of 'memmapDirectory' (filled by slabs along the first axis). The file
+    is removed at once when the system allows it (the memory mapping keeping 
+    the data), otherwise with the directory.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            shape: tuple
+                Shape of the array
+            dtype: numpy dtype
+                Type of the array
+            memmapDirectory: str, default None
+                Directory of the memory-mapped file (None to allocate in RAM)
+            name: str, default "array"
+                Name used in the file name
+            fillValue: float, default 0.
+                Initial value of the array
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            array: np.ndarray or np.memmap
+                Allocated array"""
+    if memmapDirectory is None:
+        if fillValue == 0:
+            return np.zeros(shape, dtype = dtype)
+        return np.full(shape, fillValue, dtype = dtype)
+    
+    fileDescriptor, path = tempfile.mkstemp(prefix = "urock_{0}_".format(name),
+                                            suffix = ".dat", dir = memmapDirectory)
+    os.close(fileDescriptor)
+    # A new file is full of zeros
+    array = np.memmap(path, dtype = dtype, mode = "w+", shape = shape)
+    if fillValue != 0:
+        for i in range(shape[0]):
+            array[i] = fillValue
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    
+    return array
+
+def hashGeometry(buildingCoordinates, dzLevels = None):
+    """ Identify a geometry by a hash of its building coordinates (for a given
+    grid shape, the cells where the wind solver is applied only depend on them)
+    and of the vertical levels of a stretched grid.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            buildingCoordinates: 3D array
+                Building 3D coordinates
+            dzLevels: 1D array, default None
+                Thickness of each vertical level of a stretched grid (None for
+                a uniform grid)
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            geometryHash: String
+                Hexadecimal SHA-1 hash of the geometry"""
+    geometryHash = hashlib.sha1()
+    geometryHash.update(np.ascontiguousarray(buildingCoordinates, dtype = np.int32).tobytes())
+    if dzLevels is not None:
+        geometryHash.update(np.ascontiguousarray(dzLevels, dtype = np.float64).tobytes())
+    
+    return geometryHash.hexdigest()
+
+def getSolverData(geometryHash, shape, dx, dy, dz, 
+                  windDirection = None, dtype = np.float64,
+                  cacheSize = SOLVER_CACHE_SIZE):
+    """ Get the dictionary where are stored the data of the lambda equation
+    operator (obstacle flags, sparse matrix, preconditioners, multigrid levels)
+    calculated for a given geometry. The data are kept in memory for the 
+    'cacheSize' last geometries used (identified by a hash of the building
+    coordinates, the wind direction and the grid resolution).
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            geometryHash: String
+                Hash of the building coordinates
+            shape: tuple
+                Number of cells along X, Y and Z axis
+            dx: int
+                Grid spacing along X-axis
+            dy: int
+                Grid spacing along Y-axis  
+            dz: int
+                Grid spacing along Z-axis
+            windDirection: float, default None
+                Wind direction of the calculation
+            dtype: numpy dtype, default np.float64
+                Floating point precision of the 3D fields
+            cacheSize: int, default SOLVER_CACHE_SIZE
+                Maximum number of geometries kept in memory (0 to deactivate the cache)
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            solverData: dictionary
+                Data already calculated for this geometry (empty if the 
+                geometry is not in the cache)"""
+    if not cacheSize:
+        solverCache.clear()
+        return {}
+    
+    key = (geometryHash, tuple(shape), float(dx), float(dy), float(dz),
+           windDirection, np.dtype(dtype).name, DESCENDING_Y)
+    
+    if key in solverCache:
+        print("The wind solver operator of this geometry is reused")
+        solverCache.move_to_end(key)
+    else:
+        solverCache[key] = {}
+        while len(solverCache) > cacheSize:
+            solverCache.popitem(last = False)
+    
+    return solverCache[key]
+
+def loadLambda(lambdaN1, cacheDirectory, geometryHash, dx, dy, dz,
+               windDirection, rhsNorm, maxAngle = LAMBDA_CACHE_MAX_ANGLE):
+    """ Initialize lambda (in place) with the lambda field saved by a previous
+    calculation. The field of the same geometry is used if it exists, otherwise
+    the one of the closest wind direction having the same grid (if the wind
+    direction difference is lower than 'maxAngle'). Since lambda is 
+    proportional to the right hand side of its equation, the saved field is
+    scaled by the ratio of the right hand side norms (e.g. for an other 
+    reference wind speed).
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            lambdaN1: 3D array
+                Lagrange multiplier to initialize
+            cacheDirectory: String
+                Directory where are saved the lambda fields
+            geometryHash: String
+                Hash of the building coordinates
+            dx: int
+                Grid spacing along X-axis
+            dy: int
+                Grid spacing along Y-axis  
+            dz: int
+                Grid spacing along Z-axis
+            windDirection: float
+                Wind direction of the calculation
+            rhsNorm: float
+                Norm of the right hand side of the lambda equation
+            maxAngle: float, default LAMBDA_CACHE_MAX_ANGLE
+                Maximum wind direction difference (°) for using the lambda
+                field of an other geometry
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            isLoaded: boolean
+                Whether lambda has been initialized from a saved field"""
+    bestFile = None
+    bestAngle = None
+    for filePath in glob.glob(os.path.join(cacheDirectory, LAMBDA_CACHE_PREFIX + "*.npz")):
+        try:
+            with np.load(filePath) as cachedData:
+                if tuple(cachedData["shape"]) != lambdaN1.shape\
+                    or tuple(cachedData["resolution"]) != (dx, dy, dz)\
+                    or bool(cachedData["descendingY"]) != DESCENDING_Y:
+                    continue
+                if str(cachedData["geometryHash"]) == geometryHash:
+                    angle = -1
+                elif windDirection is None or np.isnan(cachedData["windDirection"]):
+                    continue
+                else:
+                    angle = abs((windDirection - float(cachedData["windDirection"]) + 180) % 360 - 180)
+                    if angle > maxAngle:
+                        continue
+        except (OSError, ValueError, KeyError):
+            # The file may have been written by an other version or be incomplete
+            continue
+        if bestAngle is None or angle < bestAngle:
+            bestFile = filePath
+            bestAngle = angle
+    
+    if bestFile is None:
+        return False
+    
+    with np.load(bestFile) as cachedData:
+        factor = rhsNorm / cachedData["rhsNorm"] if cachedData["rhsNorm"] > 0 else 1.
+        lambdaN1[1:-1, 1:-1, 1:-1] = factor * cachedData["lambda"][1:-1, 1:-1, 1:-1]
+    print("The wind solver starts from the lambda field saved in {0}".format(bestFile))
+    
+    return True
+
+def saveLambda(lambdaN1, cacheDirectory, geometryHash, dx, dy, dz,
+               windDirection, rhsNorm, cacheSize = LAMBDA_CACHE_SIZE):
+    """ Save the lambda field of a calculation in order to use it as initial
+    guess of the next calculations. Only the 'cacheSize' last saved fields
+    are kept.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            lambdaN1: 3D array
+                Lagrange multiplier to save
+            cacheDirectory: String
+                Directory where are saved the lambda fields
+            geometryHash: String
+                Hash of the building coordinates
+            dx: int
+                Grid spacing along X-axis
+            dy: int
+                Grid spacing along Y-axis  
+            dz: int
+                Grid spacing along Z-axis
+            windDirection: float
+                Wind direction of the calculation
+            rhsNorm: float
+                Norm of the right hand side of the lambda equation
+            cacheSize: int, default LAMBDA_CACHE_SIZE
+                Maximum number of lambda files kept in the directory
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            filePath: String
+                Path of the saved file"""
+    key = "{0}_{1}_{2}_{3}_{4}_{5}_{6}".format(geometryHash, lambdaN1.shape, dx, dy, dz,
+                                               windDirection, DESCENDING_Y)
+    filePath = os.path.join(cacheDirectory, 
+                            LAMBDA_CACHE_PREFIX + hashlib.sha1(key.encode()).hexdigest() + ".npz")
+    np.savez(filePath,
+             **{"lambda": lambdaN1,
+                "shape": np.array(lambdaN1.shape),
+                "resolution": np.array([dx, dy, dz], dtype = np.float64),
+                "descendingY": np.array(DESCENDING_Y),
+                "geometryHash": np.array(geometryHash),
+                "windDirection": np.array(np.nan if windDirection is None else windDirection,
+                                          dtype = np.float64),
+                "rhsNorm": np.array(rhsNorm)})
+    
+    # Remove the oldest files
+    cachedFiles = sorted(glob.glob(os.path.join(cacheDirectory, LAMBDA_CACHE_PREFIX + "*.npz")),
+                         key = os.path.getmtime)
+    for oldFile in cachedFiles[:max(len(cachedFiles) - cacheSize, 0)]:
+        os.remove(oldFile)
+    
+    return filePath
+
+def hashCase(geometryHash, u0, v0, w0, dx, dy, dz, windDirection):
+    """ Identify a wind solver calculation (geometry, grid and initial wind
+    field) by a hash: a calculation is only resumed from the checkpoint of
+    the same calculation.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            geometryHash: String
+                Hash of the building coordinates
+            u0: 3D array
+                Initialized 3D wind speed value in X direction
+            v0: 3D array
+                Initialized 3D wind speed value in Y direction 
+            w0: 3D array
+                Initialized 3D wind speed value in Z direction
+            dx: float
+                Grid spacing along X-axis
+            dy: float
+                Grid spacing along Y-axis  
+            dz: float
+                Grid spacing along Z-axis
+            windDirection: float
+                Wind direction of the calculation
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            caseHash: String
+                Hexadecimal SHA-1 digest of the calculation"""
+    sha = hashlib.sha1(geometryHash.encode())
+    sha.update(np.array([dx, dy, dz, np.nan if windDirection is None else windDirection],
+                        dtype = np.float64).tobytes())
+    for field in (u0, v0, w0):
+        sha.update(str(field.shape).encode())
+        sha.update(np.ascontiguousarray(field).data)
+    
+    return sha.hexdigest()
+
+def getCheckpointPaths(checkpointDirectory, caseHash):
+    """ Return the paths of the two lambda (memory-mapped .npy, written
+    alternately) and of the iteration state (.json) checkpoint files of a
+    calculation"""
+    basePath = os.path.join(checkpointDirectory, CHECKPOINT_PREFIX + caseHash)
+    
+    return [basePath + "_0.npy", basePath + "_1.npy"], basePath + ".json"
+
+def loadCheckpoint(lambdaN1, checkpointDirectory, caseHash):
+    """ Load lambda (in place) and the iteration state saved by an 
+    interrupted calculation.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            lambdaN1: 3D array
+                Lambda field (updated in place if a checkpoint is found)
+            checkpointDirectory: String
+                Directory of the checkpoint files
+            caseHash: String
+                Hash identifying the calculation (see 'hashCase')
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            state: dictionary
+                Iteration state of the checkpoint ("iteration", "omega", 
+                "solverMethod", "omegaMethod", "slot") or None if no valid
+                checkpoint"""
+    lambdaPaths, statePath = getCheckpointPaths(checkpointDirectory, caseHash)
+    if not os.path.exists(statePath):
+        return None
+    try:
+        with open(statePath) as stateFile:
+            state = json.load(stateFile)
+        lambdaPath = lambdaPaths[state["slot"]]
+        checkpoint = np.load(lambdaPath, mmap_mode = "r")
+        if checkpoint.shape != lambdaN1.shape:
+            return None
+        lambdaN1[:] = checkpoint
+        del checkpoint
+    except (OSError, ValueError, KeyError, IndexError, TypeError):
+        # Checkpoint not readable (e.g. written by another version)
+        return None
+    print("Wind solver resumed from iteration {0} ({1})".format(state["iteration"],
+                                                                lambdaPath))
+    
+    return state
+
+def saveCheckpoint(checkpoint, lambdaN1, checkpointDirectory, caseHash, state):
+    """ Save lambda into a memory-mapped file and the iteration state into a
+    json file. Lambda is written alternately into two files and the state,
+    replaced once lambda is flushed, refers to the file saved: the last
+    complete checkpoint is thus kept if the calculation is interrupted while
+    a checkpoint is written.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            checkpoint: dictionary
+                Memory-mapped lambda checkpoint files ("lambda") and index
+                of the last one saved ("slot"), None to create them
+            lambdaN1: 3D array
+                Lambda field to save
+            checkpointDirectory: String
+                Directory of the checkpoint files
+            caseHash: String
+                Hash identifying the calculation (see 'hashCase')
+            state: dictionary
+                Iteration state to save
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            checkpoint: dictionary
+                Memory-mapped lambda checkpoint files (to use for the next saves)"""
+    lambdaPaths, statePath = getCheckpointPaths(checkpointDirectory, caseHash)
+    if checkpoint is None:
+        # The file of a previous checkpoint (calculation resumed) is kept
+        # until a new one is complete
+        loadedState = None
+        if os.path.exists(statePath):
+            try:
+                with open(statePath) as stateFile:
+                    loadedState = json.load(stateFile)
+            except (OSError, ValueError):
+                pass
+        checkpoint = {"lambda": [None, None],
+                      "slot": loadedState.get("slot", 1) if isinstance(loadedState, dict) else 1}
+    slot = 1 - checkpoint["slot"]
+    if checkpoint["lambda"][slot] is None:
+        checkpoint["lambda"][slot] = np.lib.format.open_memmap(lambdaPaths[slot], mode = "w+",
+                                                               dtype = lambdaN1.dtype,
+                                                               shape = lambdaN1.shape)
+    checkpoint["lambda"][slot][:] = lambdaN1
+    checkpoint["lambda"][slot].flush()
+    with open(statePath + ".tmp", "w") as stateFile:
+        json.dump(dict(state, slot = slot), stateFile)
+    os.replace(statePath + ".tmp", statePath)
+    checkpoint["slot"] = slot
+    
+    return checkpoint
+
+def removeCheckpoint(checkpointDirectory, caseHash):
+    """ Remove the checkpoint files of a calculation once it is finished (the
+    memory-mapped lambda checkpoint should be closed before)"""
+    lambdaPaths, statePath = getCheckpointPaths(checkpointDirectory, caseHash)
+    for path in lambdaPaths + [statePath, statePath + ".tmp"]:
+        if os.path.exists(path):
+            os.remove(path)
+
+def setObstacleFlags(nx, ny, nz, buildingCoordinates):
+    """ Set the flags identifying the coefficients used to modify the lambda
+    equation near obstacles (table 1 in Pardyjak and Brown, 2003). Since the
+    coefficients are only 0, 0.5 or 1, they are stored as bits of a single
+    byte per cell (WALL_E to WALL_N bits set when e to n are 0). The SOLVED
+    bit identifies the cells where lambda is calculated.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            nx: int
+                Number of cells along X-axis
+            ny: int
+                Number of cells along Y-axis
+            nz: int
+                Number of cells along Z-axis
+            buildingCoordinates: 3D array
+                Building 3D coordinates
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            flags: 3D array
+                Obstacle flags (uint8) of the lambda equation for each cell"""
+    flags = np.zeros([nx, ny, nz], dtype = np.uint8)
+    isBuilding = np.zeros([nx, ny, nz], dtype = bool)
+    isBuilding[buildingCoordinates[0], buildingCoordinates[1], buildingCoordinates[2]] = True
+    
+    # Identify cells having a building on each side
+    buildingLeft = shiftMask(isBuilding, axis = 0, offset = -1)
+    buildingRight = shiftMask(isBuilding, axis = 0, offset = 1)
+    buildingBehind = shiftMask(isBuilding, axis = 1, offset = -1)
+    buildingFront = shiftMask(isBuilding, axis = 1, offset = 1)
+    buildingBelow = shiftMask(isBuilding, axis = 2, offset = -1)
+    buildingAbove = shiftMask(isBuilding, axis = 2, offset = 1)
+    
+    # Identify cells having wall below AND front, left, right or behind
+    belowFront = buildingBelow & buildingFront
+    belowBehind = buildingBelow & buildingBehind
+    belowLeft = buildingBelow & buildingLeft
+    belowRight = buildingBelow & buildingRight
+    belowAnyAround = belowFront | belowBehind | belowLeft | belowRight
+    
+    # Go descending order along y
+    if DESCENDING_Y:
+        walls = ((WALL_E, buildingLeft | belowLeft), (WALL_F, buildingRight | belowRight),
+                 (WALL_G, buildingBehind | belowBehind), (WALL_H, buildingFront | belowFront),
+                 (WALL_M, buildingBelow), (WALL_N, buildingAbove | belowAnyAround))
+    else:
+        walls = ((WALL_E, buildingRight | belowRight), (WALL_F, buildingLeft | belowLeft),
+                 (WALL_G, buildingFront | belowFront), (WALL_H, buildingBehind | belowBehind),
+                 (WALL_M, buildingAbove), (WALL_N, buildingBelow | belowAnyAround))
+    for wall, isWall in walls:
+        np.bitwise_or(flags, wall, out = flags, where = isWall)
+    
+    # Lambda is calculated for all cells except buildings and sketch boundaries
+    flags[1:-1, 1:-1, 1:-1][~isBuilding[1:-1, 1:-1, 1:-1]] |= SOLVED
+    
+    return flags
+
+def shiftMask(mask, axis, offset):
+    """ Shift a 3D boolean mask along an axis: the value of a cell becomes
+    the value of its neighbour located 'offset' cells further along the axis
+    (False when the neighbour is outside the grid).
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            mask: 3D array
+                Boolean mask to shift
+            axis: int
+                Axis along which the mask is shifted
+            offset: int
+                Position of the neighbour relative to the cell along the axis
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            shifted: 3D array
+                Shifted boolean mask"""
+    shifted = np.zeros_like(mask)
+    source = [slice(None)] * mask.ndim
+    destination = [slice(None)] * mask.ndim
+    if offset > 0:
+        source[axis] = slice(offset, None)
+        destination[axis] = slice(None, -offset)
+    else:
+        source[axis] = slice(None, offset)
+        destination[axis] = slice(-offset, None)
+    shifted[tuple(destination)] = mask[tuple(source)]
+    
+    return shifted
+
+def decodeObstacleFlags(flags):
+    """ Get the coefficients of the lambda equation from obstacle flags.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            flags: array
+                Obstacle flags (uint8) of a set of cells
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            e, f, g, h, m, n, o, p, q: arrays
+                Coefficients of the lambda equation for each cell"""
+    isWall = [(flags & wall) > 0 for wall in (WALL_E, WALL_F, WALL_G, WALL_H, WALL_M, WALL_N)]
+    e, f, g, h, m, n = [np.where(isWallCoef, 0., 1.) for isWallCoef in isWall]
+    o = np.where(isWall[0] | isWall[1], 0.5, 1.)
+    p = np.where(isWall[2] | isWall[3], 0.5, 1.)
+    q = np.where(isWall[4] | isWall[5], 0.5, 1.)
+    
+    return e, f, g, h, m, n, o, p, q
+
+def extendActiveCells(cells4Solver, isHot, active, flags, nbLayers):
+    """ Extend the active cells of the active-set mode by 'nbLayers' layers
+    of cells around the "hot" active cells (only the active cells and their
+    neighbours are visited).
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            cells4Solver: 2D array
+                3D coordinates of the active cells
+            isHot: 1D array
+                Whether each active cell extends the active cells
+            active: 3D array
+                Boolean mask of the active cells (updated in place)
+            flags: 3D array
+                Obstacle flags (uint8) of the lambda equation for each cell
+            nbLayers: int
+                Number of layers of cells added around the hot cells
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            cells4Solver: 2D array
+                3D coordinates of the active cells (lexicographic order)
+            nbNewCells: int
+                Number of cells added"""
+    newCells = growActiveSet(cells4Solver, isHot, active, flags, nbLayers)
+    if newCells.shape[0] == 0:
+        return cells4Solver, 0
+    cells4Solver = np.concatenate([cells4Solver, newCells])
+    # Keep the lexicographic order of the sweep
+    cells4Solver = cells4Solver[np.lexsort((cells4Solver[:, 2], cells4Solver[:, 1],
+                                            cells4Solver[:, 0]))]
+    
+    return cells4Solver, newCells.shape[0]
+
+def splitRedBlack(cells4Solver):
+    """ Split the cells of the solver into two colors ("checkerboard"): the
+    7-points stencil of a cell only involves cells of the other color.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            cells4Solver: 1D array
+                Array of 3D cell coordinates for which the wind solver is applied
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            redCells: 1D array
+                Array of 3D cell coordinates having an even sum of indices
+            blackCells: 1D array
+                Array of 3D cell coordinates having an odd sum of indices"""
+    isRed = cells4Solver.sum(axis = 1) % 2 == 0
+    
+    return cells4Solver[isRed], cells4Solver[~isRed]
+
+def coarsenAxis(positions):
+    """ Identify for each cell of an axis the cell of the coarser grid
+    containing it. Boundary cells remain boundary cells while two consecutive
+    inner cells are merged. The weights used to interpolate a coarse grid
+    correction to the fine grid are also calculated.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            positions: 1D array
+                Position of each fine cell center along the axis (in finest
+                grid spacing unit)
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            fine2coarse: 1D array
+                Index of the coarse cell containing each fine cell
+            fine2neighbour: 1D array
+                Index of the closest other coarse cell of each fine cell
+            weights: 1D array
+                Interpolation weight of the coarse cell containing each
+                fine cell (the closest other coarse cell having 1 - weight)
+            coarsePositions: 1D array
+                Position of each coarse cell center along the axis"""
+    nFine = positions.size
+    nCoarse = (nFine - 1) // 2 + 2
+    fine2coarse = (np.arange(nFine, dtype = np.int32) + 1) // 2
+    fine2coarse[0] = 0
+    fine2coarse[-1] = nCoarse - 1
+    
+    # Boundary cells keep their position, others are at their fine cells center
+    coarsePositions = np.bincount(fine2coarse, weights = positions) / np.bincount(fine2coarse)
+    coarsePositions[0] = positions[0]
+    coarsePositions[-1] = positions[-1]
+    
+    # The closest other coarse cell is on the side of the fine cell
+    fine2neighbour = np.where(positions < coarsePositions[fine2coarse],
+                              fine2coarse - 1,
+                              fine2coarse + 1).astype(np.int32)
+    fine2neighbour = np.clip(fine2neighbour, 0, nCoarse - 1).astype(np.int32)
+    weights = np.ones(nFine)
+    distNeighbour = np.abs(coarsePositions[fine2neighbour] - coarsePositions[fine2coarse])
+    hasNeighbour = distNeighbour > 0
+    weights[hasNeighbour] = 1 - np.abs(positions - coarsePositions[fine2coarse])[hasNeighbour]\
+        / distNeighbour[hasNeighbour]
+    
+    return fine2coarse, fine2neighbour, weights, coarsePositions
+
+def createMultigridLevels(lambdaN1, rhs, cells4Solver, buildingCoordinates,
+                          flags, minCells = MULTIGRID_MIN_CELLS):
+    """ Create the hierarchy of grids used by the multigrid solver. A coarse
+    cell is considered as obstacle only if all the fine cells it contains
+    are obstacles. The obstacle flags of each coarse level are then calculated
+    from the coarse building coordinates. Since coarse cell centers are not
+    located at a full coarse grid spacing from the sketch boundaries, the
+    diagonal coefficient of the cells close to the boundaries is corrected 
+    such that lambda is 0 at the real boundary location (linear extrapolation).
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            lambdaN1: 3D array
+                Lagrange multiplier of the fine grid
+            rhs: 3D array
+                Right hand side of the lambda equation of the fine grid
+            cells4Solver: 1D array
+                Array of 3D cell coordinates for which the wind solver is applied
+            buildingCoordinates: 3D array
+                Building 3D coordinates
+            flags: 3D array
+                Obstacle flags of the fine grid
+            minCells: int, default MULTIGRID_MIN_CELLS
+                Minimum number of inner cells along each axis of the coarsest grid
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            levels: list of dictionaries
+                Data of each grid level (from the finest to the coarsest)"""
+    redCells, blackCells = splitRedBlack(cells4Solver)
+    levels = [{"lambda": lambdaN1, "rhs": rhs, "cells": cells4Solver,
+               "red": redCells, "black": blackCells,
+               "flags": flags,
+               "corrections": tuple(np.zeros(nAxis) for nAxis in lambdaN1.shape),
+               "residual": np.zeros(lambdaN1.shape, dtype = lambdaN1.dtype)}]
+    fluid = np.ones(lambdaN1.shape, dtype = np.int32)
+    fluid[buildingCoordinates[0], buildingCoordinates[1], buildingCoordinates[2]] = 0
+    positions = [np.arange(nAxis, dtype = np.float64) for nAxis in lambdaN1.shape]
+    spacing = 1
+    
+    while min(fluid.shape) - 2 >= 2 * minCells:
+        # Identify the coarse cell of each fine cell along each axis
+        ci, ni, wi, posI = coarsenAxis(positions[0])
+        cj, nj, wj, posJ = coarsenAxis(positions[1])
+        ck, nk, wk, posK = coarsenAxis(positions[2])
+        nxc, nyc, nzc = posI.size, posJ.size, posK.size
+        positions = [posI, posJ, posK]
+        spacing *= 2
+        
+        # A coarse cell is fluid if at least one of its fine cells is fluid
+        coarseFluid = np.zeros((nxc, nyc, nzc), dtype = np.int32)
+        np.add.at(coarseFluid, (ci[:, None, None], cj[None, :, None], ck[None, None, :]), fluid)
+        coarseFluid = (coarseFluid > 0).astype(np.int32)
+        
+        # Coarse building coordinates and cells where lambda is calculated
+        coarseBuildingCoordinates = np.stack(np.where(coarseFluid == 0)).astype(np.int32)
+        coarseCells = np.transpose(np.where(coarseFluid[1:-1, 1:-1, 1:-1] == 1)).astype(np.int32) + 1
+        redCells, blackCells = splitRedBlack(coarseCells)
+        coarseFlags = setObstacleFlags(nx = nxc, ny = nyc, nz = nzc,
+                                       buildingCoordinates = coarseBuildingCoordinates)
+        
+        # Correction of the diagonal coefficient (o, p or q) of the cells close
+        # to the boundaries along each axis: the boundary ghost value is replaced
+        # by the extrapolated value -c * lambda (the correction is multiplied 
+        # by the coefficient of the boundary neighbour within the kernels)
+        corrections = []
+        for pos in (posI, posJ, posK):
+            correction = np.zeros(pos.size)
+            for ind, dist in [(1, pos[1] - pos[0]),
+                              (-2, pos[-1] - pos[-2])]:
+                correction[ind] = (spacing - dist) / dist / 2
+            corrections.append(correction)
+        
+        levels[-1]["fine2coarse"] = (ci, cj, ck)
+        levels[-1]["fine2neighbour"] = (ni, nj, nk)
+        levels[-1]["weights"] = (wi, wj, wk)
+        levels.append({"lambda": np.zeros((nxc, nyc, nzc), dtype = lambdaN1.dtype),
+                       "rhs": np.zeros((nxc, nyc, nzc), dtype = lambdaN1.dtype),
+                       "count": np.zeros((nxc, nyc, nzc)),
+                       "fluid": coarseFluid,
+                       "cells": coarseCells,
+                       "red": redCells,
+                       "black": blackCells,
+                       "flags": coarseFlags,
+                       "corrections": tuple(corrections),
+                       "residual": np.zeros((nxc, nyc, nzc), dtype = lambdaN1.dtype)})
+        fluid = coarseFluid
+    
+    return levels
+
+def vCycle(levels, level, A, B, 
+           nbPreSmoothing = MULTIGRID_PRE_SMOOTHING,
+           nbPostSmoothing = MULTIGRID_POST_SMOOTHING,
+           nbCoarsestSmoothing = MULTIGRID_COARSEST_SMOOTHING):
+    """ Apply a multigrid V-cycle to the lambda equation of a given level
+    (lambda of the level is updated in place).
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            levels: list of dictionaries
+                Data of each grid level (from the finest to the coarsest)
+            level: int
+                Index of the level where the V-cycle starts
+            A: float
+                Coefficient (dx / dy) ** 2 of the lambda equation
+            B: float
+                Coefficient (dx / dz) ** 2 of the lambda equation
+            nbPreSmoothing: int, default MULTIGRID_PRE_SMOOTHING
+                Number of red-black relaxations before the coarse grid correction
+            nbPostSmoothing: int, default MULTIGRID_POST_SMOOTHING
+                Number of red-black relaxations after the coarse grid correction
+            nbCoarsestSmoothing: int, default MULTIGRID_COARSEST_SMOOTHING
+                Number of red-black relaxations used to solve the coarsest level
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            None"""
+    lev = levels[level]
+    flags = lev["flags"]
+    corrI, corrJ, corrK = lev["corrections"]
+    
+    # Solve the coarsest level using many relaxations
+    if level == len(levels) - 1:
+        for N in range(nbCoarsestSmoothing):
+            for cellsColor in (lev["red"], lev["black"]):
+                relaxRedBlack(cellsColor, lev["lambda"], lev["rhs"], 1.5,
+                              flags, corrI, corrJ, corrK, DESCENDING_Y, A, B)
+        return None
+    
+    # Pre-smoothing (Gauss-Seidel relaxation is the most efficient smoother)
+    for N in range(nbPreSmoothing):
+        for cellsColor in (lev["red"], lev["black"]):
+            relaxRedBlack(cellsColor, lev["lambda"], lev["rhs"], 1.,
+                          flags, corrI, corrJ, corrK, DESCENDING_Y, A, B)
+    
+    # Restrict the residual to the coarse level (the equation being
+    # multiplied by the squared grid spacing, the residual is multiplied by 4)
+    coarse = levels[level + 1]
+    ci, cj, ck = lev["fine2coarse"]
+    calcResidual(lev["cells"], lev["lambda"], lev["rhs"], lev["residual"],
+                 flags, corrI, corrJ, corrK, DESCENDING_Y, A, B)
+    coarse["rhs"][:] = 0
+    coarse["count"][:] = 0
+    restrictResidual(lev["cells"], lev["residual"], coarse["rhs"], coarse["count"], ci, cj, ck)
+    coarse["rhs"][coarse["count"] > 0] *= 4. / coarse["count"][coarse["count"] > 0]
+    
+    # Solve the error equation on the coarse level and correct the fine level
+    coarse["lambda"][:] = 0
+    vCycle(levels = levels, level = level + 1, A = A, B = B,
+           nbPreSmoothing = nbPreSmoothing, nbPostSmoothing = nbPostSmoothing,
+           nbCoarsestSmoothing = nbCoarsestSmoothing)
+    ni, nj, nk = lev["fine2neighbour"]
+    wi, wj, wk = lev["weights"]
+    prolongCorrection(lev["cells"], lev["lambda"], coarse["lambda"], coarse["fluid"],
+                      ci, cj, ck, ni, nj, nk, wi, wj, wk)
+    
+    # Post-smoothing
+    for N in range(nbPostSmoothing):
+        for cellsColor in (lev["black"], lev["red"]):
+            relaxRedBlack(cellsColor, lev["lambda"], lev["rhs"], 1.,
+                          flags, corrI, corrJ, corrK, DESCENDING_Y, A, B)
+    
+    return None
+
+def assembleOperator(cells4Solver, flags, A, B):
+    """ Build the sparse matrix of the lambda equation (7-points stencil) for
+    the cells where the wind solver is applied (unknowns are numbered in the 
+    cells4Solver order). Lambda being 0 for the other cells, they do not 
+    appear in the matrix.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            cells4Solver: 1D array
+                Array of 3D cell coordinates for which the wind solver is applied
+            flags: 3D array
+                Obstacle flags of the lambda equation
+            A: float
+                Coefficient (dx / dy) ** 2 of the lambda equation
+            B: float
+                Coefficient (dx / dz) ** 2 of the lambda equation
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            operator: scipy.sparse.csr_matrix
+                Matrix L of the lambda equation L.lambda = rhs"""
+    i, j, k = cells4Solver.T
+    nbCells = cells4Solver.shape[0]
+    # Coefficients of each unknown
+    e, f, g, h, m, n, o, p, q = decodeObstacleFlags(flags[i, j, k])
+    
+    # Number of each unknown in the 3D grid (-1 for the cells not solved)
+    cellNumbers = np.full(flags.shape, -1, dtype = np.int64)
+    cellNumbers[i, j, k] = np.arange(nbCells)
+    
+    # Neighbour position associated with each coefficient
+    if DESCENDING_Y:
+        offsets = ((e, -1, 0, 0, 1.), (f, 1, 0, 0, 1.), (g, 0, -1, 0, A), 
+                   (h, 0, 1, 0, A), (m, 0, 0, -1, B), (n, 0, 0, 1, B))
+    else:
+        offsets = ((e, 1, 0, 0, 1.), (f, -1, 0, 0, 1.), (g, 0, 1, 0, A), 
+                   (h, 0, -1, 0, A), (m, 0, 0, 1, B), (n, 0, 0, -1, B))
+    
+    rows = [np.arange(nbCells)]
+    columns = [np.arange(nbCells)]
+    values = [2. * (o + A * p + B * q)]
+    for coef, di, dj, dk, factor in offsets:
+        neighbours = cellNumbers[i + di, j + dj, k + dk]
+        isSolved = (neighbours >= 0) & (coef != 0)
+        rows.append(np.arange(nbCells)[isSolved])
+        columns.append(neighbours[isSolved])
+        values.append(-factor * coef[isSolved])
+    
+    # The matrix is kept in double precision whatever the precision of the
+    # coefficients (the conjugate gradient is sensitive to round-off errors)
+    operator = sparse.csr_matrix((np.concatenate(values),
+                                  (np.concatenate(rows), np.concatenate(columns))),
+                                 shape = (nbCells, nbCells), dtype = np.float64)
+    operator.sort_indices()
+    
+    return operator
+
+def createPreconditioner(operator, preconditioner = PCG_PRECONDITIONER):
+    """ Create the function applying the inverse of a preconditioner of the
+    lambda equation matrix to a vector.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            operator: scipy.sparse.csr_matrix
+                Matrix L of the lambda equation L.lambda = rhs
+            preconditioner: String, default PCG_PRECONDITIONER
+                Type of preconditioner:
+                    - "jacobi": diagonal of the matrix
+                    - "ssor": symmetric successive over-relaxation (one 
+                    forward and one backward Gauss-Seidel sweep)
+                    - "ic": incomplete Cholesky factorization without fill-in
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            applyPreconditioner: function
+                Function returning M^-1.r for a given residual vector r"""
+    diagonal = operator.diagonal()
+    if preconditioner == "jacobi":
+        inverseDiagonal = 1. / diagonal
+        def applyPreconditioner(residual):
+            return inverseDiagonal * residual
+    elif preconditioner == "ssor":
+        def applyPreconditioner(residual):
+            return applySsor(operator.indptr, operator.indices, operator.data,
+                             diagonal, residual, 1.)
+    elif preconditioner == "ic":
+        # The factor keeps the sparsity pattern of the lower part of the matrix
+        lower = sparse.tril(operator, format = "csr")
+        lower.sort_indices()
+        lowerData = factorizeIncompleteCholesky(lower.indptr, lower.indices, 
+                                                lower.data)
+        def applyPreconditioner(residual):
+            return applyIncompleteCholesky(lower.indptr, lower.indices,
+                                           lowerData, residual)
+    else:
+        raise ValueError("Unknown preconditioner '{0}'".format(preconditioner))
+    
+    return applyPreconditioner
+
+def createIterationLogger(maxIterations, threshold, feedback = None,
+                          criterion = "eps", minInterval = SOLVER_LOG_INTERVAL):
+    """ Create the default iteration callback of the wind solver: the progress
+    is printed (and sent to QGIS) at most once every 'minInterval' seconds
+    instead of at each iteration.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            maxIterations: int
+                Maximum number of wind solver iterations
+            threshold: float
+                Threshold of the convergence criterion
+            feedback: Qgis.core class QgsProcessingFeedback, default None
+                Base class for providing feedback to QGIS from a processing algorithm (if not in standalone mode).
+            criterion: String, default "eps"
+                Name of the convergence criterion in the messages
+            minInterval: float, default SOLVER_LOG_INTERVAL
+                Minimum time (s) between two messages
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            iterationCallback: function
+                Function to call with the iteration number and the value of 
+                the convergence criterion"""
+    lastTime = [time.time()]
+    
+    def iterationCallback(N, value):
+        timeNow = time.time()
+        if timeNow - lastTime[0] < minInterval:
+            return None
+        lastTime[0] = timeNow
+        textToSend = "Iteration {0} (max {1}) - {2} = {3} >= {4}".format(N,
+                                                                          maxIterations,
+                                                                          criterion,
+                                                                          np.format_float_scientific(value, 3),
+                                                                          threshold)
+        print(textToSend)
+        if feedback is not None:
+            feedback.setProgressText(textToSend)
+    
+    return iterationCallback
+
+def solvePcg(operator, rhs, lambda0, applyPreconditioner, 
+             maxIterations = MAX_ITERATIONS, 
+             residualThreshold = PCG_RESIDUAL_THRESHOLD,
+             iterationCallback = None, isCanceled = None):
+    """ Solve the lambda equation using the preconditioned conjugate gradient
+    method. The solver stops when the true relative residual norm
+    ||rhs - L.lambda|| / ||rhs|| goes under a threshold.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            operator: scipy.sparse.csr_matrix
+                Matrix L of the lambda equation L.lambda = rhs
+            rhs: 1D array
+                Right hand side of the lambda equation
+            lambda0: 1D array
+                Initial guess of lambda
+            applyPreconditioner: function
+                Function returning M^-1.r for a given residual vector r
+            maxIterations: int, default MAX_ITERATIONS
+                Maximum number of iterations (solver stops if reached)
+            residualThreshold: float, default PCG_RESIDUAL_THRESHOLD
+                Threshold of the relative residual norm for stopping the solver
+            iterationCallback: function, default None
+                Function called with the iteration number and the relative 
+                residual norm after each iteration not reaching the threshold
+            isCanceled: function, default None
+                Function returning True when the solver should stop
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            lambdaN1: 1D array
+                Solution of the lambda equation
+            residualNorm: float
+                True relative residual norm of the solution"""
+    lambdaN1 = np.array(lambda0, dtype = np.float64)
+    rhsNorm = np.linalg.norm(rhs)
+    if rhsNorm == 0:
+        return np.zeros_like(lambdaN1), 0.
+    
+    residual = rhs - operator.dot(lambdaN1)
+    residualNorm = np.linalg.norm(residual) / rhsNorm
+    precResidual = applyPreconditioner(residual)
+    direction = precResidual.copy()
+    rz = np.dot(residual, precResidual)
+    for N in range(maxIterations):
+        if residualNorm < residualThreshold:
+            break
+        operatorDirection = operator.dot(direction)
+        step = rz / np.dot(direction, operatorDirection)
+        lambdaN1 += step * direction
+        residual -= step * operatorDirection
+        residualNorm = np.linalg.norm(residual) / rhsNorm
+        
+        # The recursively updated residual may drift from the true residual:
+        # check the true one before stopping (and restart from it if needed)
+        if residualNorm < residualThreshold:
+            residual = rhs - operator.dot(lambdaN1)
+            residualNorm = np.linalg.norm(residual) / rhsNorm
+            if residualNorm < residualThreshold:
+                break
+            precResidual = applyPreconditioner(residual)
+            direction = precResidual.copy()
+            rz = np.dot(residual, precResidual)
+        else:
+            precResidual = applyPreconditioner(residual)
+            rzN1 = np.dot(residual, precResidual)
+            direction = precResidual + (rzN1 / rz) * direction
+            rz = rzN1
+        
+        if iterationCallback is not None:
+            iterationCallback(N + 1, residualNorm)
+        if isCanceled is not None and isCanceled():
+            break
+    print("Wind solver stopped after {0} iterations (residual = {1})".format(N + 1,
+                                                                              np.format_float_scientific(residualNorm, 3)))
+    
+    return lambdaN1, residualNorm
+
+def splitTiles(nx, ny, nbTiles):
+    """ Split the (nx, ny) plane into rectangular tiles (the number of tiles
+    along each axis being proportional to the number of cells).
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            nx: int
+                Number of cells along X-axis
+            ny: int
+                Number of cells along Y-axis
+            nbTiles: int
+                Number of tiles
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            tiles: list of tuple
+                (iStart, iEnd, jStart, jEnd) of each tile (end excluded)"""
+    # Choose the factorization nbTiles = nbTilesX * nbTilesY giving tiles 
+    # as square as possible
+    nbTilesX = min(range(1, nbTiles + 1),
+                   key = lambda t: np.inf if nbTiles % t else abs(np.log(nx / t) - np.log(ny * t / nbTiles)))
+    nbTilesY = nbTiles // nbTilesX
+    iLimits = np.linspace(0, nx, nbTilesX + 1).round().astype(int)
+    jLimits = np.linspace(0, ny, nbTilesY + 1).round().astype(int)
+    
+    return [(iLimits[a], iLimits[a + 1], jLimits[b], jLimits[b + 1])
+            for a in range(nbTilesX) for b in range(nbTilesY)]
+
+def createSharedArray(array):
+    """ Copy an array into a new shared memory block.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            array: nD array
+                Array to share between processes
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            sharedMemory: multiprocessing.shared_memory.SharedMemory
+                Shared memory block (to close and unlink once finished)
+            sharedArray: nD array
+                Array using the shared memory block
+            spec: tuple
+                (name, shape, dtype) needed to attach the array in an other process"""
+    sharedMemory = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+    sharedArray = np.ndarray(array.shape, dtype = array.dtype, buffer = sharedMemory.buf)
+    sharedArray[:] = array
+    
+    return sharedMemory, sharedArray, (sharedMemory.name, array.shape, array.dtype.str)
+
+def getPythonExecutable():
+    """ Return the path of the Python interpreter used to start the processes
+    of the "schwarz" method. When the plugin runs within QGIS, 'sys.executable'
+    is the QGIS application: the interpreter of the Python installation used
+    by QGIS is looked for instead (None if not found)"""
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        return sys.executable
+    for directory in (sys.exec_prefix, os.path.join(sys.exec_prefix, "bin")):
+        for name in ("python.exe", "python3", "python"):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                return path
+    
+    return None
+
+def attachSharedArray(spec):
+    """ Attach (within a worker process) an array created by 'createSharedArray'
+    from its (name, shape, dtype) spec. Return the shared memory block and the array"""
+    name, shape, dtype = spec
+    try:
+        sharedMemory = shared_memory.SharedMemory(name = name, track = False)
+    except TypeError:
+        # Before Python 3.13 (the workers share the resource tracker of the
+        # main process, which unlinks the block)
+        sharedMemory = shared_memory.SharedMemory(name = name)
+    
+    return sharedMemory, np.ndarray(shape, dtype = dtype, buffer = sharedMemory.buf)
+
+def initSchwarzWorker(specs, parameters):
+    """ Initialize a worker process of the "schwarz" method: attach the 
+    shared arrays and store the solver parameters"""
+    # Each process solves its tile on a single thread
+    numba.set_num_threads(1)
+    for key, spec in specs.items():
+        schwarzWorkerData[key] = attachSharedArray(spec)
+    schwarzWorkerData["parameters"] = parameters
+
+def relaxTile(tile, source):
+    """ Apply the successive over-relaxation to a tile extended by its halo, 
+    lambda on the outer boundary of the extended tile being fixed to its 
+    value of the previous outer iteration. Only the tile itself (not the
+    halo) is copied to the lambda buffer of the next outer iteration.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            tile: tuple
+                (iStart, iEnd, jStart, jEnd) of the tile (end excluded)
+            source: int
+                Index (0 or 1) of the lambda buffer of the previous outer iteration
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            sumVariation: float
+                Sum of the lambda variation over the tile during the outer iteration
+            sumLambda: float
+                Sum of lambda over the tile"""
+    omega, alpha1, dx, dy, dz, A, B, zWeights, haloSize, innerIterations = schwarzWorkerData["parameters"]
+    u0 = schwarzWorkerData["u0"][1]
+    v0 = schwarzWorkerData["v0"][1]
+    w0 = schwarzWorkerData["w0"][1]
+    flags = schwarzWorkerData["flags"][1]
+    lambdaSource = schwarzWorkerData["lambda{0}".format(source)][1]
+    lambdaTarget = schwarzWorkerData["lambda{0}".format(1 - source)][1]
+    nx, ny, nz = flags.shape
+    
+    # Tile extended by the halo and by one fixed layer
+    iStart, iEnd, jStart, jEnd = tile
+    iMin = max(iStart - haloSize - 1, 0)
+    iMax = min(iEnd + haloSize + 1, nx)
+    jMin = max(jStart - haloSize - 1, 0)
+    jMax = min(jEnd + haloSize + 1, ny)
+    lambdaTile = lambdaSource[iMin:iMax, jMin:jMax, :].copy()
+    for N in range(innerIterations):
+        calcLambdaDense(lambdaTile, omega, alpha1,
+                        u0[iMin:iMax, jMin:jMax, :],
+                        v0[iMin:iMax, jMin:jMax, :],
+                        w0[iMin:iMax, jMin:jMax, :],
+                        dx, dy, dz, flags[iMin:iMax, jMin:jMax, :],
+                        DESCENDING_Y, A, B, zWeights, False)
+    
+    lambdaCore = lambdaTile[iStart - iMin:iEnd - iMin, jStart - jMin:jEnd - jMin, :]
+    sumVariation = np.sum(np.abs(lambdaCore - lambdaSource[iStart:iEnd, jStart:jEnd, :]),
+                          dtype = np.float64)
+    sumLambda = np.sum(np.abs(lambdaCore), dtype = np.float64)
+    lambdaTarget[iStart:iEnd, jStart:jEnd, :] = lambdaCore
+    
+    return sumVariation, sumLambda
+
+def solveSchwarz(lambdaN1, u0, v0, w0, flags, omega, alpha1, dx, dy, dz, A, B, zWeights,
+                 maxIterations = MAX_ITERATIONS, 
+                 thresholdIterations = THRESHOLD_ITERATIONS,
+                 nbProcesses = DECOMPOSITION_NB_PROCESSES,
+                 haloSize = DECOMPOSITION_HALO_SIZE,
+                 innerIterations = DECOMPOSITION_INNER_ITERATIONS,
+                 iterationCallback = None, isCanceled = None):
+    """ Solve the lambda equation using an overlapping Schwarz domain 
+    decomposition: the (nx, ny) plane is split into one tile per process,
+    each tile extended by 'haloSize' cells being relaxed 'innerIterations'
+    times at each outer iteration. The 3D fields are shared between the
+    processes (multiprocessing.shared_memory), each process only copying
+    lambda of its extended tile. Lambda of the halos is exchanged between 
+    outer iterations (two lambda buffers being alternately read and written)
+    until the global convergence.
+    
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            lambdaN1: 3D array
+                Initial lambda (updated in place)
+            u0: 3D array
+                Initialized 3D wind speed value in X direction
+            v0: 3D array
+                Initialized 3D wind speed value in Y direction 
+            w0: 3D array
+                Initialized 3D wind speed value in Z direction
+            flags: 3D array
+                Obstacle flags (uint8) of the lambda equation for each cell
+            omega: float
+                Relaxation factor
+            alpha1: float
+                Gaussian precision moduli of the horizontal wind
+            dx: float
+                Grid spacing along X-axis
+            dy: float
+                Grid spacing along Y-axis  
+            dz: 1D array
+                Grid spacing along Z-axis of each level
+            A: float
+                Coefficient (dx / dy) ** 2 of the lambda equation
+            B: 1D array
+                Coefficient (dx / dz) ** 2 of the lambda equation of each level
+            zWeights: 2D array
+                Vertical weights of the lambda equation of each level (see
+                'calcVerticalWeights')
+            maxIterations: int, default MAX_ITERATIONS
+                Maximum number of sweeps of each tile (solver stops if reached)
+            thresholdIterations: float, default THRESHOLD_ITERATIONS
+                Threshold for stopping the solver: when the relative variation
+                of lambda per sweep during an outer iteration goes under this 
+                threshold, the solver stops
+            nbProcesses: int, default DECOMPOSITION_NB_PROCESSES
+                Number of processes (and of tiles), None: number of CPUs
+            haloSize: int, default DECOMPOSITION_HALO_SIZE
+                Number of cells overlapping the neighbouring tiles
+            innerIterations: int, default DECOMPOSITION_INNER_ITERATIONS
+                Number of sweeps of each tile between two halo exchanges
+            iterationCallback: function, default None
+                Function called with the number of sweeps and the relative
+                variation of lambda after each outer iteration not reaching
+                the threshold
+            isCanceled: function, default None
+                Function returning True when the solver should stop
+        
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _ 
+    
+            lambdaN1: 3D array
+                Solution of the lambda equation
+            eps: float
+                Relative variation of lambda per sweep during the last outer iteration"""
+    nx, ny, nz = flags.shape
+    nbProcesses = nbProcesses or os.cpu_count()
+    tiles = splitTiles(nx = nx, ny = ny, nbTiles = nbProcesses)
+    print("Domain decomposition: {0} tiles of about {1} x {2} cells".format(len(tiles),
+                                                                           tiles[0][1] - tiles[0][0],
+                                                                           tiles[0][3] - tiles[0][2]))
+    
+    sharedBlocks = []
+    specs = {}
+    sharedArrays = {}
+    try:
+        for key, array in (("u0", u0), ("v0", v0), ("w0", w0), ("flags", flags),
+                           ("lambda0", lambdaN1), ("lambda1", lambdaN1)):
+            sharedMemory, sharedArrays[key], specs[key] = createSharedArray(array)
+            sharedBlocks.append(sharedMemory)
+        parameters = (omega, alpha1, dx, dy, dz, A, B, zWeights, haloSize, innerIterations)
+        
+        # Spawned processes do not inherit the numba threads of the main one
+        # (and are started from a Python interpreter, not from QGIS)
+        context = multiprocessing.get_context(DECOMPOSITION_START_METHOD)
+        if DECOMPOSITION_START_METHOD != "fork":
+            context.set_executable(getPythonExecutable())
+        with context.Pool(processes = len(tiles), initializer = initSchwarzWorker,
+                          initargs = (specs, parameters)) as pool:
+            source = 0
+            eps = np.inf
+            nbOuterIterations = max(maxIterations // innerIterations, 1)
+            for N in range(nbOuterIterations):
+                sums = pool.starmap(relaxTile, [(tile, source) for tile in tiles])
+                source = 1 - source
+                sumVariation, sumLambda = np.sum(sums, axis = 0)
+                eps = sumVariation / innerIterations / sumLambda
+                if eps < thresholdIterations:
+                    break
+                if iterationCallback is not None:
+                    iterationCallback((N + 1) * innerIterations, eps)
+                if isCanceled is not None and isCanceled():
+                    break
+        lambdaN1[:] = sharedArrays["lambda{0}".format(source)]
+        print("Wind solver stopped after {0} iterations (eps = {1}, {2} outer iterations)".format((N + 1) * innerIterations,
+                                                                                                  np.round(eps, 6),
+                                                                                                  N + 1))
+    finally:
+        sharedArrays.clear()
+        for sharedMemory in sharedBlocks:
+            sharedMemory.close()
+            sharedMemory.unlink()
+    
+    return lambdaN1, eps
+
+@jit(nopython=True, nogil=True, cache=True)
+def decodeFlag(flag):
+    # Coefficients e, f, g, h, m, n, o, p, q of the lambda equation of a cell
+    e = 0. if flag & WALL_E else 1.
+    f = 0. if flag & WALL_F else 1.
+    g = 0. if flag & WALL_G else 1.
+    h = 0. if flag & WALL_H else 1.
+    m = 0. if flag & WALL_M else 1.
+    n = 0. if flag & WALL_N else 1.
+    o = 0.5 if flag & (WALL_E | WALL_F) else 1.
+    p = 0.5 if flag & (WALL_G | WALL_H) else 1.
+    q = 0.5 if flag & (WALL_M | WALL_N) else 1.
+    
+    return e, f, g, h, m, n, o, p, q
+
+@jit(nopython=True, nogil=True, cache=True)
+def calcVerticalDiagonal(m, n, q, zWeights, k, DESCENDING_Y):
+    # Half of the weight of lambda[k] in the vertical terms of the lambda 
+    # equation: only the neighbours not being an obstacle are kept (their 
+    # weights differ on a stretched grid). 'm' weights the cell above (below
+    # in descending order)
+    if m == 0. and n == 0.:
+        return q * zWeights[k, 2]
+    if DESCENDING_Y:
+        return 0.5 * (m * zWeights[k, 0] + n * zWeights[k, 1])
+    return 0.5 * (m * zWeights[k, 1] + n * zWeights[k, 0])
+
+@jit(nopython=True, nogil=True, cache=True)
+def calcLambda(cells4Solver, lambdaN1, omega, alpha1, u0, v0, w0, dx, dy, dz, flags, DESCENDING_Y, A, B, zWeights, computeVariation):
+    # Sums of the lambda variation and of lambda (in double precision) used
+    # for the convergence criterion when 'computeVariation' is True
+    sumVariation = 0.
+    sumLambda = 0.
+    # Go descending order along y
+    if DESCENDING_Y:
+        for c in range(cells4Solver.shape[0] - 1, -1, -1):
+            i = cells4Solver[c, 0]
+            j = cells4Solver[c, 1]
+            k = cells4Solver[c, 2]
+            e, f, g, h, m, n, o, p, q = decodeFlag(flags[i, j, k])
+            lambdaOld = lambdaN1[i, j, k]
+            lambdaNew = omega * (
+                ((-1.) * (dx ** 2 * (-2. * alpha1 ** 2) * (((u0[i, j, k] - u0[i + 1, j, k]) / (dx) + (
+                        v0[i, j, k] - v0[i, j + 1, k]) / (dy) +
+                                                            (w0[i, j, k] - w0[i, j, k + 1]) / (dz[k])))) + (
+                          e * lambdaN1[i - 1, j, k] + f * lambdaN1[i + 1, j, k] + A * (
+                          g * lambdaN1[i, j - 1, k] + h * lambdaN1[i, j + 1, k]) + B[k] * (
+                                  m * zWeights[k, 0] * lambdaN1[i, j, k - 1] + n * zWeights[k, 1] * lambdaN1[i, j, k + 1]))) / (
+                        2. * (o + A * p + B[k] * calcVerticalDiagonal(m, n, q, zWeights, k, DESCENDING_Y)))) + (1 - omega) * lambdaOld
+            lambdaN1[i, j, k] = lambdaNew
+            if computeVariation:
+                sumVariation += abs(lambdaNew - lambdaOld)
+                sumLambda += abs(lambdaNew)
+
+    else:
+        for i, j, k in cells4Solver:
+            e, f, g, h, m, n, o, p, q = decodeFlag(flags[i, j, k])
+            lambdaOld = lambdaN1[i, j, k]
+            lambdaNew = omega * (
+                ((-1.) * (dx ** 2 * (-2. * alpha1 ** 2) * (((u0[i + 1, j, k] - u0[i, j, k]) / (dx) + (
+                        v0[i, j + 1, k] - v0[i, j, k]) / (dy) +
+                                                            (w0[i, j, k + 1] - w0[i, j, k]) / (dz[k])))) + (
+                          e * lambdaN1[i + 1, j, k] + f * lambdaN1[i - 1, j, k] + A * (
+                          g * lambdaN1[i, j + 1, k] + h * lambdaN1[i, j - 1, k]) + B[k] * (
+                                  m * zWeights[k, 1] * lambdaN1[i, j, k + 1] + n * zWeights[k, 0] * lambdaN1[i, j, k - 1]))) / (
+                        2. * (o + A * p + B[k] * calcVerticalDiagonal(m, n, q, zWeights, k, DESCENDING_Y)))) + (1 - omega) * lambdaOld
+            lambdaN1[i, j, k] = lambdaNew
+            if computeVariation:
+                sumVariation += abs(lambdaNew - lambdaOld)
+                sumLambda += abs(lambdaNew)
+
+    return sumVariation, sumLambda
+@jit(nopython=True, nogil=True, cache=True)
+def calcLambdaDense(lambdaN1, omega, alpha1, u0, v0, w0, dx, dy, dz, flags, DESCENDING_Y, A, B, zWeights, computeVariation):
+    # Same as 'calcLambda' but sweeping the 3D grid (in the order of the
+    # cells4Solver array) and skipping the cells not solved
+    nx, ny, nz = flags.shape
+    # Convergence sums (see 'calcLambda')
+    sumVariation = 0.
+    sumLambda = 0.
+    for I in range(1, nx - 1):
+        for J in range(1, ny - 1):
+            for K in range(1, nz - 1):
+                # Go descending order along y
+                if DESCENDING_Y:
+                    i = nx - 1 - I
+                    j = ny - 1 - J
+                    k = nz - 1 - K
+                else:
+                    i = I
+                    j = J
+                    k = K
+                if not flags[i, j, k] & SOLVED:
+                    continue
+                e, f, g, h, m, n, o, p, q = decodeFlag(flags[i, j, k])
+                if DESCENDING_Y:
+                    lambdaOld = lambdaN1[i, j, k]
+                    lambdaNew = omega * (
+                        ((-1.) * (dx ** 2 * (-2. * alpha1 ** 2) * (((u0[i, j, k] - u0[i + 1, j, k]) / (dx) + (
+                                v0[i, j, k] - v0[i, j + 1, k]) / (dy) +
+                                                                    (w0[i, j, k] - w0[i, j, k + 1]) / (dz[k])))) + (
+                                  e * lambdaN1[i - 1, j, k] + f * lambdaN1[i + 1, j, k] + A * (
+                                  g * lambdaN1[i, j - 1, k] + h * lambdaN1[i, j + 1, k]) + B[k] * (
+                                          m * zWeights[k, 0] * lambdaN1[i, j, k - 1] + n * zWeights[k, 1] * lambdaN1[i, j, k + 1]))) / (
+                                2. * (o + A * p + B[k] * calcVerticalDiagonal(m, n, q, zWeights, k, DESCENDING_Y)))) + (1 - omega) * lambdaOld
+                    lambdaN1[i, j, k] = lambdaNew
+                    if computeVariation:
+                        sumVariation += abs(lambdaNew - lambdaOld)
+                        sumLambda += abs(lambdaNew)
+                else:
+                    lambdaOld = lambdaN1[i, j, k]
+                    lambdaNew = omega * (
+                        ((-1.) * (dx ** 2 * (-2. * alpha1 ** 2) * (((u0[i + 1, j, k] - u0[i, j, k]) / (dx) + (
+                                v0[i, j + 1, k] - v0[i, j, k]) / (dy) +
+                                                                    (w0[i, j, k + 1] - w0[i, j, k]) / (dz[k])))) + (
+                                  e * lambdaN1[i + 1, j, k] + f * lambdaN1[i - 1, j, k] + A * (
+                                  g * lambdaN1[i, j + 1, k] + h * lambdaN1[i, j - 1, k]) + B[k] * (
+                                          m * zWeights[k, 1] * lambdaN1[i, j, k + 1] + n * zWeights[k, 0] * lambdaN1[i, j, k - 1]))) / (
+                                2. * (o + A * p + B[k] * calcVerticalDiagonal(m, n, q, zWeights, k, DESCENDING_Y)))) + (1 - omega) * lambdaOld
+                    lambdaN1[i, j, k] = lambdaNew
+                    if computeVariation:
+                        sumVariation += abs(lambdaNew - lambdaOld)
+                        sumLambda += abs(lambdaNew)
+    
+    return sumVariation, sumLambda
+
+@jit(nopython=True, nogil=True, parallel=True, cache=True)
+def calcLambdaRedBlack(cellsColor, lambdaN1, omega, alpha1, u0, v0, w0, dx, dy, dz, flags, DESCENDING_Y, A, B, zWeights, computeVariation):
+    # All cells of 'cellsColor' have the same color: their neighbours all have
+    # the other color thus they can be updated in place and in parallel
+    # Convergence sums (see 'calcLambda')
+    sumVariation = 0.
+    sumLambda = 0.
+    for c in prange(cellsColor.shape[0]):
+        i = cellsColor[c, 0]
+        j = cellsColor[c, 1]
+        k = cellsColor[c, 2]
+        e, f, g, h, m, n, o, p, q = decodeFlag(flags[i, j, k])
+        # Go descending order along y
+        if DESCENDING_Y:
+            lambdaOld = lambdaN1[i, j, k]
+            lambdaNew = omega * (
+                ((-1.) * (dx ** 2 * (-2. * alpha1 ** 2) * (((u0[i, j, k] - u0[i + 1, j, k]) / (dx) + (
+                        v0[i, j, k] - v0[i, j + 1, k]) / (dy) +
+                                                            (w0[i, j, k] - w0[i, j, k + 1]) / (dz[k])))) + (
+                          e * lambdaN1[i - 1, j, k] + f * lambdaN1[i + 1, j, k] + A * (
+                          g * lambdaN1[i, j - 1, k] + h * lambdaN1[i, j + 1, k]) + B[k] * (
+                                  m * zWeights[k, 0] * lambdaN1[i, j, k - 1] + n * zWeights[k, 1] * lambdaN1[i, j, k + 1]))) / (
+                        2. * (o + A * p + B[k] * calcVerticalDiagonal(m, n, q, zWeights, k, DESCENDING_Y)))) + (1 - omega) * lambdaOld
+            lambdaN1[i, j, k] = lambdaNew
+            if computeVariation:
+                sumVariation += abs(lambdaNew - lambdaOld)
+                sumLambda += abs(lambdaNew)
+        else:
+            lambdaOld = lambdaN1[i, j, k]
+            lambdaNew = omega * (
+                ((-1.) * (dx ** 2 * (-2. * alpha1 ** 2) * (((u0[i + 1, j, k] - u0[i, j, k]) / (dx) + (
+                        v0[i, j + 1, k] - v0[i, j, k]) / (dy) +
+                                                            (w0[i, j, k + 1] - w0[i, j, k]) / (dz[k])))) + (
+                          e * lambdaN1[i + 1, j, k] + f * lambdaN1[i - 1, j, k] + A * (
+                          g * lambdaN1[i, j + 1, k] + h * lambdaN1[i, j - 1, k]) + B[k] * (
+                                  m * zWeights[k, 1] * lambdaN1[i, j, k + 1] + n * zWeights[k, 0] * lambdaN1[i, j, k - 1]))) / (
+                        2. * (o + A * p + B[k] * calcVerticalDiagonal(m, n, q, zWeights, k, DESCENDING_Y)))) + (1 - omega) * lambdaOld
+            lambdaN1[i, j, k] = lambdaNew
+            if computeVariation:
+                sumVariation += abs(lambdaNew - lambdaOld)
+                sumLambda += abs(lambdaNew)
+
+    return sumVariation, sumLambda
+
+@jit(nopython=True, nogil=True, parallel=True, cache=True)
+def calcLambdaRedBlackDense(color, lambdaN1, omega, alpha1, u0, v0, w0, dx, dy, dz, flags, DESCENDING_Y, A, B, zWeights, computeVariation):
+    # Same as 'calcLambdaRedBlack' but sweeping the cells of the 3D grid having
+    # a given color (0 for an even sum of indices, 1 for an odd one)
+    nx, ny, nz = flags.shape
+    # Convergence sums (see 'calcLambda')
+    sumVariation = 0.
+    sumLambda = 0.
+    for i in prange(1, nx - 1):
+        for j in range(1, ny - 1):
+            for k in range(1 + (i + j + 1 + color) % 2, nz - 1, 2):
+                if not flags[i, j, k] & SOLVED:
+                    continue
+                e, f, g, h, m, n, o, p, q = decodeFlag(flags[i, j, k])
+                # Go descending order along y
+                if DESCENDING_Y:
+                    lambdaOld = lambdaN1[i, j, k]
+                    lambdaNew = omega * (
+                        ((-1.) * (dx ** 2 * (-2. * alpha1 ** 2) * (((u0[i, j, k] - u0[i + 1, j, k]) / (dx) + (
+                                v0[i, j, k] - v0[i, j + 1, k]) / (dy) +
+                                                                    (w0[i, j, k] - w0[i, j, k + 1]) / (dz[k])))) + (
+                                  e * lambdaN1[i - 1, j, k] + f * lambdaN1[i + 1, j, k] + A * (
+                                  g * lambdaN1[i, j - 1, k] + h * lambdaN1[i, j + 1, k]) + B[k] * (
+                                          m * zWeights[k, 0] * lambdaN1[i, j, k - 1] + n * zWeights[k, 1] * lambdaN1[i, j, k + 1]))) / (
+                                2. * (o + A * p + B[k] * calcVerticalDiagonal(m, n, q, zWeights, k, DESCENDING_Y)))) + (1 - omega) * lambdaOld
+                    lambdaN1[i, j, k] = lambdaNew
+                    if computeVariation:
+                        sumVariation += abs(lambdaNew - lambdaOld)
+                        sumLambda += abs(lambdaNew)
+                else:
+                    lambdaOld = lambdaN1[i, j, k]
+                    lambdaNew = omega * (
+                        ((-1.) * (dx ** 2 * (-2. * alpha1 ** 2) * (((u0[i + 1, j, k] - u0[i, j, k]) / (dx) + (
+                                v0[i, j + 1, k] - v0[i, j, k]) / (dy) +
+                                                                    (w0[i, j, k + 1] - w0[i, j, k]) / (dz[k])))) + (
+                                  e * lambdaN1[i + 1, j, k] + f * lambdaN1[i - 1, j, k] + A * (
+                                  g * lambdaN1[i, j + 1, k] + h * lambdaN1[i, j - 1, k]) + B[k] * (
+                                          m * zWeights[k, 1] * lambdaN1[i, j, k + 1] + n * zWeights[k, 0] * lambdaN1[i, j, k - 1]))) / (
+                                2. * (o + A * p + B[k] * calcVerticalDiagonal(m, n, q, zWeights, k, DESCENDING_Y)))) + (1 - omega) * lambdaOld
+                    lambdaN1[i, j, k] = lambdaNew
+                    if computeVariation:
+                        sumVariation += abs(lambdaNew - lambdaOld)
+                        sumLambda += abs(lambdaNew)
+
+    return sumVariation, sumLambda
+
+@jit(nopython=True, nogil=True, parallel=True, cache=True)
+def calcLambdaZLine(color, lambdaN1, omega, alpha1, u0, v0, w0, dx, dy, dz, flags, DESCENDING_Y, A, B, zWeights, computeVariation, cp, dp):
+    # Vertical line relaxation: the lambda equation of all the cells of a
+    # column is solved at once (tridiagonal system, Thomas algorithm), the 
+    # horizontal neighbours being fixed. Columns of a same color (0 for an 
+    # even sum of i and j, 1 for an odd one) are independent thus solved in
+    # parallel ('cp' and 'dp' are (nx, nz) work arrays of the Thomas algorithm)
+    nx, ny, nz = flags.shape
+    # Go descending order along y (neighbours and divergence are mirrored)
+    if DESCENDING_Y:
+        s = -1
+    else:
+        s = 1
+    # Convergence sums (see 'calcLambda')
+    sumVariation = 0.
+    sumLambda = 0.
+    for i in prange(1, nx - 1):
+        for j in range(1 + (i + 1 + color) % 2, ny - 1, 2):
+            # Forward elimination (cells not solved are kept fixed)
+            cp[i, 0] = 0.
+            dp[i, 0] = lambdaN1[i, j, 0]
+            for k in range(1, nz):
+                if k == nz - 1 or not flags[i, j, k] & SOLVED:
+                    cp[i, k] = 0.
+                    dp[i, k] = lambdaN1[i, j, k]
+                    continue
+                e, f, g, h, m, n, o, p, q = decodeFlag(flags[i, j, k])
+                rhs = s * 2. * alpha1 ** 2 * dx ** 2 * ((u0[i + 1, j, k] - u0[i, j, k]) / dx
+                                                        + (v0[i, j + 1, k] - v0[i, j, k]) / dy
+                                                        + (w0[i, j, k + 1] - w0[i, j, k]) / dz[k])\
+                    + e * lambdaN1[i + s, j, k] + f * lambdaN1[i - s, j, k]\
+                    + A * (g * lambdaN1[i, j + s, k] + h * lambdaN1[i, j - s, k])
+                diag = 2. * (o + A * p + B[k] * calcVerticalDiagonal(m, n, q, zWeights, k, DESCENDING_Y))
+                # 'm' weights the cell above (below in descending order)
+                if DESCENDING_Y:
+                    lower = -B[k] * m * zWeights[k, 0]
+                    upper = -B[k] * n * zWeights[k, 1]
+                else:
+                    lower = -B[k] * n * zWeights[k, 0]
+                    upper = -B[k] * m * zWeights[k, 1]
+                denominator = diag - lower * cp[i, k - 1]
+                cp[i, k] = upper / denominator
+                dp[i, k] = (rhs - lower * dp[i, k - 1]) / denominator
+            # Back substitution and over-relaxation of the column solution
+            lambdaLine = dp[i, nz - 1]
+            for k in range(nz - 2, 0, -1):
+                lambdaLine = dp[i, k] - cp[i, k] * lambdaLine
+                if not flags[i, j, k] & SOLVED:
+                    continue
+                lambdaOld = lambdaN1[i, j, k]
+                lambdaNew = omega * lambdaLine + (1 - omega) * lambdaOld
+                lambdaN1[i, j, k] = lambdaNew
+                if computeVariation:
+                    sumVariation += abs(lambdaNew - lambdaOld)
+                    sumLambda += abs(lambdaNew)
+
+    return sumVariation, sumLambda
+
+@jit(nopython=True, nogil=True, parallel=True, cache=True)
+def calcVariation(lambdaN1, lambdaN):
+    # Sums of the lambda variation between 2 iterations and of lambda (in 
+    # double precision) over the 3D grid
+    nx, ny, nz = lambdaN1.shape
+    sumVariation = 0.
+    sumLambda = 0.
+    for i in prange(nx):
+        for j in range(ny):
+            for k in range(nz):
+                sumVariation += abs(lambdaN1[i, j, k] - lambdaN[i, j, k])
+                sumLambda += abs(lambdaN1[i, j, k])
+    
+    return sumVariation, sumLambda
+
+@jit(nopython=True, nogil=True, cache=True)
+def findActiveSeeds(flags, alpha1, u0, v0, w0, dx, dy, dz, DESCENDING_Y, tolerance):
+    # Coordinates of the cells where the initial wind field is divergent (right
+    # hand side of the lambda equation greater than 'tolerance' times its maximum)
+    nx, ny, nz = flags.shape
+    rhs = np.zeros(flags.shape)
+    rhsMax = 0.
+    nbSeeds = 0
+    for i in range(1, nx - 1):
+        for j in range(1, ny - 1):
+            for k in range(1, nz - 1):
+                if not flags[i, j, k] & SOLVED:
+                    continue
+                if DESCENDING_Y:
+                    rhs[i, j, k] = abs((u0[i, j, k] - u0[i + 1, j, k]) / dx
+                                       + (v0[i, j, k] - v0[i, j + 1, k]) / dy
+                                       + (w0[i, j, k] - w0[i, j, k + 1]) / dz[k])
+                else:
+                    rhs[i, j, k] = abs((u0[i + 1, j, k] - u0[i, j, k]) / dx
+                                       + (v0[i, j + 1, k] - v0[i, j, k]) / dy
+                                       + (w0[i, j, k + 1] - w0[i, j, k]) / dz[k])
+                rhsMax = max(rhsMax, rhs[i, j, k])
+    for i in range(1, nx - 1):
+        for j in range(1, ny - 1):
+            for k in range(1, nz - 1):
+                if rhs[i, j, k] > tolerance * rhsMax:
+                    nbSeeds += 1
+    seeds = np.empty((nbSeeds, 3), dtype = np.int32)
+    c = 0
+    for i in range(1, nx - 1):
+        for j in range(1, ny - 1):
+            for k in range(1, nz - 1):
+                if rhs[i, j, k] > tolerance * rhsMax:
+                    seeds[c, 0] = i
+                    seeds[c, 1] = j
+                    seeds[c, 2] = k
+                    c += 1
+    
+    return seeds
+
+# Numba type of the 3D coordinates of a cell
+cellType = types.UniTuple(types.int64, 3)
+
+@jit(nopython=True, nogil=True, cache=True)
+def growActiveSet(cells4Solver, isHot, active, flags, nbLayers):
+    # Breadth-first extension of the active cells: the solved neighbours of
+    # the hot cells become active, then the neighbours of these new cells...
+    # ('nbLayers' times). Return the coordinates of the new active cells
+    front = List.empty_list(cellType)
+    for c in range(cells4Solver.shape[0]):
+        if isHot[c]:
+            front.append((np.int64(cells4Solver[c, 0]), np.int64(cells4Solver[c, 1]),
+                          np.int64(cells4Solver[c, 2])))
+    newCells = List.empty_list(cellType)
+    for layer in range(nbLayers):
+        nextFront = List.empty_list(cellType)
+        for cell in front:
+            i, j, k = cell
+            for neighbour in ((i - 1, j, k), (i + 1, j, k), (i, j - 1, k),
+                              (i, j + 1, k), (i, j, k - 1), (i, j, k + 1)):
+                a, b, c = neighbour
+                if flags[a, b, c] & SOLVED and not active[a, b, c]:
+                    active[a, b, c] = True
+                    nextFront.append(neighbour)
+                    newCells.append(neighbour)
+        front = nextFront
+    result = np.empty((len(newCells), 3), dtype = np.int32)
+    for c in range(len(newCells)):
+        result[c, 0] = newCells[c][0]
+        result[c, 1] = newCells[c][1]
+        result[c, 2] = newCells[c][2]
+    
+    return result
+
+@jit(nopython=True, nogil=True, parallel=True, cache=True)
+def calcRhs(cells4Solver, rhs, alpha1, u0, v0, w0, dx, dy, dz, DESCENDING_Y):
+    # Right hand side of the lambda equation (multiplied by dx ** 2)
+    for c in prange(cells4Solver.shape[0]):
+        i = cells4Solver[c, 0]
+        j = cells4Solver[c, 1]
+        k = cells4Solver[c, 2]
+        if DESCENDING_Y:
+            rhs[i, j, k] = 2. * alpha1 ** 2 * dx ** 2 * ((u0[i, j, k] - u0[i + 1, j, k]) / dx
+                                                        + (v0[i, j, k] - v0[i, j + 1, k]) / dy
+                                                        + (w0[i, j, k] - w0[i, j, k + 1]) / dz[k])
+        else:
+            rhs[i, j, k] = 2. * alpha1 ** 2 * dx ** 2 * ((u0[i + 1, j, k] - u0[i, j, k]) / dx
+                                                        + (v0[i, j + 1, k] - v0[i, j, k]) / dy
+                                                        + (w0[i, j, k + 1] - w0[i, j, k]) / dz[k])
+
+@jit(nopython=True, nogil=True, parallel=True, cache=True)
+def calcRhsNorm(flags, alpha1, u0, v0, w0, dx, dy, dz, DESCENDING_Y):
+    # Euclidean norm of the right hand side of the lambda equation (without
+    # storing the right hand side)
+    nx, ny, nz = flags.shape
+    sumSquares = 0.
+    for i in prange(1, nx - 1):
+        for j in range(1, ny - 1):
+            for k in range(1, nz - 1):
+                if not flags[i, j, k] & SOLVED:
+                    continue
+                if DESCENDING_Y:
+                    rhs = 2. * alpha1 ** 2 * dx ** 2 * ((u0[i, j, k] - u0[i + 1, j, k]) / dx
+                                                       + (v0[i, j, k] - v0[i, j + 1, k]) / dy
+                                                       + (w0[i, j, k] - w0[i, j, k + 1]) / dz[k])
+                else:
+                    rhs = 2. * alpha1 ** 2 * dx ** 2 * ((u0[i + 1, j, k] - u0[i, j, k]) / dx
+                                                       + (v0[i, j + 1, k] - v0[i, j, k]) / dy
+                                                       + (w0[i, j, k + 1] - w0[i, j, k]) / dz[k])
+                sumSquares += rhs ** 2
+    
+    return np.sqrt(sumSquares)
+
+@jit(nopython=True, nogil=True, cache=True)
+def calcStencil(lam, flags, corrI, corrJ, corrK, i, j, k, DESCENDING_Y, A, B):
+    # Weighted sum of the neighbour lambda values and diagonal coefficient of
+    # the lambda equation of a cell (the diagonal of the cells close to the
+    # boundaries being corrected on coarse multigrid levels)
+    e, f, g, h, m, n, o, p, q = decodeFlag(flags[i, j, k])
+    if DESCENDING_Y:
+        neighbours = e * lam[i - 1, j, k] + f * lam[i + 1, j, k]\
+            + A * (g * lam[i, j - 1, k] + h * lam[i, j + 1, k])\
+            + B * (m * lam[i, j, k - 1] + n * lam[i, j, k + 1])
+        diagonal = 2. * (o + corrI[i] * (e if i == 1 else f)
+                         + A * (p + corrJ[j] * (g if j == 1 else h))
+                         + B * (q + corrK[k] * (m if k == 1 else n)))
+    else:
+        neighbours = e * lam[i + 1, j, k] + f * lam[i - 1, j, k]\
+            + A * (g * lam[i, j + 1, k] + h * lam[i, j - 1, k])\
+            + B * (m * lam[i, j, k + 1] + n * lam[i, j, k - 1])
+        diagonal = 2. * (o + corrI[i] * (f if i == 1 else e)
+                         + A * (p + corrJ[j] * (h if j == 1 else g))
+                         + B * (q + corrK[k] * (n if k == 1 else m)))
+    
+    return neighbours, diagonal
+
+@jit(nopython=True, nogil=True, parallel=True, cache=True)
+def relaxRedBlack(cellsColor, lam, rhs, omega, flags, corrI, corrJ, corrK, DESCENDING_Y, A, B):
+    # Same as 'calcLambdaRedBlack' but for a given right hand side
+    for c in prange(cellsColor.shape[0]):
+        i = cellsColor[c, 0]
+        j = cellsColor[c, 1]
+        k = cellsColor[c, 2]
+        neighbours, diagonal = calcStencil(lam, flags, corrI, corrJ, corrK, i, j, k,
+                                           DESCENDING_Y, A, B)
+        lam[i, j, k] = omega * (rhs[i, j, k] + neighbours) / diagonal\
+            + (1 - omega) * lam[i, j, k]
+
+@jit(nopython=True, nogil=True, parallel=True, cache=True)
+def calcResidual(cells, lam, rhs, residual, flags, corrI, corrJ, corrK, DESCENDING_Y, A, B):
+    # Residual of the lambda equation
+    for c in prange(cells.shape[0]):
+        i = cells[c, 0]
+        j = cells[c, 1]
+        k = cells[c, 2]
+        neighbours, diagonal = calcStencil(lam, flags, corrI, corrJ, corrK, i, j, k,
+                                           DESCENDING_Y, A, B)
+        residual[i, j, k] = rhs[i, j, k] + neighbours - diagonal * lam[i, j, k]
+
+@jit(nopython=True, nogil=True, cache=True)
+def restrictResidual(cells, residual, coarseRhs, coarseCount, ci, cj, ck):
+    # Sum the fine residuals (and count the fine cells) within each coarse cell
+    for c in range(cells.shape[0]):
+        i = cells[c, 0]
+        j = cells[c, 1]
+        k = cells[c, 2]
+        coarseRhs[ci[i], cj[j], ck[k]] += residual[i, j, k]
+        coarseCount[ci[i], cj[j], ck[k]] += 1
+
+@jit(nopython=True, nogil=True, parallel=True, cache=True)
+def prolongCorrection(cells, lam, coarseLam, coarseFluid, ci, cj, ck, ni, nj, nk, wi, wj, wk):
+    # Add the coarse correction to each fine cell using a trilinear
+    # interpolation of the fluid coarse cells surrounding the fine cell
+    for c in prange(cells.shape[0]):
+        i = cells[c, 0]
+        j = cells[c, 1]
+        k = cells[c, 2]
+        correction = 0.
+        sumWeights = 0.
+        for a in range(2):
+            I = ci[i] if a == 0 else ni[i]
+            wa = wi[i] if a == 0 else 1 - wi[i]
+            for b in range(2):
+                J = cj[j] if b == 0 else nj[j]
+                wb = wj[j] if b == 0 else 1 - wj[j]
+                for d in range(2):
+                    K = ck[k] if d == 0 else nk[k]
+                    wd = wk[k] if d == 0 else 1 - wk[k]
+                    if coarseFluid[I, J, K] == 1:
+                        correction += wa * wb * wd * coarseLam[I, J, K]
+                        sumWeights += wa * wb * wd
+        if sumWeights > 0:
+            lam[i, j, k] += correction / sumWeights
+
+@jit(nopython=True, nogil=True, cache=True)
+def applySsor(indptr, indices, data, diagonal, residual, omega):
+    # Apply the inverse of the SSOR preconditioner of a CSR matrix: forward
+    # sweep (D/omega + L).y = r, scaling by (2 - omega) / omega * D / omega
+    # and backward sweep (D/omega + U).z = y
+    nbRows = residual.size
+    y = np.zeros(nbRows)
+    for r in range(nbRows):
+        s = residual[r]
+        for c in range(indptr[r], indptr[r + 1]):
+            if indices[c] < r:
+                s -= data[c] * y[indices[c]]
+        y[r] = omega * s / diagonal[r]
+    for r in range(nbRows):
+        y[r] *= (2. - omega) * diagonal[r] / omega
+    z = np.zeros(nbRows)
+    for r in range(nbRows - 1, -1, -1):
+        s = y[r]
+        for c in range(indptr[r], indptr[r + 1]):
+            if indices[c] > r:
+                s -= data[c] * z[indices[c]]
+        z[r] = omega * s / diagonal[r]
+    
+    return z
+
+@jit(nopython=True, nogil=True, cache=True)
+def factorizeIncompleteCholesky(indptr, indices, data):
+    # Incomplete Cholesky factorization L.L^T of a symmetric matrix keeping
+    # the sparsity pattern of its lower part (CSR with sorted indices, the
+    # diagonal being the last element of each row)
+    lowerData = np.copy(data)
+    for r in range(indptr.size - 1):
+        for c in range(indptr[r], indptr[r + 1]):
+            col = indices[c]
+            # Sparse dot product of the rows 'r' and 'col' for columns < col
+            s = lowerData[c]
+            a = indptr[r]
+            b = indptr[col]
+            while (a < c) and (b < indptr[col + 1] - 1):
+                if indices[a] == indices[b]:
+                    s -= lowerData[a] * lowerData[b]
+                    a += 1
+                    b += 1
+                elif indices[a] < indices[b]:
+                    a += 1
+                else:
+                    b += 1
+            if col < r:
+                lowerData[c] = s / lowerData[indptr[col + 1] - 1]
+            elif s > 0:
+                lowerData[c] = np.sqrt(s)
+            else:
+                # Breakdown: keep the diagonal of the matrix
+                lowerData[c] = np.sqrt(data[c])
+    
+    return lowerData
+
+@jit(nopython=True, nogil=True, cache=True)
+def applyIncompleteCholesky(indptr, indices, lowerData, residual):
+    # Solve L.y = r (forward substitution) then L^T.z = y (backward 
+    # substitution using the rows of L as columns of L^T)
+    nbRows = residual.size
+    z = np.copy(residual)
+    for r in range(nbRows):
+        s = z[r]
+        for c in range(indptr[r], indptr[r + 1] - 1):
+            s -= lowerData[c] * z[indices[c]]
+        z[r] = s / lowerData[indptr[r + 1] - 1]
+    for r in range(nbRows - 1, -1, -1):
+        z[r] /= lowerData[indptr[r + 1] - 1]
+        for c in range(indptr[r], indptr[r + 1] - 1):
+            z[indices[c]] -= lowerData[c] * z[r]
+    
+    return z
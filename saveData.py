@@ -7,7 +7,8 @@ Created on Mon Oct  4 13:59:31 2021
 """
 import pandas as pd
 import numpy as np
-from .DataUtil import radToDeg, windDirectionFromXY, createIndex, prefix
+from .DataUtil import radToDeg, windDirectionFromXY, createIndex, prefix,\
+    writeTableColumns, fetchColumns
 from .Obstacles import windRotation
 from osgeo.gdal import Grid, GridOptions
 from .GlobalVariables import HORIZ_WIND_DIRECTION, HORIZ_WIND_SPEED, WIND_SPEED,\
@@ -15,42 +16,35 @@ from .GlobalVariables import HORIZ_WIND_DIRECTION, HORIZ_WIND_SPEED, WIND_SPEED,
     OUTPUT_DIRECTORY, MESH_SIZE, OUTPUT_FILENAME, DELETE_OUTPUT_IF_EXISTS,\
     OUTPUT_RASTER_EXTENSION, OUTPUT_VECTOR_EXTENSION, OUTPUT_NETCDF_EXTENSION,\
     WIND_GROUP, WINDSPEED_PROFILE, RLON, RLAT, LON, LAT, LEVELS, WINDSPEED_X,\
-    WINDSPEED_Y, WINDSPEED_Z, VERT_WIND, Z, OUTPUT_FILENAME, PREFIX_NAME
+    WINDSPEED_Y, WINDSPEED_Z, VERT_WIND, Z, OUTPUT_FILENAME, PREFIX_NAME,\
+    OUT_OF_CORE_SLAB_SIZE
 from datetime import datetime
 import netCDF4 as nc4
 import os
+from collections import OrderedDict
 
 def saveBasicOutputs(cursor, z_out, dz, u, v, w, gridName,
                      verticalWindProfile, outputFilePath, meshSize,
                      outputFilename = OUTPUT_FILENAME,
                      outputRaster = None, saveRaster = True,
                      saveVector = True, saveNetcdf = True,
-                     prefix_name = PREFIX_NAME):
+                     prefix_name = PREFIX_NAME, levelHeights = None,
+                     longitudeLatitude = None):
 
     # -------------------------------------------------------------------
     # SAVE NETCDF -------------------------------------------------------
     # ------------------------------------------------------------------- 
     final_netcdf_path = None
     if saveNetcdf:    
-        # Get the srid of the input geometry
-        cursor.execute(""" SELECT ST_SRID({0}) AS srid FROM {1} LIMIT 1
-                       """.format( GEOM_FIELD,
-                                   gridName))
-        srid = cursor.fetchall()[0][0]
-        # Get the coordinate in lat/lon of each point 
-        # WARNING : for now keep the data in local coordinates)
-        cursor.execute(""" 
-           SELECT ST_X({0}) AS LON, ST_Y({0}) AS LAT FROM 
-           (SELECT ST_TRANSFORM(ST_SETSRID({0},{2}), 4326) AS {0} FROM {1})
-           """.format( GEOM_FIELD,
-                       gridName,
-                       srid))
-        coord = np.array(cursor.fetchall())
-        # Convert to a 2D (X, Y) array
+        # Get the coordinate in lat/lon of each point (if not already calculated)
         nx = u.shape[0]
         ny = u.shape[1]
-        longitude = np.array([[coord[i * nx + j, 0] for i in range(ny)] for j in range(nx)])
-        latitude = np.array([[coord[i * nx + j, 1] for i in range(ny)] for j in range(nx)])
+        if longitudeLatitude is None:
+            longitudeLatitude = getLongitudeLatitude(cursor = cursor,
+                                                     gridName = gridName,
+                                                     nx = nx,
+                                                     ny = ny)
+        longitude, latitude = longitudeLatitude
         
     
         # Save the data into a NetCDF file
@@ -78,7 +72,19 @@ def saveBasicOutputs(cursor, z_out, dz, u, v, w, gridName,
         # Keep only wind field for a single horizontal plan (and convert carthesian
         # wind speed into polar at least for horizontal)
         tempoTable = "TEMPO_HORIZ"
-        if z_i % dz % (dz / 2) == 0:
+        if levelHeights is not None:
+            # Vertically stretched grid: linear interpolation between the
+            # two levels surrounding z_i (the level height levelHeights[k]
+            # corresponds to the index k+1 of the grid, 0 being the ground)
+            n_lev = min(max(int(np.searchsorted(levelHeights, z_i)), 1),
+                        levelHeights.size - 1)
+            weight1 = (z_i - levelHeights[n_lev - 1]) \
+                / (levelHeights[n_lev] - levelHeights[n_lev - 1])
+            weight = 1 - weight1
+            ufin = (weight * u[:,:,n_lev] + weight1 * u[:,:,n_lev + 1])
+            vfin = (weight * v[:,:,n_lev] + weight1 * v[:,:,n_lev + 1])
+            wfin = (weight * w[:,:,n_lev] + weight1 * w[:,:,n_lev + 1])
+        elif z_i % dz % (dz / 2) == 0:
             n_lev = int(z_i / dz) + 1
             ufin = u[:,:,n_lev]
             vfin = v[:,:,n_lev]
@@ -91,24 +97,26 @@ def saveBasicOutputs(cursor, z_out, dz, u, v, w, gridName,
             ufin = (weight * u[:,:,n_lev] + weight1 * u[:,:,n_lev1])
             vfin = (weight * v[:,:,n_lev] + weight1 * v[:,:,n_lev1])
             wfin = (weight * w[:,:,n_lev] + weight1 * w[:,:,n_lev1])
-        df = pd.DataFrame({HORIZ_WIND_SPEED: ((ufin ** 2 + vfin ** 2) ** 0.5).flatten("F"),
-                           WIND_SPEED: ((ufin ** 2 + vfin ** 2 + wfin ** 2) ** 0.5).flatten("F"), 
-                           HORIZ_WIND_DIRECTION: radToDeg(windDirectionFromXY(ufin, vfin)).flatten("F"), 
-                           VERT_WIND_SPEED: wfin.flatten("F")}).rename_axis(ID_POINT)
+        horizWind = OrderedDict([(ID_POINT, np.arange(ufin.size, dtype = np.int32)),
+                                 (HORIZ_WIND_SPEED, ((ufin ** 2 + vfin ** 2) ** 0.5).flatten("F")),
+                                 (HORIZ_WIND_DIRECTION, radToDeg(windDirectionFromXY(ufin, vfin)).flatten("F")),
+                                 (VERT_WIND_SPEED, wfin.flatten("F")),
+                                 (WIND_SPEED, ((ufin ** 2 + vfin ** 2 + wfin ** 2) ** 0.5).flatten("F"))])
         
         # Save horizontal wind speed, wind direction and
         # vertical wind speed in a vector file
-        df.to_csv(os.path.join(TEMPO_DIRECTORY, TEMPO_HORIZ_WIND_FILE))
+        writeTableColumns(cursor = cursor,
+                          tableName = tempoTable,
+                          columns = horizWind,
+                          filePathBase = os.path.join(TEMPO_DIRECTORY,
+                                                      TEMPO_HORIZ_WIND_FILE))
         cursor.execute(
             """
-            DROP TABLE IF EXISTS {9};
-            CREATE TABLE {9}({3} INTEGER, {5} DOUBLE, {6} DOUBLE, {7} DOUBLE, {11} DOUBLE)
-                AS SELECT {3}, {5}, {6}, {7}, {11} FROM CSVREAD('{10}');
             {0}{1}
             DROP TABLE IF EXISTS {2};
             CREATE TABLE {2}
                 AS SELECT   a.{3}, {4}, b.{5}, 
-                            b.{6}, b.{7}, b.{11}
+                            b.{6}, b.{7}, b.{10}
                 FROM {8} AS a
                 LEFT JOIN {9} AS b
                 ON a.{3} = b.{3}
@@ -122,7 +130,6 @@ def saveBasicOutputs(cursor, z_out, dz, u, v, w, gridName,
                         GEOM_FIELD                  , HORIZ_WIND_SPEED,
                         HORIZ_WIND_DIRECTION        , VERT_WIND_SPEED,
                         gridName                    , tempoTable,
-                        TEMPO_DIRECTORY + os.sep + TEMPO_HORIZ_WIND_FILE,
                         WIND_SPEED))
         
         # -------------------------------------------------------------------
@@ -245,9 +252,13 @@ def saveToNetCDF(longitude,
     z[:] = verticalWindProfile[Z].values
     lon[:,:] = longitude
     lat[:,:] = latitude
-    windSpeed_x[:,:,:] = u
-    windSpeed_y[:,:,:] = v
-    windSpeed_z[:,:,:] = w
+    # (by slabs along X to avoid a copy of the whole fields when they are 
+    # memory-mapped)
+    for iStart in range(0, u.shape[0], OUT_OF_CORE_SLAB_SIZE):
+        slab = slice(iStart, iStart + OUT_OF_CORE_SLAB_SIZE)
+        windSpeed_x[slab,:,:] = u[slab]
+        windSpeed_y[slab,:,:] = v[slab]
+        windSpeed_z[slab,:,:] = w[slab]
     
     # VERTICAL WIND PROFILE DATA
     # Creates a group within this file for the vertical wind profile
@@ -284,6 +295,52 @@ def saveToNetCDF(longitude,
     
     return path + OUTPUT_NETCDF_EXTENSION
     
+def getLongitudeLatitude(cursor, gridName, nx, ny, connection = None):
+    """ Get the longitude and the latitude of each point of the grid.
+    
+    Parameters
+	_ _ _ _ _ _ _ _ _ _ 
+        cursor: conn.cursor
+            A cursor object, used to perform spatial SQL queries
+        gridName: String
+            Name of the grid point table
+        nx: int
+            Number of grid points along X-axis
+        ny: int
+            Number of grid points along Y-axis
+        connection: jaydebeapi.Connection, default None
+            Connection of the cursor, used to fetch the coordinates as arrays
+            (row-wise fetch if None)
+
+    
+    Returns
+	_ _ _ _ _ _ _ _ _ _ 	
+        longitude: 2D array
+            Longitude of each (X, Y) grid point
+        latitude: 2D array
+            Latitude of each (X, Y) grid point"""
+    # Get the srid of the input geometry
+    cursor.execute(""" SELECT ST_SRID({0}) AS srid FROM {1} LIMIT 1
+                   """.format( GEOM_FIELD,
+                               gridName))
+    srid = cursor.fetchall()[0][0]
+    # Get the coordinate in lat/lon of each point 
+    # WARNING : for now keep the data in local coordinates)
+    # (fetched as arrays, without Python object per point)
+    coord = fetchColumns(cursor = cursor,
+                         connection = connection,
+                         query = """ 
+                            SELECT ST_X({0}) AS LON, ST_Y({0}) AS LAT FROM 
+                            (SELECT ST_TRANSFORM(ST_SETSRID({0},{2}), 4326) AS {0} FROM {1})
+                            """.format( GEOM_FIELD,
+                                        gridName,
+                                        srid))
+    # Convert to a 2D (X, Y) array (points are ordered by X first)
+    longitude = coord["LON"][:nx * ny].reshape(ny, nx).transpose()
+    latitude = coord["LAT"][:nx * ny].reshape(ny, nx).transpose()
+    
+    return longitude, latitude
+
 def saveTable(cursor, tableName, filedir, delete = False, 
               rotationCenterCoordinates = None, rotateAngle = None):
     """ Save a table in .geojson or .shp (the table can be rotated before saving if needed).
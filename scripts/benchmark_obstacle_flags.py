@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compare the time spent to set the obstacle flags of the wind solver using the
+former pandas MultiIndex implementation and the boolean mask implementation
+(WindSolver.setObstacleFlags). The building coordinates are those of a URock
+initialization on the BigArea case (H2GIS and Java are needed).
+
+Usage:
+    python scripts/benchmark_obstacle_flags.py [--srid 3857] [--meshSize 2] [--dz 2]
+"""
+import os
+import sys
+import time
+import argparse
+import importlib
+import tempfile
+import numpy as np
+import pandas as pd
+
+# The plugin directory is imported as a package
+pluginDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(pluginDirectory))
+pluginName = os.path.basename(pluginDirectory)
+MainCalculation = importlib.import_module(pluginName + ".MainCalculation")
+WindSolver = importlib.import_module(pluginName + ".WindSolver")
+H2gisConnection = importlib.import_module(pluginName + ".H2gisConnection")
+
+def setObstacleFlagsFromIndex(nx, ny, nz, buildingCoordinates):
+    """ Former implementation of WindSolver.setObstacleFlags identifying the
+    cells close to walls using pandas MultiIndex intersections and unions.
+
+    		Parameters
+    		_ _ _ _ _ _ _ _ _ _
+
+            nx: int
+                Number of cells along X-axis
+            ny: int
+                Number of cells along Y-axis
+            nz: int
+                Number of cells along Z-axis
+            buildingCoordinates: 3D array
+                Building 3D coordinates
+
+    		Returns
+    		_ _ _ _ _ _ _ _ _ _
+
+            flags: 3D array
+                Obstacle flags (uint8) of the lambda equation for each cell"""
+    flags = np.zeros([nx, ny, nz], dtype = np.uint8)
+
+    # Identify index having wall below AND front, left, right or behind
+    indBelow = pd.MultiIndex.from_tuples(list(zip(*[buildingCoordinates[0],
+                                                    buildingCoordinates[1],
+                                                    buildingCoordinates[2] + 1])))
+    indBelowFront = indBelow.intersection(pd.MultiIndex.from_tuples(list(zip(*[buildingCoordinates[0],
+                                                                               buildingCoordinates[1] - 1,
+                                                                               buildingCoordinates[2]]))))
+    indBelowBehind = indBelow.intersection(pd.MultiIndex.from_tuples(list(zip(*[buildingCoordinates[0],
+                                                                               buildingCoordinates[1] + 1,
+                                                                               buildingCoordinates[2]]))))
+    indBelowLeft = indBelow.intersection(pd.MultiIndex.from_tuples(list(zip(*[buildingCoordinates[0] + 1,
+                                                                               buildingCoordinates[1],
+                                                                               buildingCoordinates[2]]))))
+    indBelowRight = indBelow.intersection(pd.MultiIndex.from_tuples(list(zip(*[buildingCoordinates[0] - 1,
+                                                                               buildingCoordinates[1],
+                                                                               buildingCoordinates[2]]))))
+    indBelowAnyAround = indBelowFront.union(indBelowBehind).union(indBelowLeft).union(indBelowRight)
+
+    def levels(ind):
+        return ind.get_level_values(0), ind.get_level_values(1), ind.get_level_values(2)
+
+    # Go descending order along y
+    if WindSolver.DESCENDING_Y:
+        flags[buildingCoordinates[0] + 1, buildingCoordinates[1], buildingCoordinates[2]] |= WindSolver.WALL_E
+        flags[levels(indBelowLeft)] |= WindSolver.WALL_E
+        flags[buildingCoordinates[0] - 1, buildingCoordinates[1], buildingCoordinates[2]] |= WindSolver.WALL_F
+        flags[levels(indBelowRight)] |= WindSolver.WALL_F
+        flags[buildingCoordinates[0], buildingCoordinates[1] + 1, buildingCoordinates[2]] |= WindSolver.WALL_G
+        flags[levels(indBelowBehind)] |= WindSolver.WALL_G
+        flags[buildingCoordinates[0], buildingCoordinates[1] - 1, buildingCoordinates[2]] |= WindSolver.WALL_H
+        flags[levels(indBelowFront)] |= WindSolver.WALL_H
+        flags[buildingCoordinates[0], buildingCoordinates[1], buildingCoordinates[2] + 1] |= WindSolver.WALL_M
+        flags[buildingCoordinates[0], buildingCoordinates[1], buildingCoordinates[2] - 1] |= WindSolver.WALL_N
+    else:
+        flags[buildingCoordinates[0] - 1, buildingCoordinates[1], buildingCoordinates[2]] |= WindSolver.WALL_E
+        flags[levels(indBelowRight)] |= WindSolver.WALL_E
+        flags[buildingCoordinates[0] + 1, buildingCoordinates[1], buildingCoordinates[2]] |= WindSolver.WALL_F
+        flags[levels(indBelowLeft)] |= WindSolver.WALL_F
+        flags[buildingCoordinates[0], buildingCoordinates[1] - 1, buildingCoordinates[2]] |= WindSolver.WALL_G
+        flags[levels(indBelowFront)] |= WindSolver.WALL_G
+        flags[buildingCoordinates[0], buildingCoordinates[1] + 1, buildingCoordinates[2]] |= WindSolver.WALL_H
+        flags[levels(indBelowBehind)] |= WindSolver.WALL_H
+        flags[buildingCoordinates[0], buildingCoordinates[1], buildingCoordinates[2] - 1] |= WindSolver.WALL_M
+        flags[buildingCoordinates[0], buildingCoordinates[1], buildingCoordinates[2] + 1] |= WindSolver.WALL_N
+
+    flags[levels(indBelowAnyAround)] |= WindSolver.WALL_N
+
+    return flags
+
+def timeFunction(function, nbRepeat, **kwargs):
+    """ Return the result and the minimum time spent by a function call"""
+    times = []
+    for r in range(nbRepeat):
+        timeStart = time.time()
+        result = function(**kwargs)
+        times.append(time.time() - timeStart)
+
+    return result, min(times)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__.split("Usage")[0])
+    parser.add_argument("--srid", type = int, default = 3857)
+    parser.add_argument("--meshSize", type = float, default = 2)
+    parser.add_argument("--dz", type = float, default = 2)
+    parser.add_argument("--windDirection", type = float, default = 270)
+    parser.add_argument("--repeat", type = int, default = 3)
+    args = parser.parse_args()
+
+    inputDirectory = os.path.join(pluginDirectory, "Resources", "Inputs", "BigArea")
+    outputDirectory = tempfile.mkdtemp()
+    javaEnvironmentPath = H2gisConnection.getJavaDir(pluginDirectory)
+    H2gisConnection.setJavaDir(javaEnvironmentPath)
+
+    # Only the initialization is needed to get the building coordinates
+    outputs = MainCalculation.main(javaEnvironmentPath = javaEnvironmentPath,
+                                   pluginDirectory = pluginDirectory,
+                                   outputFilePath = outputDirectory,
+                                   buildingFilePath = os.path.join(inputDirectory, "buildings.shp"),
+                                   vegetationFilePath = os.path.join(inputDirectory, "vegetation.shp"),
+                                   srid = args.srid,
+                                   windDirection = args.windDirection,
+                                   meshSize = args.meshSize,
+                                   dz = args.dz,
+                                   onlyInitialization = True,
+                                   saveRaster = False,
+                                   saveVector = False,
+                                   saveNetcdf = False)
+    w0 = outputs[5]
+    buildingCoordinates = outputs[9]
+    nx, ny, nz = w0.shape
+    print("Grid shape: {0} - Nb building cells: {1}".format(w0.shape, buildingCoordinates.shape[1]))
+
+    flagsIndex, timeIndex = timeFunction(setObstacleFlagsFromIndex, args.repeat,
+                                         nx = nx, ny = ny, nz = nz,
+                                         buildingCoordinates = buildingCoordinates)
+    flagsMask, timeMask = timeFunction(WindSolver.setObstacleFlags, args.repeat,
+                                       nx = nx, ny = ny, nz = nz,
+                                       buildingCoordinates = buildingCoordinates)
+
+    # Flags may only differ on the sketch boundaries (never solved)
+    isEqual = np.array_equal(flagsIndex[1:-1, 1:-1, 1:-1], flagsMask[1:-1, 1:-1, 1:-1])
+    print("pandas MultiIndex: {0:.3f} s".format(timeIndex))
+    print("Boolean masks: {0:.3f} s".format(timeMask))
+    print("Speed-up: {0:.1f} - Identical flags: {1}".format(timeIndex / timeMask, isEqual))
@@ -0,0 +1,308 @@
+# coding=utf-8
+"""Tests of the exchange of query results between H2GIS and Python."""
+
+import re
+import struct
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from .. import DataUtil
+
+
+class FakeCursor(object):
+    """ Cursor returning fixed rows, described as by jaydebeapi (name, type,
+    display size, internal size, precision, scale, nullable)."""
+    description = [("ID", None, 11, 11, 10, 0, 0),
+                   ("ID_NULL", None, 11, 11, 10, 0, 1),
+                   ("LON", None, 17, 17, 17, 0, 2)]
+    rows = [(1, 4, 2.5), (2, None, None), (3, 6, 1.)]
+
+    def execute(self, query):
+        self.query = query
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeStatement(object):
+    def __init__(self, error):
+        self.error = error
+        self.closed = False
+
+    def executeQuery(self, query):
+        raise self.error
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection(object):
+    """ jaydebeapi connection whose JDBC statement raises 'error'."""
+    def __init__(self, error):
+        self.statement = FakeStatement(error)
+        self.jconn = self
+
+    def createStatement(self):
+        return self.statement
+
+
+class FakeBulkResultSet(object):
+    """ JDBC result set of the bulk fetch function (NAME, TYPE, DATA)."""
+    def __init__(self, rows):
+        self.rows = rows
+        self.index = -1
+
+    def next(self):
+        self.index += 1
+        return self.index < len(self.rows)
+
+    def getString(self, i):
+        return self.rows[self.index][i - 1]
+
+    def getBytes(self, i):
+        return self.rows[self.index][i - 1]
+
+
+class FakeBulkStatement(object):
+    """ JDBC statement calling the bulk fetch function on the rows of a
+    FakeCursor, packed as in its Java source."""
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.closed = False
+
+    def executeQuery(self, query):
+        match = re.match(r"SELECT \* FROM (\w+)\('(.*)'\)$", query, re.S)
+        assert match.group(1) == DataUtil.BULK_FETCH_FUNCTION
+        self.query = match.group(2).replace("''", "'")
+        rows = []
+        for i, d in enumerate(self.cursor.description):
+            isInteger = d[4] <= 10 and d[6] == 0
+            values = [row[i] for row in self.cursor.rows]
+            if isInteger:
+                data = struct.pack("<{0}i".format(len(values)), *values)
+            else:
+                data = struct.pack("<{0}d".format(len(values)),
+                                   *[np.nan if v is None else v for v in values])
+            rows.append((d[0], "<i4" if isInteger else "<f8", data))
+        return FakeBulkResultSet(rows)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeBulkConnection(object):
+    """ jaydebeapi connection whose JDBC connection has the bulk fetch function."""
+    def __init__(self, cursor):
+        self.statement = FakeBulkStatement(cursor)
+        self.jconn = self
+
+    def createStatement(self):
+        return self.statement
+
+
+def checkRowWiseColumns(columns):
+    assert list(columns) == ["ID", "ID_NULL", "LON"]
+    assert columns["ID"].dtype == np.int32
+    np.testing.assert_array_equal(columns["ID"], [1, 2, 3])
+    assert columns["ID_NULL"].dtype == np.float64
+    np.testing.assert_array_equal(columns["ID_NULL"], [4, np.nan, 6])
+    np.testing.assert_array_equal(columns["LON"], [2.5, np.nan, 1.])
+
+
+def test_fetch_columns_row_wise():
+    checkRowWiseColumns(DataUtil.fetchColumns(cursor = FakeCursor(), query = "SELECT"))
+
+
+def test_fetch_columns_bulk(monkeypatch):
+    monkeypatch.setattr(DataUtil, "BINARY_EXCHANGE", True)
+    query = "SELECT * FROM T WHERE NAME = 'A'"
+    connection = FakeBulkConnection(FakeCursor())
+    columns = DataUtil.fetchColumns(cursor = None, query = query,
+                                    connection = connection)
+    assert connection.statement.query == query
+    assert connection.statement.closed
+    rowWiseColumns = DataUtil.fetchColumns(cursor = FakeCursor(), query = query)
+    assert list(columns) == list(rowWiseColumns)
+    for c in columns:
+        assert columns[c].dtype == rowWiseColumns[c].dtype
+        np.testing.assert_array_equal(columns[c], rowWiseColumns[c])
+    checkRowWiseColumns(columns)
+
+
+def test_fetch_columns_missing_function(monkeypatch):
+    monkeypatch.setattr(DataUtil, "BINARY_EXCHANGE", True)
+    connection = FakeConnection(Exception("Function \"{0}\" not found; SQL statement: [90022-200]"\
+                                          .format(DataUtil.BULK_FETCH_FUNCTION)))
+    columns = DataUtil.fetchColumns(cursor = FakeCursor(), query = "SELECT",
+                                    connection = connection)
+    checkRowWiseColumns(columns)
+    assert connection.statement.closed
+
+
+def test_fetch_columns_other_error(monkeypatch):
+    monkeypatch.setattr(DataUtil, "BINARY_EXCHANGE", True)
+    connection = FakeConnection(Exception("Column \"LON\" not found; SQL statement: [42122-200]"))
+    with pytest.raises(Exception, match = "42122"):
+        DataUtil.fetchColumns(cursor = FakeCursor(), query = "SELECT",
+                              connection = connection)
+
+
+class FakeH2Cursor(object):
+    """ Cursor emulating the H2 statements used to exchange tables through
+    files: the binary exchange functions (written as in their Java sources)
+    raise the H2 'function not found' error (90022) if 'missingFunctions'."""
+    def __init__(self, missingFunctions = False):
+        self.missingFunctions = missingFunctions
+        self.tables = {}
+        self.description = None
+        self.result = None
+
+    def checkFunction(self, functionName):
+        if self.missingFunctions:
+            raise Exception("Function \"{0}\" not found; SQL statement: [90022-200]"\
+                            .format(functionName))
+
+    def select(self, query):
+        """ Columns (name, SQL type, not null, values) of 'SELECT * FROM table'."""
+        tableName = re.match(r"\s*SELECT \* FROM (\w+)\s*$", query).group(1)
+        if tableName not in self.tables:
+            raise Exception("Table \"{0}\" not found; SQL statement: [42102-200]"\
+                            .format(tableName))
+        return self.tables[tableName]
+
+    def execute(self, query):
+        for statement in [s.strip() for s in query.split(";") if s.strip()]:
+            self.executeStatement(statement)
+
+    def executeStatement(self, statement):
+        match = re.match(r"DROP TABLE IF EXISTS (\w+)$", statement)
+        if match:
+            self.tables.pop(match.group(1), None)
+            return
+        match = re.match(r"CREATE TABLE (\w+)\(([^)]*)\)(?:\s+AS SELECT (.*) FROM CSVREAD\('(.*)'\))?$",
+                         statement, re.S)
+        if match:
+            tableName, definition, names, filePath = match.groups()
+            columns = [c.split(" ", 1) for c in definition.split(", ")]
+            self.tables[tableName] = [(c, t.split(" ")[0], t.endswith("NOT NULL"), [])
+                                          for c, t in columns]
+            if filePath:
+                df = pd.read_csv(filePath, dtype = str, keep_default_na = False)
+                for c, t, notNull, values in self.tables[tableName]:
+                    for v in df[c]:
+                        values.append(None if v == "" else
+                                      int(v) if t == "INTEGER" else float(v))
+            return
+        match = re.match(r"CALL (\w+)\('(.*)', '(.*)', '(.*)'\)$", statement)
+        if match and match.group(1) == DataUtil.BINARY_READ_FUNCTION:
+            self.checkFunction(match.group(1))
+            tableName, basePath, description = match.groups()[1:]
+            for i, column in enumerate(description.split(",")):
+                dtype = column.rsplit(":", 1)[1]
+                values = np.fromfile("{0}_{1}.bin".format(basePath, i), dtype = dtype)
+                isNull = values.view("<i8") == DataUtil.BINARY_NULL_BITS if dtype == "<f8"\
+                            else np.zeros(values.size, dtype = bool)
+                self.tables[tableName][i][3].extend(None if n else v.item()
+                                                        for v, n in zip(values, isNull))
+            return
+        if match and match.group(1) == "CSVWRITE":
+            filePath, query = match.group(2), match.group(3).replace("''", "'")
+            columns = self.select(query)
+            pd.DataFrame(OrderedDict((c, pd.Series(values, dtype = object))
+                                     for c, t, notNull, values in columns))\
+                .to_csv(filePath, index = False)
+            return
+        match = re.match(r"CALL (\w+)\('(.*)', '(.*)'\)$", statement)
+        if match and match.group(1) == DataUtil.BINARY_WRITE_FUNCTION:
+            self.checkFunction(match.group(1))
+            basePath, query = match.group(2), match.group(3).replace("''", "'")
+            description = []
+            for i, (c, t, notNull, values) in enumerate(self.select(query)):
+                isInteger = t == "INTEGER" and notNull
+                dtype = "<i4" if isInteger else "<f8"
+                np.array([np.nan if v is None else v for v in values], dtype = dtype)\
+                    .tofile("{0}_{1}.bin".format(basePath, i))
+                description.append("{0}:{1}".format(c, dtype))
+            self.result = [(",".join(description), )]
+            return
+        match = re.match(r"SELECT \* FROM \((.*)\) LIMIT 0$", statement)
+        if match:
+            self.description = [(c, None, 11, 11, 10 if t == "INTEGER" else 17, 0,
+                                 0 if notNull else 1)
+                                    for c, t, notNull, values in self.select(match.group(1))]
+            self.result = []
+            return
+        raise ValueError("Statement not emulated: {0}".format(statement))
+
+    def fetchall(self):
+        return self.result
+
+
+@pytest.mark.parametrize("binaryExchange, missingFunctions",
+                         [(False, False), (True, False), (True, True)],
+                         ids = ["csv", "binary", "missing-functions"])
+def test_table_columns_round_trip(tmp_path, monkeypatch, binaryExchange, missingFunctions):
+    monkeypatch.setattr(DataUtil, "BINARY_EXCHANGE", binaryExchange)
+    cursor = FakeH2Cursor(missingFunctions = missingFunctions)
+    columns = OrderedDict([("ID", np.array([3, -1, 2**31 - 1], dtype = np.int64)),
+                           ("U", np.array([0.1, np.nan, -1e-300])),
+                           ("V", np.array([1., 2., 1. / 3]))])
+    DataUtil.writeTableColumns(cursor = cursor, tableName = "WIND",
+                               columns = columns,
+                               filePathBase = str(tmp_path / "write"))
+    assert [(c, t, notNull) for c, t, notNull, values in cursor.tables["WIND"]]\
+        == [("ID", "INTEGER", True), ("U", "DOUBLE", False), ("V", "DOUBLE", False)]
+    assert cursor.tables["WIND"][1][3][1] is None
+    assert cursor.tables["WIND"][2][3] == [1., 2., 1. / 3]
+
+    result = DataUtil.readQueryColumns(cursor = cursor, query = "SELECT * FROM WIND",
+                                       filePathBase = str(tmp_path / "read"))
+    assert list(result) == list(columns)
+    assert result["ID"].dtype == np.int32
+    np.testing.assert_array_equal(result["ID"], columns["ID"])
+    for c in ["U", "V"]:
+        assert result[c].dtype == np.float64
+        np.testing.assert_array_equal(result[c], columns[c])
+
+
+def test_table_columns_nullable_integers(tmp_path, monkeypatch):
+    # Integer column which can be NULL: float64 on both paths
+    results = []
+    for missingFunctions in [False, True]:
+        monkeypatch.setattr(DataUtil, "BINARY_EXCHANGE", True)
+        cursor = FakeH2Cursor(missingFunctions = missingFunctions)
+        cursor.tables["T"] = [("ID", "INTEGER", False, [1, None, 3])]
+        results.append(DataUtil.readQueryColumns(cursor = cursor, query = "SELECT * FROM T",
+                                                 filePathBase = str(tmp_path / str(missingFunctions))))
+    for result in results:
+        assert result["ID"].dtype == np.float64
+        np.testing.assert_array_equal(result["ID"], [1, np.nan, 3])
+
+
+def test_table_columns_other_error(tmp_path, monkeypatch):
+    monkeypatch.setattr(DataUtil, "BINARY_EXCHANGE", True)
+    cursor = FakeH2Cursor()
+    with pytest.raises(Exception, match = "42102"):
+        DataUtil.readQueryColumns(cursor = cursor, query = "SELECT * FROM MISSING",
+                                  filePathBase = str(tmp_path / "read"))
+
+
+@pytest.mark.parametrize("binaryExchange, missingFunctions",
+                         [(False, False), (True, False), (True, True)],
+                         ids = ["csv", "binary", "missing-functions"])
+def test_write_table_columns_nan_values(tmp_path, monkeypatch, binaryExchange, missingFunctions):
+    # Masked values are NULL, the other NaN and infinite values are kept
+    monkeypatch.setattr(DataUtil, "BINARY_EXCHANGE", binaryExchange)
+    cursor = FakeH2Cursor(missingFunctions = missingFunctions)
+    values = np.ma.masked_array([np.nan, np.nan, np.inf, -np.inf, 0.5],
+                                mask = [True, False, False, False, False])
+    DataUtil.writeTableColumns(cursor = cursor, tableName = "T",
+                               columns = OrderedDict([("ID", np.arange(5)), ("U", values)]),
+                               filePathBase = str(tmp_path / "write"))
+    written = cursor.tables["T"][1][3]
+    assert written[0] is None
+    assert np.isnan(written[1])
+    assert written[2:] == [np.inf, -np.inf, 0.5]
@@ -0,0 +1,273 @@
+# coding=utf-8
+"""Tests of the array calculations of the wind field initialization."""
+
+import math
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from .. import InitWindField
+from ..GlobalVariables import *
+
+
+def fillInitialWindFieldFromIndex(profile, rockle, building, nx, ny, nz, removeOffset):
+    """ Initial wind field as calculated by the former 'setInitialWindField'
+    (DataFrame indexed by the (X, Y, Z) MultiIndex of every cell)."""
+    df_wind0 = pd.DataFrame({"U": np.zeros(nx * ny * nz),
+                             "V": [val for i in range(nx) for j in range(ny) for val in profile],
+                             "W": np.zeros(nx * ny * nz)},
+                            index = pd.MultiIndex.from_product([range(nx), range(ny), range(nz)]))
+    for c in rockle.columns:
+        df_wind0.loc[rockle[c].sort_index().dropna().index, c] = rockle[c].sort_index().dropna()
+    if removeOffset:
+        idx = pd.IndexSlice
+        for z_i in range(1, rockle.index.get_level_values(2).max() + 1):
+            df_wind0.loc[idx[:, :, z_i], :] = df_wind0.loc[idx[:, :, z_i], :] * profile[z_i]\
+                / df_wind0.loc[idx[:, :, z_i], :].pow(2).sum(axis = 1).pow(0.5).mean()
+    df_wind0.loc[building] = 0
+
+    return [df_wind0[c].values.reshape(nx, ny, nz) for c in ["U", "V", "W"]]
+
+
+@pytest.mark.parametrize("removeOffset", [False, True])
+def test_fill_initial_wind_field(removeOffset):
+    nx, ny, nz = 9, 7, 6
+    rng = np.random.default_rng(0)
+    profile = np.concatenate([[0.], np.log(np.arange(1, nz) / 0.1)])
+
+    # Röckle zone points (some components not set) and building cells
+    cells = rng.choice(nx * ny * 4, size = 60, replace = False)
+    rockleX, rockleY, rockleZ = np.unravel_index(cells, (nx, ny, 4))
+    rockleZ = rockleZ + 1
+    values = rng.standard_normal((3, cells.size))
+    values[rng.random(values.shape) < 0.3] = np.nan
+    building = pd.MultiIndex.from_tuples([(2, 2, 1), (2, 3, 1), (2, 2, 2), (6, 4, 1)])
+    buildX, buildY, buildZ = [building.get_level_values(j).values for j in range(3)]
+
+    u0 = np.zeros((nx, ny, nz))
+    v0 = np.tile(profile, (nx, ny, 1))
+    w0 = np.zeros((nx, ny, nz))
+    InitWindField.fillInitialWindField(u0 = u0, v0 = v0, w0 = w0, profile = profile,
+                                       rockleCoordinates = (rockleX, rockleY, rockleZ),
+                                       rockleValues = list(values),
+                                       buildingCoordinates = (buildX, buildY, buildZ),
+                                       removeOffset = removeOffset)
+
+    rockle = pd.DataFrame({"U": values[0], "V": values[1], "W": values[2]},
+                          index = pd.MultiIndex.from_arrays([rockleX, rockleY, rockleZ]))
+    references = fillInitialWindFieldFromIndex(profile = profile, rockle = rockle,
+                                               building = building, nx = nx, ny = ny,
+                                               nz = nz, removeOffset = removeOffset)
+    for wind0, reference in zip([u0, v0, w0], references):
+        np.testing.assert_allclose(wind0, reference, rtol = 1e-12, atol = 1e-12)
+
+
+class SqlNull(object):
+    """ SQL NULL: NULL result for any arithmetic operation and unknown (None)
+    result for any comparison."""
+    def operation(self, *args):
+        return self
+    __add__ = __radd__ = __sub__ = __rsub__ = __mul__ = __rmul__ = operation
+    __truediv__ = __rtruediv__ = __neg__ = operation
+
+    def comparison(self, other):
+        return None
+    __eq__ = __lt__ = __le__ = __gt__ = __ge__ = comparison
+
+NULL = SqlNull()
+
+
+def sqlFunction(function):
+    """ SQL function of numbers: NULL as soon as one of its arguments is NULL."""
+    def sqlFunctionOfNumbers(*args):
+        if any(arg is NULL for arg in args):
+            return NULL
+        return function(*args)
+    return sqlFunctionOfNumbers
+
+@sqlFunction
+def POWER(x, y):
+    """ Java Math.pow (NaN for a negative value raised to a non-integer power)."""
+    try:
+        return math.pow(x, y)
+    except ValueError:
+        return math.nan
+
+SIN, COS, ABS = sqlFunction(math.sin), sqlFunction(math.cos), sqlFunction(abs)
+
+
+def calculates3dBuildWindFactorSql(zoneType, a, z, idPointZ):
+    """ Row obtained for a 2D zone point 'a' (NULL values as NULL) and a level
+    of height 'z' by the SQL engine of 'calculates3dBuildWindFactor' (the
+    equations are copied from the SQL queries), None if the WHERE clause is
+    not satisfied."""
+    PI = math.pi
+    if zoneType in [WAKE_NAME, WAKE_BACKWARD_NAME]:
+        isInZone = z < a[UPPER_VERTICAL_THRESHOLD] and z >= a[UPPER_VERTICAL_THRESHOLD + CAVITY_NAME[0]]
+    elif zoneType == STREET_CANYON_NAME:
+        isInZone = z < a[UPPER_VERTICAL_THRESHOLD] and z < a[MAX_CANYON_HEIGHT_FIELD]
+    elif zoneType == ROOFTOP_PERP_NAME:
+        isInZone = z < a[HEIGHT_FIELD] + a[ROOFTOP_PERP_VAR_HEIGHT] and z > a[HEIGHT_FIELD]
+    elif zoneType == ROOFTOP_CORN_NAME:
+        isInZone = z < a[HEIGHT_FIELD] + a[ROOFTOP_CORNER_VAR_HEIGHT] and z > a[HEIGHT_FIELD]
+    else:
+        isInZone = z < a[UPPER_VERTICAL_THRESHOLD]
+    if not isInZone:
+        return None
+
+    H = a.get(HEIGHT_FIELD)
+    row = OrderedDict([(ID_POINT_Z, idPointZ)])
+    if zoneType == DISPLACEMENT_NAME:
+        row[U] = C_DZ*POWER(z/H,P_DZ)*a[U]
+        row[V] = C_DZ*POWER(z/H,P_DZ)*a[V]
+        row[W] = 0 if a[U] == 0 and a[V] == 0 \
+            else -0*C_DZ*POWER((H-z)/H,0.5)*(ABS(a[U])/POWER(POWER(a[U],2)+POWER(a[V],2),0.5))
+        row[ID_POINT] = a[ID_POINT]
+        row[HEIGHT_FIELD] = H
+    elif zoneType == DISPLACEMENT_VORTEX_NAME:
+        relativePosition = a[POINT_RELATIVE_POSITION_FIELD+DISPLACEMENT_VORTEX_NAME[0]]
+        row[V] = -(0.6*COS(PI*z/(0.5*H))+0.05)*0.6*SIN(PI*relativePosition)
+        row[W] = -0.1*COS(PI*relativePosition)-0.05
+        row[ID_POINT] = a[ID_POINT]
+        row[HEIGHT_FIELD] = H
+    elif zoneType == CAVITY_NAME:
+        relativePosition = a[POINT_RELATIVE_POSITION_FIELD+CAVITY_NAME[0]]
+        row[V] = -POWER(1-relativePosition/POWER(1-POWER(z/H,2),0.5),2)\
+            *POWER(a[COS_BLOCK_AZIMUTH],0)*POWER(a[DOWNSTREAM_X_RELATIVE_POSITION],0.5)
+        row[ID_POINT] = a[ID_POINT]
+        row[HEIGHT_FIELD] = H
+        row[U] = 0*POWER(relativePosition/POWER(1-POWER(z/H,2),0.5),0.5)
+        row[W] = 0*POWER(1-relativePosition/POWER(1-POWER(z/H,2),0.5),2)
+    elif zoneType == WAKE_NAME:
+        deficit = a[WAKE_RELATIVE_POSITION_FIELD]*POWER(POWER(1-POWER(z/H,2),0.5),1.5)
+        row[V_WEIGHT] = 1-deficit
+        row[U_WEIGHT] = 1-deficit
+        row[W_WEIGHT] = 1-deficit
+        row[ID_POINT] = a[ID_POINT]
+        row[HEIGHT_FIELD] = H
+        row[V] = 1-deficit*POWER(a[COS_BLOCK_AZIMUTH],0)*POWER(a[DOWNSTREAM_X_RELATIVE_POSITION],0)
+        row[U] = 0*deficit*a[SIN_BLOCK_AZIMUTH]*a[DOWNSTREAM_X_RELATIVE_POSITION]
+    elif zoneType == STREET_CANYON_NAME:
+        row[U] = a[U]
+        row[V] = a[V]
+        row[W] = a[W]
+        row[ID_POINT] = a[ID_POINT]
+        row[HEIGHT_FIELD] = a[UPSTREAM_HEIGHT_FIELD]
+    elif zoneType == ROOFTOP_PERP_NAME:
+        Hr = a[ROOFTOP_PERP_VAR_HEIGHT]
+        row[V] = -POWER((H+Hr-z)/Z_REF,P_RTP)*ABS(H+Hr-z)/Hr
+        row[ID_POINT] = a[ID_POINT]
+        row[HEIGHT_FIELD] = H
+    elif zoneType == ROOFTOP_CORN_NAME:
+        Hr = a[ROOFTOP_CORNER_VAR_HEIGHT]
+        C1 = a[ROOFTOP_WIND_FACTOR]
+        theta = a[UPWIND_FACADE_ANGLE_FIELD]
+        row[U] = -C1*SIN(2*theta)*POWER((H+Hr-z)/Z_REF,P_RTP)*ABS(H+Hr-z)/Hr
+        row[V] = -C1*POWER(SIN(theta),2)*POWER((H+Hr-z)/Z_REF,P_RTP)*ABS(H+Hr-z)/Hr
+        row[ID_POINT] = a[ID_POINT]
+        row[HEIGHT_FIELD] = H
+    elif zoneType == CAVITY_BACKWARD_NAME:
+        relativePosition = a[POINT_RELATIVE_POSITION_FIELD+CAVITY_NAME[0]]
+        row[V] = POWER(1-relativePosition/POWER(1-POWER(z/H,2),0.5),2)
+        row[ID_POINT] = a[ID_POINT]
+        row[HEIGHT_FIELD] = H
+        row[ID_POINT_X] = a[ID_POINT_X]
+        row[UPWIND_FACADE_FIELD] = a[UPWIND_FACADE_FIELD]
+    elif zoneType == WAKE_BACKWARD_NAME:
+        factor = -1+POWER(a[WAKE_RELATIVE_POSITION_FIELD]*POWER(1-POWER(z/H,2),0.5),1.5)
+        row[V] = factor
+        row[U] = factor
+        row[W] = factor
+        row[ID_POINT] = a[ID_POINT]
+        row[HEIGHT_FIELD] = H
+        row[ID_POINT_X] = a[ID_POINT_X]
+        row[UPWIND_FACADE_FIELD] = a[UPWIND_FACADE_FIELD]
+    row[Y_WALL] = a[Y_WALL]
+
+    return row
+
+
+BUILD_ZONE_ATTRIBUTES = \
+    {   DISPLACEMENT_NAME       : [UPPER_VERTICAL_THRESHOLD, HEIGHT_FIELD, U, V],
+        DISPLACEMENT_VORTEX_NAME: [UPPER_VERTICAL_THRESHOLD, HEIGHT_FIELD,
+                                   POINT_RELATIVE_POSITION_FIELD+DISPLACEMENT_VORTEX_NAME[0]],
+        CAVITY_NAME             : [UPPER_VERTICAL_THRESHOLD, HEIGHT_FIELD,
+                                   POINT_RELATIVE_POSITION_FIELD+CAVITY_NAME[0],
+                                   COS_BLOCK_AZIMUTH, DOWNSTREAM_X_RELATIVE_POSITION],
+        WAKE_NAME               : [UPPER_VERTICAL_THRESHOLD, UPPER_VERTICAL_THRESHOLD + CAVITY_NAME[0],
+                                   HEIGHT_FIELD, WAKE_RELATIVE_POSITION_FIELD, COS_BLOCK_AZIMUTH,
+                                   SIN_BLOCK_AZIMUTH, DOWNSTREAM_X_RELATIVE_POSITION],
+        STREET_CANYON_NAME      : [UPPER_VERTICAL_THRESHOLD, MAX_CANYON_HEIGHT_FIELD,
+                                   U, V, W, UPSTREAM_HEIGHT_FIELD],
+        ROOFTOP_PERP_NAME       : [HEIGHT_FIELD, ROOFTOP_PERP_VAR_HEIGHT],
+        ROOFTOP_CORN_NAME       : [HEIGHT_FIELD, ROOFTOP_CORNER_VAR_HEIGHT,
+                                   ROOFTOP_WIND_FACTOR, UPWIND_FACADE_ANGLE_FIELD],
+        CAVITY_BACKWARD_NAME    : [UPPER_VERTICAL_THRESHOLD, HEIGHT_FIELD,
+                                   POINT_RELATIVE_POSITION_FIELD+CAVITY_NAME[0]],
+        WAKE_BACKWARD_NAME      : [UPPER_VERTICAL_THRESHOLD, UPPER_VERTICAL_THRESHOLD + CAVITY_NAME[0],
+                                   HEIGHT_FIELD, WAKE_RELATIVE_POSITION_FIELD]}
+
+
+@pytest.mark.parametrize("zoneType", sorted(BUILD_ZONE_ATTRIBUTES))
+def test_build_wind_factor_arrays(zoneType):
+    nbPoints = 40
+    levelHeights = np.arange(0.5, 30, 1.5)
+    rng = np.random.default_rng(0)
+
+    # Attributes read from H2GIS (NaN for NULL), some of them out of the
+    # range of the equations (NaN factors), and a calm point for DISPLACEMENT
+    attributes = OrderedDict()
+    for c in BUILD_ZONE_ATTRIBUTES[zoneType]:
+        if c == HEIGHT_FIELD:
+            values = rng.uniform(1, 25, nbPoints)
+        elif c in [UPPER_VERTICAL_THRESHOLD, MAX_CANYON_HEIGHT_FIELD, UPSTREAM_HEIGHT_FIELD,
+                   ROOFTOP_PERP_VAR_HEIGHT, ROOFTOP_CORNER_VAR_HEIGHT]:
+            values = rng.uniform(1, 30, nbPoints)
+        elif c == UPPER_VERTICAL_THRESHOLD + CAVITY_NAME[0]:
+            values = rng.uniform(0, 10, nbPoints)
+        else:
+            values = rng.uniform(-1, 2, nbPoints)
+        values[rng.random(nbPoints) < 0.15] = np.nan
+        attributes[c] = values
+    if zoneType == DISPLACEMENT_NAME:
+        attributes[U][:2] = 0
+        attributes[V][:2] = [0, np.nan]
+        attributes[HEIGHT_FIELD][:2] = [np.nan, 20]
+        attributes[UPPER_VERTICAL_THRESHOLD][:2] = 20
+    attributes[ID_POINT] = np.arange(nbPoints, dtype = np.int32)
+    if zoneType in [CAVITY_BACKWARD_NAME, WAKE_BACKWARD_NAME]:
+        attributes[ID_POINT_X] = rng.integers(0, 100, nbPoints).astype(np.int32)
+        attributes[UPWIND_FACADE_FIELD] = rng.integers(0, 100, nbPoints).astype(np.int32)
+    attributes[Y_WALL] = rng.uniform(0, 10, nbPoints)
+
+    columns = InitWindField.calculates3dBuildWindFactorArrays(zoneType = zoneType,
+                                                              attributes = attributes,
+                                                              levelHeights = levelHeights)
+
+    rows = []
+    for i in range(nbPoints):
+        a = {c: NULL if np.isnan(attributes[c][i]) else attributes[c][i].item()
+                 for c in attributes}
+        for k, z in enumerate(levelHeights):
+            row = calculates3dBuildWindFactorSql(zoneType, a, z, k + 1)
+            if row is not None:
+                rows.append(row)
+    assert len(rows) > 0
+    assert list(columns) == list(rows[0])
+    for c in columns:
+        assert columns[c].size == len(rows)
+        # NULL values once written in H2GIS
+        isNull = np.ma.getmaskarray(columns[c]) if np.ma.isMaskedArray(columns[c])\
+                    else np.isnan(columns[c])
+        values = np.ma.getdata(columns[c])
+        for j, row in enumerate(rows):
+            if row[c] is NULL:
+                assert isNull[j], (c, j)
+            else:
+                assert not isNull[j], (c, j)
+                if math.isnan(row[c]):
+                    assert np.isnan(values[j]), (c, j)
+                else:
+                    assert values[j] == pytest.approx(row[c], rel = 1e-12, abs = 1e-12), (c, j)
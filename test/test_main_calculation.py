@@ -0,0 +1,110 @@
+# coding=utf-8
+"""Tests of the array steps of the main calculation."""
+
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from .. import WindSolver
+try:
+    from .. import MainCalculation
+except ImportError:
+    # Dependencies of the H2GIS connection and of the outputs not installed
+    MainCalculation = None
+
+pytestmark = pytest.mark.skipif(MainCalculation is None,
+                                reason = "MainCalculation dependencies not installed")
+
+
+def rasterizeBuildingsFromIndex(nx, ny, nz, buildingCells):
+    """ Building coordinates and cells to solve as calculated by the former
+    main calculation (Series indexed by the (X, Y, Z) MultiIndex of every cell)."""
+    gridBuil = pd.MultiIndex.from_arrays(buildingCells)
+    gridBuil = gridBuil.append(pd.MultiIndex.from_product([range(1, nx-1), range(1, ny-1), [0]]))
+    buildGrid3D = pd.Series(1, index = pd.MultiIndex.from_product([range(nx), range(ny), range(nz)]),
+                            dtype = np.int32)
+    buildGrid3D.loc[gridBuil] = 0
+    buildGrid3D = np.array([buildGrid3D.xs(i, level = 0).unstack().values for i in range(nx)])
+
+    cells4Solver = np.transpose(np.where(buildGrid3D == 1))
+    for axis, n in enumerate([nx, ny, nz]):
+        cells4Solver = cells4Solver[(cells4Solver[:, axis] > 0) & (cells4Solver[:, axis] < n - 1)]
+    buildingCoordinates = np.stack(np.where(buildGrid3D == 0)).astype(np.int32)
+
+    return buildingCoordinates, cells4Solver.astype(np.int32)
+
+
+@pytest.mark.parametrize("slabSize", [None, 1, 3])
+def test_rasterize_buildings(slabSize):
+    nx, ny, nz = 11, 9, 7
+    rng = np.random.default_rng(0)
+    # Building cells, some of them duplicated or on the sketch boundaries
+    buildingCells = [rng.integers(0, n, 80) for n in (nx, ny, nz)]
+    buildingCoordinates, cells4Solver = \
+        MainCalculation.rasterizeBuildings(nx = nx, ny = ny, nz = nz,
+                                           buildingCells = buildingCells,
+                                           slabSize = slabSize)
+    references = rasterizeBuildingsFromIndex(nx = nx, ny = ny, nz = nz,
+                                             buildingCells = buildingCells)
+    for array, reference in zip([buildingCoordinates, cells4Solver], references):
+        assert array.dtype == reference.dtype
+        np.testing.assert_array_equal(array, reference)
+
+
+def rotateDataReturningArrays(theta, nx, ny, nz, x, y, x_rot, y_rot, u, v):
+    """ Rotated coordinates and wind field as calculated by the former
+    'rotateData' (rotated wind field allocated and returned)."""
+    u_rot = np.zeros(u.shape)
+    v_rot = np.zeros(v.shape)
+    rot = np.array([[math.cos(theta), -math.sin(theta)],
+                    [math.sin(theta), math.cos(theta)]])
+    xmax = x.max()
+    ymax = y.max()
+    for i in range(nx):
+        for j in range(ny):
+            x_rot[i,j] = (xmax-x[i]) * rot[0,0] + (ymax-y[j]) * rot[0,1]
+            y_rot[i,j] = (xmax-x[i]) * rot[1,0] + (ymax-y[j]) * rot[1,1]
+            for k in range(nz):
+                u_rot[i, j, k] = u[i,j,k] * rot[0,0] + v[i,j,k] * rot[0,1]
+                v_rot[i, j, k] = u[i,j,k] * rot[1,0] + v[i,j,k] * rot[1,1]
+
+    return x_rot, y_rot, u_rot, v_rot
+
+
+@pytest.mark.parametrize("memmap", [False, True])
+def test_rotate_data(memmap, tmp_path):
+    nx, ny, nz = 9, 7, 5
+    rng = np.random.default_rng(0)
+    theta = -float(215) * np.pi / 180
+    x = np.linspace(0, 16, nx) + 3.
+    y = np.linspace(0, 12, ny) - 1.
+    winds = [(rng.standard_normal((nx, ny, nz)), rng.standard_normal((nx, ny, nz)))
+                 for i in range(2)]
+    memmapDirectory = str(tmp_path) if memmap else None
+
+    # Both wind fields rotated at the same time, as in the main calculation
+    outputs = []
+    with ThreadPoolExecutor(max_workers = 1) as rotationThread:
+        futures = []
+        for u, v in winds:
+            output = [np.zeros((nx, ny)), np.zeros((nx, ny)),
+                      WindSolver.allocateArray(u.shape, u.dtype, memmapDirectory, "u_rot"),
+                      WindSolver.allocateArray(v.shape, v.dtype, memmapDirectory, "v_rot")]
+            futures.append(rotationThread.submit(MainCalculation.rotateData,
+                                                 theta = theta, nx = nx, ny = ny, nz = nz,
+                                                 x = x, y = y, x_rot = output[0],
+                                                 y_rot = output[1], u = u, v = v,
+                                                 u_rot = output[2], v_rot = output[3]))
+            outputs.append(output)
+        for future in futures:
+            future.result()
+
+    for (u, v), output in zip(winds, outputs):
+        references = rotateDataReturningArrays(theta = theta, nx = nx, ny = ny, nz = nz,
+                                               x = x, y = y, x_rot = np.zeros((nx, ny)),
+                                               y_rot = np.zeros((nx, ny)), u = u, v = v)
+        for array, reference in zip(output, references):
+            np.testing.assert_allclose(array, reference, rtol = 1e-14, atol = 1e-14)
@@ -0,0 +1,344 @@
+# coding=utf-8
+"""Tests of the wind solver on a small synthetic building case."""
+
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from .. import DataUtil
+from .. import WindSolver
+
+
+def createBuildingCase(dzLevels = None, nx = 26, ny = 22, dx = 2.):
+    """ Create a small grid having three buildings and a random initial wind
+    field (zero on the faces of the building cells) as solver arguments."""
+    nz = 14 if dzLevels is None else dzLevels.size
+    dz = 1. if dzLevels is None else dzLevels[0]
+    buildGrid3D = np.ones((nx, ny, nz), dtype = np.int32)
+    buildGrid3D[1:nx-1, 1:ny-1, 0] = 0
+    for x0, y0, width, length, height in [(5, 4, 5, 6, 7), (14, 11, 6, 5, 9), (6, 14, 4, 4, 4)]:
+        buildGrid3D[x0:x0+width, y0:y0+length, 1:height] = 0
+    buildingCoordinates = np.stack(np.nonzero(buildGrid3D == 0)).astype(np.int32)
+    cells4Solver = (np.argwhere(buildGrid3D[1:nx-1, 1:ny-1, 1:nz-1] == 1) + 1).astype(np.int32)
+
+    rng = np.random.default_rng(0)
+    zLevels = np.cumsum(np.full(nz, dz) if dzLevels is None else dzLevels)
+    u0 = 0.3 * rng.standard_normal((nx, ny, nz))
+    v0 = -np.log(zLevels / 0.1)[np.newaxis, np.newaxis, :] + 0.3 * rng.standard_normal((nx, ny, nz))
+    w0 = 0.1 * rng.standard_normal((nx, ny, nz))
+    b = buildingCoordinates
+    for wind0, shift in zip([u0, v0, w0], np.eye(3, dtype = np.int32)):
+        wind0[b[0], b[1], b[2]] = 0
+        wind0[b[0] + shift[0], b[1] + shift[1], b[2] + shift[2]] = 0
+
+    return dict(x = np.arange(nx) * dx, y = np.arange(ny) * dx,
+                z = np.arange(nz) * dz, dx = dx, dy = dx, dz = dz,
+                u0 = u0, v0 = v0, w0 = w0,
+                buildingCoordinates = buildingCoordinates,
+                cells4Solver = cells4Solver)
+
+
+def calcDivergence(u, v, w, case, dzLevels = None):
+    """ Divergence of a wind field in each cell solved."""
+    i, j, k = case["cells4Solver"].T
+    dz = np.full(u.shape[2], case["dz"]) if dzLevels is None else dzLevels
+    return (u[i+1, j, k] - u[i, j, k]) / case["dx"]\
+        + (v[i, j+1, k] - v[i, j, k]) / case["dy"]\
+        + (w[i, j, k+1] - w[i, j, k]) / dz[k]
+
+
+@pytest.mark.parametrize("solverMethod", ["sor", "red-black", "zline"])
+def test_stretched_grid_divergence(solverMethod):
+    dzLevels = np.concatenate([[1.], DataUtil.getLevelThicknesses(topHeight = 30,
+                                                                  dz = 1,
+                                                                  stretchRatio = 1.2,
+                                                                  stretchHeight = 6)])
+    case = createBuildingCase(dzLevels = dzLevels)
+    u, v, w = WindSolver.solver(solverMethod = solverMethod, maxIterations = 5000,
+                                thresholdIterations = 1e-13, cacheSize = 0,
+                                dzLevels = dzLevels, **case)
+
+    divergence0 = calcDivergence(case["u0"], case["v0"], case["w0"], case, dzLevels)
+    divergence = calcDivergence(u, v, w, case, dzLevels)
+    assert np.abs(divergence).max() < 1e-9 * np.abs(divergence0).max()
+
+
+def test_integer_grid_spacing():
+    """ Integer grid spacings (set from QGIS) use the kernels compiled by the
+    warm-up, no other specialization being compiled during the solve"""
+    WindSolver.compileKernels(np.float64)
+    kernels = [kernel for kernel, signature in WindSolver.getKernelSignatures(np.float64)]
+    signatures = [list(kernel.signatures) for kernel in kernels]
+    case = createBuildingCase(dx = 2)
+    case["dz"] = 1
+    for solverMethod, cells4Solver in [("sor", case["cells4Solver"]), ("sor", None),
+                                       ("red-black", case["cells4Solver"]),
+                                       ("red-black", None), ("zline", None)]:
+        WindSolver.solver(solverMethod = solverMethod, maxIterations = 2, cacheSize = 0,
+                          **dict(case, cells4Solver = cells4Solver))
+    assert [list(kernel.signatures) for kernel in kernels] == signatures
+
+
+@pytest.fixture(scope = "module")
+def referenceSolution():
+    case = createBuildingCase()
+    solution = WindSolver.solver(solverMethod = "pcg", maxIterations = 5000,
+                                 residualThreshold = 1e-13, cacheSize = 0, **case)
+    return case, solution
+
+
+@pytest.mark.parametrize("options", [
+    pytest.param(dict(solverMethod = "red-black"), id = "red-black"),
+    pytest.param(dict(solverMethod = "multigrid"), id = "multigrid"),
+    pytest.param(dict(solverMethod = "pcg", preconditioner = "jacobi"), id = "pcg-jacobi"),
+    pytest.param(dict(solverMethod = "pcg", preconditioner = "ssor"), id = "pcg-ssor"),
+    pytest.param(dict(solverMethod = "pcg", preconditioner = "ic"), id = "pcg-ic"),
+    pytest.param(dict(solverMethod = "pcg", preconditioner = "ic", cacheSize = 1, nbSolves = 2),
+                 id = "pcg-ic-cached"),
+    pytest.param(dict(solverMethod = "red-black", lambdaCache = True, nbSolves = 2),
+                 id = "warm-start"),
+    pytest.param(dict(solverMethod = "red-black", dtype = np.float32), id = "float32"),
+    pytest.param(dict(solverMethod = "sor"), id = "sor"),
+    pytest.param(dict(solverMethod = "sor", cells4Solver = None), id = "sor-dense"),
+    pytest.param(dict(solverMethod = "red-black", cells4Solver = None), id = "red-black-dense"),
+    pytest.param(dict(solverMethod = "sor", convergenceInterval = 10), id = "convergence-interval"),
+    pytest.param(dict(solverMethod = "red-black", omegaMethod = "chebyshev"), id = "chebyshev"),
+    pytest.param(dict(solverMethod = "sor", omegaMethod = "adaptive"), id = "adaptive"),
+    pytest.param(dict(solverMethod = "zline"), id = "zline"),
+    pytest.param(dict(solverMethod = "schwarz", nbProcesses = 2), id = "schwarz"),
+    pytest.param(dict(solverMethod = "sor", nestedFactor = 2), id = "nested"),
+    pytest.param(dict(solverMethod = "red-black", activeDistance = 2, activeTolerance = 1e-12),
+                 id = "active-set"),
+])
+def test_solver_methods(options, referenceSolution, tmp_path):
+    """ Each solver method or option gives the wind field of a tightly 
+    converged preconditioned conjugate gradient"""
+    case, reference = referenceSolution
+    case = dict(case)
+    options = dict(options)
+    nbSolves = options.pop("nbSolves", 1)
+    dtype = options.pop("dtype", np.float64)
+    for key in ("u0", "v0", "w0"):
+        case[key] = case[key].astype(dtype)
+    if "cells4Solver" in options:
+        case["cells4Solver"] = options.pop("cells4Solver")
+    if options.pop("lambdaCache", False):
+        options["lambdaCacheDirectory"] = str(tmp_path)
+    nestedFactor = options.pop("nestedFactor", 1)
+    if nestedFactor > 1:
+        options["lambda0"] = WindSolver.solveCoarseLambda(dx = case["dx"], dy = case["dy"],
+                                                          dz = case["dz"], u0 = case["u0"],
+                                                          v0 = case["v0"], w0 = case["w0"],
+                                                          buildingCoordinates = case["buildingCoordinates"],
+                                                          factor = nestedFactor,
+                                                          thresholdIterations = 1e-6)
+    options.setdefault("cacheSize", 0)
+    
+    for i in range(nbSolves):
+        solution = WindSolver.solver(maxIterations = 20000, thresholdIterations = 1e-12,
+                                     residualThreshold = 1e-12, **case, **options)
+        tolerance = 1e-8 if dtype == np.float64 else 1e-4
+        for wind, windReference in zip(solution, reference):
+            assert wind.dtype == dtype
+            np.testing.assert_allclose(wind, windReference, rtol = 0, 
+                                       atol = tolerance * np.abs(windReference).max())
+
+
+def calcObstacleCoefficientsFromIndex(nx, ny, nz, buildingCoordinates):
+    """ Coefficients e, f, g, h, m, n, o, p, q of the lambda equation near
+    obstacles as calculated by the former solver (one 3D array per 
+    coefficient, cells close to walls identified by pandas MultiIndex)."""
+    e, f, g, h, m, n, o, p, q = [np.ones([nx, ny, nz]) for i in range(9)]
+    b = buildingCoordinates
+    
+    def index(di, dj, dk):
+        return pd.MultiIndex.from_tuples(list(zip(*[b[0] + di, b[1] + dj, b[2] + dk])))
+    
+    def levels(ind):
+        return ind.get_level_values(0), ind.get_level_values(1), ind.get_level_values(2)
+    
+    indBelow = index(0, 0, 1)
+    indBelowFront = indBelow.intersection(index(0, -1, 0))
+    indBelowBehind = indBelow.intersection(index(0, 1, 0))
+    indBelowLeft = indBelow.intersection(index(1, 0, 0))
+    indBelowRight = indBelow.intersection(index(-1, 0, 0))
+    indBelowAnyAround = indBelowFront.union(indBelowBehind).union(indBelowLeft).union(indBelowRight)
+    
+    if WindSolver.DESCENDING_Y:
+        e[b[0] + 1, b[1], b[2]] = 0.
+        e[levels(indBelowLeft)] = 0.
+        f[b[0] - 1, b[1], b[2]] = 0.
+        f[levels(indBelowRight)] = 0.
+        g[b[0], b[1] + 1, b[2]] = 0.
+        g[levels(indBelowBehind)] = 0.
+        h[b[0], b[1] - 1, b[2]] = 0.
+        h[levels(indBelowFront)] = 0.
+        m[b[0], b[1], b[2] + 1] = 0.
+        n[b[0], b[1], b[2] - 1] = 0.
+    else:
+        e[b[0] - 1, b[1], b[2]] = 0.
+        e[levels(indBelowRight)] = 0.
+        f[b[0] + 1, b[1], b[2]] = 0.
+        f[levels(indBelowLeft)] = 0.
+        g[b[0], b[1] - 1, b[2]] = 0.
+        g[levels(indBelowFront)] = 0.
+        h[b[0], b[1] + 1, b[2]] = 0.
+        h[levels(indBelowBehind)] = 0.
+        m[b[0], b[1], b[2] - 1] = 0.
+        n[b[0], b[1], b[2] + 1] = 0.
+    
+    o[b[0] - 1, b[1], b[2]] = 0.5
+    o[b[0] + 1, b[1], b[2]] = 0.5
+    p[b[0], b[1] - 1, b[2]] = 0.5
+    p[b[0], b[1] + 1, b[2]] = 0.5
+    q[b[0], b[1], b[2] + 1] = 0.5
+    q[b[0], b[1], b[2] - 1] = 0.5
+    n[levels(indBelowAnyAround)] = 0.
+    o[levels(indBelowLeft.union(indBelowRight))] = 0.5
+    p[levels(indBelowFront.union(indBelowBehind))] = 0.5
+    q[levels(indBelowAnyAround)] = 0.5
+    
+    return e, f, g, h, m, n, o, p, q
+
+
+def test_obstacle_flags():
+    case = createBuildingCase()
+    nx, ny, nz = case["u0"].shape
+    flags = WindSolver.setObstacleFlags(nx = nx, ny = ny, nz = nz,
+                                        buildingCoordinates = case["buildingCoordinates"])
+    i, j, k = case["cells4Solver"].T
+    coefficients = WindSolver.decodeObstacleFlags(flags[i, j, k])
+    references = calcObstacleCoefficientsFromIndex(nx, ny, nz, case["buildingCoordinates"])
+    for name, coefficient, reference in zip("efghmnopq", coefficients, references):
+        np.testing.assert_array_equal(coefficient, reference[i, j, k], err_msg = name)
+    # Only the cells solved are flagged as such
+    solved = np.zeros([nx, ny, nz], dtype = bool)
+    solved[i, j, k] = True
+    np.testing.assert_array_equal((flags & WindSolver.SOLVED) > 0, solved)
+
+
+class CancelingFeedback(object):
+    """ QGIS feedback whose calculation is canceled after 'nbChecks' checks."""
+    def __init__(self, nbChecks):
+        self.nbChecks = nbChecks
+        self.nbCalls = 0
+
+    def isCanceled(self):
+        self.nbCalls += 1
+        return self.nbCalls > self.nbChecks
+
+    def setProgress(self, progress):
+        pass
+
+    def setProgressText(self, text):
+        pass
+
+    def pushInfo(self, text):
+        pass
+
+
+@pytest.mark.parametrize("solverMethod", ["sor", "red-black"])
+def test_checkpoint_resume(solverMethod, tmp_path):
+    """ A calculation canceled and resumed from its checkpoint gives the
+    wind field of an uninterrupted calculation"""
+    case = createBuildingCase()
+    options = dict(solverMethod = solverMethod, maxIterations = 40,
+                   thresholdIterations = 1e-30, cacheSize = 0, **case)
+    reference = WindSolver.solver(**options)
+
+    with pytest.raises(WindSolver.SolverCanceled, match = "state saved"):
+        WindSolver.solver(feedback = CancelingFeedback(nbChecks = 25),
+                          checkpointDirectory = str(tmp_path),
+                          checkpointInterval = 10, **options)
+    # Complete checkpoint of the last iteration calculated
+    files = sorted(path.name for path in tmp_path.iterdir())
+    assert len(files) == 3 and not any(f.endswith(".tmp") for f in files)
+    statePath, = [f for f in files if f.endswith(".json")]
+    caseHash = statePath[len(WindSolver.CHECKPOINT_PREFIX):-len(".json")]
+    lambdaN1 = np.zeros(case["u0"].shape)
+    state = WindSolver.loadCheckpoint(lambdaN1 = lambdaN1,
+                                      checkpointDirectory = str(tmp_path),
+                                      caseHash = caseHash)
+    assert state["iteration"] == 26
+    assert np.abs(lambdaN1).max() > 0
+
+    solution = WindSolver.solver(checkpointDirectory = str(tmp_path), **options)
+    for wind, windReference in zip(solution, reference):
+        np.testing.assert_allclose(wind, windReference, rtol = 0,
+                                   atol = 1e-12 * np.abs(windReference).max())
+    # Checkpoint removed once the calculation is finished
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_checkpoint_interrupted_save(tmp_path, monkeypatch):
+    """ A checkpoint interrupted while it is written leaves the previous
+    checkpoint complete"""
+    lambdaSaved = np.arange(24.).reshape(2, 3, 4)
+    checkpoint = WindSolver.saveCheckpoint(checkpoint = None, lambdaN1 = lambdaSaved,
+                                           checkpointDirectory = str(tmp_path),
+                                           caseHash = "case", state = {"iteration": 10})
+
+    def interrupt(*args, **kwargs):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(WindSolver.json, "dump", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        WindSolver.saveCheckpoint(checkpoint = checkpoint, lambdaN1 = -lambdaSaved,
+                                  checkpointDirectory = str(tmp_path),
+                                  caseHash = "case", state = {"iteration": 20})
+    monkeypatch.undo()
+    checkpoint = None
+
+    lambdaN1 = np.zeros(lambdaSaved.shape)
+    state = WindSolver.loadCheckpoint(lambdaN1 = lambdaN1,
+                                      checkpointDirectory = str(tmp_path),
+                                      caseHash = "case")
+    assert state["iteration"] == 10
+    np.testing.assert_array_equal(lambdaN1, lambdaSaved)
+
+
+@pytest.mark.parametrize("solverMethod, dense", [("sor", False), ("sor", True),
+                                                 ("red-black", False), ("pcg", False)])
+def test_out_of_core(solverMethod, dense, tmp_path):
+    """ The out-of-core mode (memory-mapped arrays, wind field calculated by
+    slabs) gives the wind field calculated in RAM and leaves no file"""
+    case = createBuildingCase(nx = 2 * WindSolver.OUT_OF_CORE_SLAB_SIZE + 8)
+    if dense:
+        case["cells4Solver"] = None
+    options = dict(solverMethod = solverMethod, maxIterations = 30,
+                   thresholdIterations = 1e-30, residualThreshold = 1e-30,
+                   cacheSize = 0, **case)
+    reference = WindSolver.solver(**options)
+    solution = WindSolver.solver(memmapDirectory = str(tmp_path), **options)
+    for wind, windReference in zip(solution, reference):
+        assert isinstance(wind, np.memmap)
+        np.testing.assert_allclose(wind, windReference, rtol = 0,
+                                   atol = 1e-12 * np.abs(windReference).max())
+    # The files are removed at once, except on Windows (with the directory)
+    if sys.platform != "win32":
+        assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("solverMethod", ["sor", "red-black", "multigrid", "pcg"])
+def test_solver_cache_hit(solverMethod):
+    """ A calculation reusing the cached operator of its geometry (new
+    initial wind field) gives the wind field of a calculation without cache"""
+    case = createBuildingCase()
+    newCase = dict(case, u0 = 2 * case["u0"], v0 = 1.5 * case["v0"], w0 = -case["w0"])
+    options = dict(solverMethod = solverMethod, maxIterations = 30,
+                   thresholdIterations = 1e-30, residualThreshold = 1e-30)
+    reference = WindSolver.solver(cacheSize = 0, **newCase, **options)
+    try:
+        WindSolver.solver(cacheSize = 1, **case, **options)
+        solverData, = WindSolver.solverCache.values()
+        cachedData = dict(solverData)
+        assert len(cachedData) > 0
+        solution = WindSolver.solver(cacheSize = 1, **newCase, **options)
+        # Same operator data used by the second calculation
+        assert list(WindSolver.solverCache.values()) == [solverData]
+        assert all(solverData[key] is data for key, data in cachedData.items())
+    finally:
+        WindSolver.solverCache.clear()
+    for wind, windReference in zip(solution, reference):
+        np.testing.assert_array_equal(wind, windReference)
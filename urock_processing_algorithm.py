@@ -64,6 +64,7 @@ except Exception:
     pass
 
 from . import MainCalculation
+from .WindSolver import SolverCanceled
 from .GlobalVariables import *
 from .H2gisConnection import getJavaDir, setJavaDir, saveJavaDir
 
@@ -388,47 +389,52 @@ class URockAlgorithm(QgsProcessingAlgorithm):
             feedback.pushInfo('You should either specify an output raster or a horizontal mesh size')
             
         # Make the calculations
-        u, v, w, u0, v0, w0, x, y, z, buildingCoordinates, cursor, gridName,\
-        rotationCenterCoordinates, verticalWindProfile, dicVectorTables,\
-        netcdf_path, net_cdf_path_ini = \
-            MainCalculation.main(javaEnvironmentPath = javaEnvVar,
-                                 pluginDirectory = plugin_directory,
-                                 outputFilePath = outputDirectory,
-                                 outputFilename = outputFilename,
-                                 buildingFilePath = build_file,
-                                 vegetationFilePath = veg_file,
-                                 srid = srid_build,
-                                 z_ref = z_ref,
-                                 v_ref = v_ref,
-                                 windDirection = windDirection,
-                                 prefix = prefix,
-                                 meshSize = meshSize,
-                                 dz = dz,
-                                 alongWindZoneExtend = ALONG_WIND_ZONE_EXTEND,
-                                 crossWindZoneExtend = CROSS_WIND_ZONE_EXTEND,
-                                 verticalExtend = VERTICAL_EXTEND,
-                                 cadTriangles = "",
-                                 cadTreesIntersection = "",
-                                 tempoDirectory = TEMPO_DIRECTORY,
-                                 onlyInitialization = ONLY_INITIALIZATION,
-                                 maxIterations = MAX_ITERATIONS,
-                                 thresholdIterations = THRESHOLD_ITERATIONS,
-                                 idFieldBuild = idBuild,
-                                 buildingHeightField = heightBuild,
-                                 vegetationBaseHeight = baseHeightVeg,
-                                 vegetationTopHeight = topHeightVeg,
-                                 idVegetation = idVeg,
-                                 vegetationAttenuationFactor = attenuationVeg,
-                                 saveRockleZones = SAVE_ROCKLE_ZONES,
-                                 outputRaster = outputRaster,
-                                 feedback = feedback,
-                                 saveRaster = saveRaster,
-                                 saveVector = saveVector,
-                                 saveNetcdf = saveNetcdf,
-                                 z_out = z_out,
-                                 debug = DEBUG,
-                                 profileType = profileType,
-                                 verticalProfileFile = profileFile)
+        # (the state of the wind solver is saved if the calculation is canceled)
+        try:
+            u, v, w, u0, v0, w0, x, y, z, buildingCoordinates, cursor, gridName,\
+            rotationCenterCoordinates, verticalWindProfile, dicVectorTables,\
+            netcdf_path, net_cdf_path_ini = \
+                MainCalculation.main(javaEnvironmentPath = javaEnvVar,
+                                     pluginDirectory = plugin_directory,
+                                     outputFilePath = outputDirectory,
+                                     outputFilename = outputFilename,
+                                     buildingFilePath = build_file,
+                                     vegetationFilePath = veg_file,
+                                     srid = srid_build,
+                                     z_ref = z_ref,
+                                     v_ref = v_ref,
+                                     windDirection = windDirection,
+                                     prefix = prefix,
+                                     meshSize = meshSize,
+                                     dz = dz,
+                                     alongWindZoneExtend = ALONG_WIND_ZONE_EXTEND,
+                                     crossWindZoneExtend = CROSS_WIND_ZONE_EXTEND,
+                                     verticalExtend = VERTICAL_EXTEND,
+                                     cadTriangles = "",
+                                     cadTreesIntersection = "",
+                                     tempoDirectory = TEMPO_DIRECTORY,
+                                     onlyInitialization = ONLY_INITIALIZATION,
+                                     maxIterations = MAX_ITERATIONS,
+                                     thresholdIterations = THRESHOLD_ITERATIONS,
+                                     idFieldBuild = idBuild,
+                                     buildingHeightField = heightBuild,
+                                     vegetationBaseHeight = baseHeightVeg,
+                                     vegetationTopHeight = topHeightVeg,
+                                     idVegetation = idVeg,
+                                     vegetationAttenuationFactor = attenuationVeg,
+                                     saveRockleZones = SAVE_ROCKLE_ZONES,
+                                     outputRaster = outputRaster,
+                                     feedback = feedback,
+                                     saveRaster = saveRaster,
+                                     saveVector = saveVector,
+                                     saveNetcdf = saveNetcdf,
+                                     z_out = z_out,
+                                     debug = DEBUG,
+                                     profileType = profileType,
+                                     verticalProfileFile = profileFile)
+        except SolverCanceled as e:
+            feedback.pushInfo(str(e))
+            return {}
         
         # Load files into QGIS if user set it
         if loadOutput:
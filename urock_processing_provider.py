@@ -30,8 +30,16 @@ __copyright__ = '(C) 2021 by Jérémy Bernard / University of Gothenburg'
 
 __revision__ = '$Format:%H$'
 
+import threading
 from qgis.core import QgsProcessingProvider
 from .urock_processing_algorithm import URockAlgorithm
+from . import MainCalculation
+from .GlobalVariables import KERNEL_WARM_UP
+
+# The algorithms are loaded again each time the provider is refreshed while
+# the numba kernels only need to be warmed up once per session
+kernelWarmUpLock = threading.Lock()
+kernelWarmUpStarted = False
 
 
 class URockProvider(QgsProcessingProvider):
@@ -53,7 +61,15 @@ class URockProvider(QgsProcessingProvider):
         """
         Loads all algorithms belonging to this provider.
         """
+        global kernelWarmUpStarted
         self.addAlgorithm(URockAlgorithm())
+        # Compile the numba kernels in the background (loaded from the numba
+        # cache after the first session)
+        with kernelWarmUpLock:
+            if KERNEL_WARM_UP and not kernelWarmUpStarted:
+                kernelWarmUpStarted = True
+                threading.Thread(target = MainCalculation.compileKernels,
+                                 daemon = True).start()
         # add additional algorithms here
         # self.addAlgorithm(MyOtherAlgorithm())
 